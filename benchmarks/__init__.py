@@ -0,0 +1 @@
+"""Performance benchmarks of the quaac library. Run with ``python -m benchmarks.run``."""
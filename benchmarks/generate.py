@@ -0,0 +1,87 @@
+"""Generate synthetic QuAAC documents of any size for benchmarking.
+
+Documents are written one data point at a time with a :class:`~quaac.streaming.DocumentWriter`,
+so documents with millions of data points can be generated without holding them in memory.
+"""
+from __future__ import annotations
+
+import io
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, Literal
+
+from quaac import Attachment, DataPoint, Document, Equipment, User
+from quaac.streaming import DocumentWriter
+
+NAMES = ('6MV Output', '10MV Output', '6MV Symmetry', '6MV Flatness', 'CBCT HU Water', 'CBCT Uniformity', 'Laser Alignment',
+         'Couch Position', 'MLC Leaf Position', 'Door Interlock')
+
+
+@dataclass(frozen=True)
+class DocumentSpec:
+    """The shape of a synthetic document.
+
+    Attributes
+    ----------
+    datapoints : int
+        The number of data points.
+    equipment : int
+        The number of distinct pieces of primary equipment. The data points cycle through them.
+    users : int
+        The number of distinct performers. The data points cycle through them.
+    attachments : int
+        The number of distinct attachments. The first ``attachments`` data points each have one.
+    attachment_size : int
+        The size of each attachment before compression, in bytes. Half of it is random and half zeros,
+        so it compresses to a bit over half its size.
+    seed : int
+        The seed of the random values. The same spec always generates the same document.
+    """
+    datapoints: int = 1000
+    equipment: int = 10
+    users: int = 5
+    attachments: int = 10
+    attachment_size: int = 64 * 1024
+    seed: int = 0
+
+
+def iter_datapoints(spec: DocumentSpec) -> Iterator[DataPoint]:
+    """Yield the data points of a synthetic document in perform datetime order."""
+    rng = random.Random(spec.seed)
+    equipment = [Equipment(name=f'Linac {i}', type='linac', serial_number=f'SN{i:05d}', manufacturer='Varian', model='TrueBeam')
+                 for i in range(spec.equipment)]
+    users = [User(name=f'Physicist {i}', email=f'physicist{i}@clinic.org') for i in range(spec.users)]
+    start = datetime(2024, 1, 1, 7)
+    for i in range(spec.datapoints):
+        attachments = [_attachment(rng, i, spec.attachment_size)] if i < spec.attachments else []
+        yield DataPoint(
+            name=NAMES[i % len(NAMES)],
+            perform_datetime=start + timedelta(minutes=i),
+            measurement_value=round(rng.gauss(100, 0.5), 3),
+            measurement_unit='cGy',
+            reference_value=100.0,
+            performer=users[i % spec.users],
+            primary_equipment=equipment[i % spec.equipment],
+            parameters={'field size': '10x10cm', 'ssd': 100},
+            attachments=attachments,
+        )
+
+
+def _attachment(rng: random.Random, index: int, size: int) -> Attachment:
+    random_part = size // 2
+    content = rng.getrandbits(8 * random_part).to_bytes(random_part, 'little') if random_part else b''
+    return Attachment.from_stream(io.BytesIO(content + bytes(size - random_part)), name=f'image_{index}.dcm')
+
+
+def generate_document(spec: DocumentSpec) -> Document:
+    """A synthetic document held in memory."""
+    return Document(datapoints=list(iter_datapoints(spec)))
+
+
+def write_document(spec: DocumentSpec, path: str | Path, format: Literal['json', 'yaml'] = 'json') -> Path:
+    """Write a synthetic document to a file without holding it in memory."""
+    with DocumentWriter(path, format=format) as writer:
+        writer.write_many(iter_datapoints(spec))
+    return Path(path)
@@ -0,0 +1,227 @@
+"""Time and measure the peak memory of the main operations of the library on synthetic documents.
+
+.. code-block:: bash
+
+    python -m benchmarks.run --sizes 1000 10000 100000 --attachments 100
+    python -m benchmarks.run --sizes 1000 10000 --save-baseline
+    python -m benchmarks.run --sizes 1000 10000 --check
+
+Each benchmark is timed ``--repeat`` times and the fastest time is kept. It is then run once more under
+:mod:`tracemalloc` to record the peak memory allocated by Python while it runs, not counting its setup.
+Benchmarks of operations whose results are cached on their inputs, e.g. hashes, are given fresh inputs
+for each run (see :class:`Fresh`), so that every run is timed cold.
+Results are compared with the baseline, if there is one, and written to ``--output`` as JSON.
+Baselines depend on the hardware; save one on the machine you compare against.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, replace
+from pathlib import Path
+from typing import Any, Callable, Union
+
+from quaac import Document
+from quaac.version import version
+
+from .generate import DocumentSpec, generate_document, write_document
+
+BASELINE = Path(__file__).parent / 'baseline.json'
+# a result is a regression if it is this much slower or bigger than the baseline
+TOLERANCE = 0.25
+
+
+@dataclass(frozen=True)
+class Fresh:
+    """A benchmark that is given fresh inputs for each run. ``setup`` is called before each run and isn't timed;
+    ``func`` is timed when called with its result."""
+    setup: Callable[[], Any]
+    func: Callable[[Any], object]
+
+
+Benchmark = Union[Callable[[], object], Fresh]
+
+
+def _file(spec: DocumentSpec, directory: Path, format: str) -> Path:
+    """The synthetic document of the spec in the given format, generated once per run."""
+    path = directory / f"{spec.datapoints}-{spec.equipment}-{spec.users}-{spec.attachments}-{spec.attachment_size}-{spec.seed}.{format}"
+    if not path.exists():
+        write_document(spec, path, format=format)
+    return path
+
+
+def bench_from_json_file(spec: DocumentSpec, directory: Path) -> Callable[[], object]:
+    path = str(_file(spec, directory, 'json'))
+    return lambda: Document.from_json_file(path)
+
+
+def bench_to_json_file(spec: DocumentSpec, directory: Path) -> Callable[[], object]:
+    doc = generate_document(spec)
+    return lambda: doc.to_json_file(str(directory / 'out.json'))
+
+
+def bench_yaml_round_trip(spec: DocumentSpec, directory: Path) -> Callable[[], object]:
+    doc = generate_document(spec)
+    path = str(directory / 'out.yaml')
+
+    def run():
+        doc.to_yaml_file(path)
+        return Document.from_yaml_file(path)
+    return run
+
+
+def bench_merge(spec: DocumentSpec, directory: Path) -> Fresh:
+    # two documents that share half of their data points
+    half = replace(spec, datapoints=spec.datapoints // 2)
+    first, second = generate_document(half), generate_document(replace(half, seed=spec.seed + 1))
+    second = Document(datapoints=first.datapoints[len(first.datapoints) // 2:] + second.datapoints)
+    paths = [str(_file(half, directory, 'json')), str(directory / f'merge-{spec.datapoints}.json')]
+    second.to_json_file(paths[1])
+    # merging hashes the data points, and the hashes are cached on them, so each run merges documents loaded
+    # without hashing rather than the same documents again
+    return Fresh(lambda: [Document.from_json_file(path, check_hash=False) for path in paths],
+                 lambda documents: documents[0].merge(documents[1:]))
+
+
+def bench_merge_files(spec: DocumentSpec, directory: Path) -> Callable[[], object]:
+    half = replace(spec, datapoints=spec.datapoints // 2)
+    paths = [_file(half, directory, 'json'), _file(replace(half, seed=spec.seed + 1), directory, 'json')]
+    return lambda: Document.merge_files(paths, directory / 'merged.json')
+
+
+def bench_verify(spec: DocumentSpec, directory: Path) -> Callable[[], object]:
+    doc = Document.from_json_file(str(_file(spec, directory, 'json')), check_hash='deferred')
+    # verify() recomputes every hash each time it is called
+    return doc.verify
+
+
+def bench_attachment_to_file(spec: DocumentSpec, directory: Path) -> Callable[[], object] | None:
+    if not spec.attachments:
+        return None
+    attachments = list(generate_document(replace(spec, datapoints=spec.attachments)).attachments)
+    output = directory / 'attachments'
+    output.mkdir(exist_ok=True)
+
+    def run():
+        for i, attachment in enumerate(attachments):
+            attachment.to_file(str(output / f'{i}.dcm'))
+    return run
+
+
+# each benchmark does its setup and returns the function to measure, or None if it doesn't apply to the spec
+BENCHMARKS: dict[str, Callable[[DocumentSpec, Path], Benchmark | None]] = {
+    'from_json_file': bench_from_json_file,
+    'to_json_file': bench_to_json_file,
+    'yaml_round_trip': bench_yaml_round_trip,
+    'merge': bench_merge,
+    'merge_files': bench_merge_files,
+    'verify': bench_verify,
+    'attachment_to_file': bench_attachment_to_file,
+}
+
+
+def measure(benchmark: Benchmark, repeat: int = 3) -> dict[str, float]:
+    """The fastest time of ``repeat`` calls, in seconds, and the peak memory allocated by one call, in MiB."""
+    if not isinstance(benchmark, Fresh):
+        func = benchmark
+        benchmark = Fresh(lambda: None, lambda _: func())
+    times = []
+    for _ in range(repeat):
+        inputs = benchmark.setup()
+        start = time.perf_counter()
+        benchmark.func(inputs)
+        times.append(time.perf_counter() - start)
+    inputs = benchmark.setup()
+    tracemalloc.start()
+    try:
+        benchmark.func(inputs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(times), 'peak_mib': peak / 2 ** 20}
+
+
+def run_benchmarks(sizes: list[int], spec: DocumentSpec = DocumentSpec(), names: list[str] | None = None, repeat: int = 3,
+                   log: Callable[[str], None] = print) -> dict:
+    """Run the benchmarks for documents of each size.
+
+    Returns the results, keyed by ``'<benchmark>/<datapoints>'``, with the spec and the environment they were run in.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            sized = replace(spec, datapoints=size)
+            for name in names or BENCHMARKS:
+                benchmark = BENCHMARKS[name](sized, Path(directory))
+                if benchmark is None:
+                    continue
+                results[f'{name}/{size}'] = result = measure(benchmark, repeat)
+                log(f"{name}/{size}: {result['seconds']:.4f} s, {result['peak_mib']:.1f} MiB")
+    return {'environment': environment(), 'spec': {k: v for k, v in asdict(spec).items() if k != 'datapoints'}, 'results': results}
+
+
+def environment() -> dict[str, str]:
+    """The versions and machine the benchmarks are run on."""
+    import pydantic
+    return {'quaac': version, 'python': platform.python_version(), 'pydantic': pydantic.VERSION,
+            'platform': platform.platform(), 'processor': platform.processor() or platform.machine()}
+
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list[str]:
+    """The results that are more than ``tolerance`` slower or bigger than the baseline, as messages."""
+    regressions = []
+    if results['spec'] != baseline['spec']:
+        return [f"The baseline was run with a different spec: {baseline['spec']}"]
+    for key, result in results['results'].items():
+        reference = baseline['results'].get(key)
+        if reference is None:
+            continue
+        for metric in ('seconds', 'peak_mib'):
+            # very small values are too noisy to compare
+            if reference[metric] > 1e-3 and result[metric] > reference[metric] * (1 + tolerance):
+                regressions.append(f"{key} {metric}: {result[metric]:.4f} vs {reference[metric]:.4f} in the baseline")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    defaults = DocumentSpec()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help="The numbers of data points.")
+    parser.add_argument('--equipment', type=int, default=defaults.equipment)
+    parser.add_argument('--users', type=int, default=defaults.users)
+    parser.add_argument('--attachments', type=int, default=defaults.attachments)
+    parser.add_argument('--attachment-size', type=int, default=defaults.attachment_size, help="In bytes.")
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help="Only run these benchmarks.")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', type=Path, default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="Save the results as the baseline.")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--check', action='store_true', help="Exit with status 1 if there are regressions.")
+    parser.add_argument('--output', type=Path, help="Write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    spec = DocumentSpec(equipment=args.equipment, users=args.users, attachments=args.attachments,
+                        attachment_size=args.attachment_size, seed=args.seed)
+    results = run_benchmarks(args.sizes, spec, args.only, args.repeat)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2))
+        print(f"Saved the baseline to {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        return 0
+    regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions and args.check else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""Helpers to run the blocking file I/O and CPU-heavy work of the library from asyncio code.
+
+The ``a``-prefixed methods, e.g. :meth:`Document.aload_json <quaac.models.Document.aload_json>` and
+:meth:`Attachment.afrom_file <quaac.attachments.Attachment.afrom_file>`, run their blocking counterparts in an executor
+with :func:`run_blocking` so the event loop is free while they run. Use :func:`amap` to fan out over many files with bounded concurrency.
+
+.. code-block:: python
+
+    from quaac.aio import amap
+
+    documents = await amap(Document.aload_json, paths, limit=4)
+"""
+from __future__ import annotations
+
+from contextvars import copy_context
+from functools import partial
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Iterable, TypeVar
+
+if TYPE_CHECKING:
+    import asyncio
+    from concurrent.futures import Executor
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+# the number of calls amap() runs at once by default
+DEFAULT_LIMIT = 4
+
+
+async def run_blocking(func: Callable[..., R], *args: Any, executor: Executor | None = None, **kwargs: Any) -> R:
+    """Call a blocking function in an executor and wait for the result without blocking the event loop.
+
+    The function runs in a copy of the caller's context, so that e.g. the :func:`~quaac.common.hash_scheme`
+    and :func:`~quaac.stats.collect_stats` of the caller apply.
+
+    Parameters
+    ----------
+    func : callable
+        The function to call with ``args`` and ``kwargs``.
+    executor : Executor | None
+        The executor to run the function in. If None, the event loop's default thread pool is used.
+        Pass a dedicated executor to keep large batches from occupying the default pool.
+    """
+    import asyncio  # already imported by the running event loop; not imported with quaac as it is slow to import
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(copy_context().run, func, *args, **kwargs))
+
+
+async def amap(func: Callable[[T], Awaitable[R]], items: Iterable[T], limit: int | asyncio.Semaphore | None = DEFAULT_LIMIT,
+               return_exceptions: bool = False) -> list[R]:
+    """Await a coroutine function for each item with at most ``limit`` running at once and return the results in input order.
+
+    Parameters
+    ----------
+    func : callable
+        A coroutine function called with each item, e.g. :meth:`Document.aload_json <quaac.models.Document.aload_json>`.
+    items : iterable
+        The items, e.g. file paths.
+    limit : int | asyncio.Semaphore | None
+        The number of calls that may run at once. Pass a semaphore to share the limit between several calls, e.g.
+        across the requests of a service. If None, all calls run at once.
+    return_exceptions : bool
+        If True, the exception of each failed call is returned in its place. If False, the first exception is raised
+        and the calls that haven't started are cancelled.
+    """
+    import asyncio
+    semaphore = asyncio.Semaphore(limit) if isinstance(limit, int) else limit
+
+    async def call(item: T) -> R:
+        if semaphore is None:
+            return await func(item)
+        async with semaphore:
+            return await func(item)
+
+    tasks = [asyncio.ensure_future(call(item)) for item in items]
+    try:
+        return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
+    except BaseException:
+        # the calls that are still waiting for their turn are not started
+        for task in tasks:
+            task.cancel()
+        raise
@@ -1,23 +1,258 @@
 from __future__ import annotations
 
 import base64
-import gzip
+import bz2
+import itertools
+import lzma
+import mmap
+import shutil
+import zlib
+from contextvars import copy_context
+from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
+from typing import TYPE_CHECKING, Any, BinaryIO, Callable, Iterable, Iterator
 
-from pydantic import ConfigDict, Field
+from pydantic import ConfigDict, Field, PrivateAttr, SerializationInfo, model_serializer
 
-from .common import HashModel
+from .aio import DEFAULT_LIMIT, amap, run_blocking
+from .common import LEGACY_HASH_SCHEME, HashModel, get_hash_scheme, new_hasher, stream_placeholder
+from .stats import phase
+
+if TYPE_CHECKING:
+    import asyncio
+    from concurrent.futures import Executor
+
+CHUNK_SIZE = 1024 * 1024
+AUTO_COMPRESSION = 'auto'
+# the number of bytes sampled by compression='auto' and the smallest saving worth compressing for
+AUTO_SAMPLE_SIZE = 64 * 1024
+AUTO_MIN_SAVING = 0.1
+# the signatures of formats that are already compressed and won't shrink further
+COMPRESSED_SIGNATURES = (
+    b'\x89PNG\r\n\x1a\n',  # png
+    b'\xff\xd8\xff',  # jpeg
+    b'GIF87a', b'GIF89a',  # gif
+    b'PK\x03\x04', b'PK\x05\x06',  # zip, docx, xlsx, etc.
+    b'\x1f\x8b',  # gzip
+    b'BZh',  # bz2
+    b'\xfd7zXZ\x00',  # xz
+    b'\x28\xb5\x2f\xfd',  # zstd
+    b'7z\xbc\xaf\x27\x1c',  # 7z
+    b'Rar!\x1a\x07',  # rar
+)
+
+
+class StreamCodec:
+    """An incremental transform of a byte stream, e.g. compression or encoding, applied one chunk at a time."""
+
+    def update(self, data: bytes) -> bytes:
+        """Transform the next chunk. The output may be held back until more data or :meth:`flush`."""
+        raise NotImplementedError
+
+    def flush(self) -> bytes:
+        """Return any remaining output once all the data has been passed to :meth:`update`."""
+        return b''
+
+
+class PassthroughCodec(StreamCodec):
+    """Leaves the data as-is."""
+
+    def update(self, data: bytes) -> bytes:
+        return bytes(data)
+
+
+class CompressorCodec(StreamCodec):
+    """Wraps a compression object with ``compress`` and ``flush`` methods, e.g. :func:`zlib.compressobj` or :class:`lzma.LZMACompressor`."""
+
+    def __init__(self, compressor):
+        self._compressor = compressor
+
+    def update(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+class DecompressorCodec(StreamCodec):
+    """Wraps decompression objects with ``decompress``, ``eof``, and ``unused_data``, e.g. :func:`zlib.decompressobj`
+    or :class:`lzma.LZMADecompressor`. Data made of several concatenated streams is decompressed in full.
+
+    Parameters
+    ----------
+    factory : callable
+        Creates a new decompression object for each stream.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._decompressor = factory()
+
+    def update(self, data: bytes) -> bytes:
+        output = []
+        while data:
+            output.append(self._decompressor.decompress(data))
+            data = b''
+            if self._decompressor.eof:
+                data = self._decompressor.unused_data
+                self._decompressor = self._factory()
+        return b''.join(output)
+
+    def flush(self) -> bytes:
+        flush = getattr(self._decompressor, 'flush', None)
+        return flush() if flush else b''
+
+
+class Base64Encoder(StreamCodec):
+    """Base64 encoding. Input is encoded in multiples of 3 bytes so that no padding appears mid-stream."""
+
+    def __init__(self):
+        self._pending = b''
+
+    def update(self, data: bytes) -> bytes:
+        data = self._pending + bytes(data)
+        cut = len(data) - len(data) % 3
+        self._pending = data[cut:]
+        return base64.b64encode(data[:cut])
+
+    def flush(self) -> bytes:
+        pending, self._pending = self._pending, b''
+        return base64.b64encode(pending)
+
+
+class Base64Decoder(StreamCodec):
+    """Base64 decoding. Input is decoded in multiples of 4 characters; whitespace is ignored."""
+
+    def __init__(self):
+        self._pending = b''
+
+    def update(self, data: bytes) -> bytes:
+        data = self._pending + bytes(data).translate(None, b' \t\r\n')
+        cut = len(data) - len(data) % 4
+        self._pending = data[cut:]
+        return base64.b64decode(data[:cut])
+
+    def flush(self) -> bytes:
+        pending, self._pending = self._pending, b''
+        return base64.b64decode(pending)
+
+
+def _compression(name: str | None, compressor: Callable[[int | None], StreamCodec], decompressor: Callable[[], StreamCodec]) -> dict:
+    """Describe a compression by its incremental codecs. The one-shot functions are built from them
+    so that one-shot and chunked output are always identical."""
+
+    def compress(data: bytes, level: int | None = None) -> bytes:
+        codec = compressor(level)
+        return codec.update(data) + codec.flush()
+
+    def decompress(data: bytes) -> bytes:
+        codec = decompressor()
+        return codec.update(data) + codec.flush()
+
+    return {'compression': name, 'compress': compress, 'decompress': decompress, 'compressor': compressor, 'decompressor': decompressor}
+
+
+def _zstd_module():
+    """The zstd implementation of the interpreter (Python 3.14+) or the ``zstandard`` package, if either is available."""
+    try:
+        from compression import zstd
+        return zstd
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+
+def _zstd_compression() -> dict | None:
+    zstd = _zstd_module()
+    if zstd is None:
+        return None
+    if hasattr(zstd, 'ZstdCompressor') and hasattr(zstd.ZstdCompressor, 'compressobj'):
+        # the zstandard package
+        return _compression('zstd', lambda level=None: CompressorCodec(zstd.ZstdCompressor(level=3 if level is None else level).compressobj()),
+                            lambda: DecompressorCodec(lambda: zstd.ZstdDecompressor().decompressobj()))
+    return _compression('zstd', lambda level=None: CompressorCodec(zstd.ZstdCompressor(level=3 if level is None else level)),
+                        lambda: DecompressorCodec(zstd.ZstdDecompressor))
 
 
 class Compression:
     """Compression algorithms supported by QuAACS.
 
-    GZIP: Gzip compression.
+    GZIP: Gzip compression. Levels 0-9; the default is 9. The modification time is fixed at zero
+    so that the same content always compresses to the same bytes (and hash).
+    ZLIB: Zlib (deflate) compression. Levels 0-9; the default is 6.
+    XZ: LZMA compression in the xz container. Presets 0-9; the default is 6. Slow, but compresses the most.
+    BZ2: Bzip2 compression. Levels 1-9; the default is 9.
+    ZSTD: Zstandard compression. Levels 1-22; the default is 3. Very fast. Only available if the interpreter provides
+    ``compression.zstd`` (Python 3.14+) or the ``zstandard`` package is installed; otherwise None.
     NONE: No compression.
+
+    Other compressions can be added with :func:`register_compression`.
+    """
+
+    GZIP = _compression('gzip', lambda level=None: CompressorCodec(zlib.compressobj(9 if level is None else level, zlib.DEFLATED, 31)),
+                        lambda: DecompressorCodec(lambda: zlib.decompressobj(31)))
+    ZLIB = _compression('zlib', lambda level=None: CompressorCodec(zlib.compressobj(6 if level is None else level)),
+                        lambda: DecompressorCodec(zlib.decompressobj))
+    XZ = _compression('xz', lambda level=None: CompressorCodec(lzma.LZMACompressor(lzma.FORMAT_XZ, preset=level)),
+                      lambda: DecompressorCodec(lzma.LZMADecompressor))
+    BZ2 = _compression('bz2', lambda level=None: CompressorCodec(bz2.BZ2Compressor(9 if level is None else level)),
+                       lambda: DecompressorCodec(bz2.BZ2Decompressor))
+    ZSTD = _zstd_compression()
+    NONE = _compression(None, lambda level=None: PassthroughCodec(), PassthroughCodec)
+
+
+COMPRESSIONS: dict[str | None, dict] = {c['compression']: c for c in (Compression.GZIP, Compression.ZLIB, Compression.XZ, Compression.BZ2, Compression.ZSTD, Compression.NONE) if c is not None}
+
+
+def register_compression(name: str, compressor: Callable[[int | None], StreamCodec], decompressor: Callable[[], StreamCodec]) -> dict:
+    """Register a compression so that attachments can be written and read with it by name.
+
+    Parameters
+    ----------
+    name : str
+        The name stored in the ``compression`` field of attachments.
+    compressor : callable
+        Creates a new :class:`StreamCodec` that compresses a stream. Called with the compression level, or None for the default.
+    decompressor : callable
+        Creates a new :class:`StreamCodec` that decompresses a stream.
+    """
+    COMPRESSIONS[name] = _compression(name, compressor, decompressor)
+    return COMPRESSIONS[name]
+
+
+def choose_compression(sample: bytes, compression: str | None = 'gzip', min_saving: float = AUTO_MIN_SAVING) -> str | None:
+    """Choose whether to compress content based on a sample of its start. This is what ``compression='auto'`` uses.
+
+    Content in a format that is already compressed (PNG, JPEG, ZIP, etc.) is left uncompressed. Otherwise, the sample is
+    trial-compressed at the fastest level and the content is only compressed if that saves at least ``min_saving`` of the size.
+
+    Parameters
+    ----------
+    sample : bytes
+        The start of the content, e.g. the first :data:`AUTO_SAMPLE_SIZE` bytes.
+    compression : str | None
+        The compression to use if compressing is worthwhile.
+    min_saving : float
+        The smallest fraction of the size that compression must save.
     """
+    if not sample or sample.startswith(COMPRESSED_SIGNATURES):
+        return None
+    trial = Compression.ZLIB['compress'](sample, level=1)
+    if len(trial) > len(sample) * (1 - min_saving):
+        return None
+    return compression
 
-    GZIP = {'compression': 'gzip', 'compress': gzip.compress, 'decompress': gzip.decompress}
-    NONE = {'compression': None, 'compress': lambda x: x, 'decompress': lambda x: x}
+
+def _get_compression(compression: str | None) -> dict:
+    try:
+        return COMPRESSIONS[compression]
+    except KeyError:
+        raise ValueError(f"Unsupported compression: {compression}") from None
 
 
 class Encoding:
@@ -26,7 +261,8 @@ class Encoding:
     BASE64: Base64 encoding.
     """
 
-    BASE64 = {'encoding': 'base64', 'encoder': base64.b64encode, 'decoder': base64.b64decode}
+    BASE64 = {'encoding': 'base64', 'encoder': base64.b64encode, 'decoder': base64.b64decode,
+              'stream_encoder': Base64Encoder, 'stream_decoder': Base64Decoder}
 
 
 def get_decoder(encoding: str):
@@ -37,24 +273,14 @@ def get_decoder(encoding: str):
         raise ValueError(f"Unsupported encoding: {encoding}")
 
 
-def get_compressor(compression: str | None):
-    """Get the compression function for the given compression."""
-    if compression == Compression.GZIP['compression']:
-        return Compression.GZIP['compress']
-    elif compression is None:
-        return Compression.NONE['compress']
-    else:
-        raise ValueError(f"Unsupported compression: {compression}")
+def get_compressor(compression: str | None, level: int | None = None):
+    """Get the compression function for the given compression and level. If the level is None, the compression's default is used."""
+    return partial(_get_compression(compression)['compress'], level=level)
 
 
 def get_decompresser(compression: str):
     """Get the compression function for the given compression."""
-    if compression == Compression.GZIP['compression']:
-        return Compression.GZIP['decompress']
-    elif compression is None:
-        return Compression.NONE['decompress']
-    else:
-        raise ValueError(f"Unsupported compression: {compression}")
+    return _get_compression(compression)['decompress']
 
 
 def get_encoder(encoding: str) -> callable:
@@ -65,6 +291,165 @@ def get_encoder(encoding: str) -> callable:
         raise ValueError(f"Unsupported encoding: {encoding}")
 
 
+def get_stream_compressor(compression: str | None, level: int | None = None) -> StreamCodec:
+    """Get a new incremental compressor for the given compression and level."""
+    return _get_compression(compression)['compressor'](level)
+
+
+def get_stream_decompresser(compression: str | None) -> StreamCodec:
+    """Get a new incremental decompressor for the given compression."""
+    return _get_compression(compression)['decompressor']()
+
+
+def get_stream_encoder(encoding: str) -> StreamCodec:
+    """Get a new incremental encoder for the given encoding."""
+    if encoding == Encoding.BASE64['encoding']:
+        return Encoding.BASE64['stream_encoder']()
+    else:
+        raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def get_stream_decoder(encoding: str) -> StreamCodec:
+    """Get a new incremental decoder for the given encoding."""
+    if encoding == Encoding.BASE64['encoding']:
+        return Encoding.BASE64['stream_decoder']()
+    else:
+        raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def iter_chunks(f: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Read a binary file object in chunks."""
+    while chunk := f.read(chunk_size):
+        yield chunk
+
+
+def encode_stream(chunks: Iterable[bytes], compression: str | None = 'gzip', encoding: str = 'base64', level: int | None = None) -> Iterator[bytes]:
+    """Compress and then encode a stream of raw chunks, one chunk at a time."""
+    compressor = get_stream_compressor(compression, level)
+    encoder = get_stream_encoder(encoding)
+    for chunk in chunks:
+        encoded = encoder.update(compressor.update(chunk))
+        if encoded:
+            yield encoded
+    yield encoder.update(compressor.flush()) + encoder.flush()
+
+
+def decode_stream(chunks: Iterable[bytes], compression: str | None = 'gzip', encoding: str = 'base64') -> Iterator[bytes]:
+    """Decode and then decompress a stream of encoded chunks, one chunk at a time."""
+    decoder = get_stream_decoder(encoding)
+    decompressor = get_stream_decompresser(compression)
+    for chunk in chunks:
+        decoded = decompressor.update(decoder.update(chunk))
+        if decoded:
+            yield decoded
+    yield decompressor.update(decoder.flush()) + decompressor.flush()
+
+
+class BulkAttachmentError(ValueError):
+    """Raised when some of the files of a bulk attachment operation fail. The others are still processed.
+
+    Attributes
+    ----------
+    errors : dict
+        The error of each failed item (e.g. the path), in input order.
+    results : list
+        The result of each item, in input order. None for the items that failed.
+    """
+
+    def __init__(self, errors: dict[Any, Exception], results: list):
+        self.errors = errors
+        self.results = results
+        details = '; '.join(f"{item}: {error}" for item, error in errors.items())
+        super().__init__(f"{len(errors)} of {len(results)} attachments failed. {details}")
+
+
+def map_in_threads(func: Callable[[Any], Any], items: Iterable, workers: int | None = None) -> list:
+    """Call a function on each item in a thread pool and return the results in input order.
+
+    Compression, decompression, and base64 release the GIL on large buffers, so attachments are processed in parallel.
+
+    Parameters
+    ----------
+    func : callable
+        Called with each item.
+    items : iterable
+        The items, e.g. file paths.
+    workers : int | None
+        The number of threads. If None, the :class:`~concurrent.futures.ThreadPoolExecutor` default is used.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    items = list(items)
+    results, errors = [None] * len(items), {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # each call runs in a copy of the caller's context, so that e.g. the hash scheme and stats carry over
+        futures = [executor.submit(copy_context().run, func, item) for item in items]
+        for i, (item, future) in enumerate(zip(items, futures)):
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                errors[item] = e
+    if errors:
+        raise BulkAttachmentError(errors, results)
+    return results
+
+
+class AttachmentSource:
+    """Where the encoded content of a lazy attachment is read from."""
+
+    def iter_encoded(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Yield the encoded content in chunks."""
+        raise NotImplementedError
+
+    def read_encoded(self) -> bytes:
+        """The whole encoded content."""
+        return b''.join(self.iter_encoded())
+
+    def digest(self, scheme: str = LEGACY_HASH_SCHEME) -> str:
+        """The digest of the encoded content with the algorithm of the given hash scheme; MD5 by default."""
+        hasher = new_hasher(scheme)
+        for chunk in self.iter_encoded():
+            hasher.update(chunk)
+        return hasher.hexdigest()
+
+
+@dataclass(frozen=True)
+class FileSource(AttachmentSource):
+    """A file on disk that is memory-mapped, compressed, and encoded each time the content is needed."""
+    path: Path
+    compression: str | None = 'gzip'
+    encoding: str = 'base64'
+    level: int | None = None
+
+    def iter_encoded(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        with open(self.path, 'rb') as f:
+            if not Path(self.path).stat().st_size:
+                # empty files can't be memory-mapped
+                yield from encode_stream([], self.compression, self.encoding, self.level)
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                chunks = (mm[start:start + chunk_size] for start in range(0, len(mm), chunk_size))
+                yield from encode_stream(chunks, self.compression, self.encoding, self.level)
+
+
+@dataclass(frozen=True)
+class ByteRangeSource(AttachmentSource):
+    """Already-encoded content stored as a byte range of a file, e.g. the content string of an attachment in a QuAAC JSON document."""
+    path: Path
+    offset: int
+    length: int
+
+    def iter_encoded(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            remaining = self.length
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise ValueError(f"{self.path} is shorter than the attachment content it should contain.")
+                remaining -= len(chunk)
+                yield chunk
+
+
 class Attachment(HashModel, validate_assignment=True):
     """A binary file that relates to a data point. This could be a screenshot, DICOM data set, or a PDF."""
     model_config = ConfigDict(title="Attachment", frozen=True, str_strip_whitespace=True, extra='allow', populate_by_name=True)
@@ -75,6 +460,99 @@ class Attachment(HashModel, validate_assignment=True):
     # we don't use a pydantic encoder here because we use the other field values to determine the encoding and compression
     # that isn't possible within a pydantic encoder
     content: bytes = Field(title="Content", description="The content of the file.", examples=["b'H4sIAAAAAAAAA...'"])
+    _source: AttachmentSource | None = PrivateAttr(default=None)
+
+    def __getattr__(self, item: str) -> Any:
+        # lazy attachments have no content in their __dict__; it is read from the source on every access
+        if item == 'content' and self._source is not None:
+            return self._source.read_encoded()
+        return super().__getattr__(item)
+
+    @property
+    def is_lazy(self) -> bool:
+        """Whether the content is read from a source file on demand rather than held in memory."""
+        return self._source is not None
+
+    @model_serializer(mode='wrap')
+    def serialize_lazy_content(self, handler, info: SerializationInfo) -> dict:
+        """Add the content of lazy attachments, which pydantic skips as it isn't in the model's __dict__.
+        Inside :func:`~quaac.common.streamed_values` the content is a placeholder that is streamed in later."""
+        data = handler(self)
+        if self._source is None or 'content' in (info.exclude or ()) or (info.include is not None and 'content' not in info.include):
+            return data
+        source = self._source
+        content = stream_placeholder(lambda: (chunk.decode('utf-8') for chunk in source.iter_encoded()))
+        if content is None:
+            content = source.read_encoded()
+            if info.mode_is_json():
+                content = content.decode('utf-8')
+        # keep the field order of a regular attachment
+        fields = list(data.items())
+        position = next((i for i, (key, _) in enumerate(fields) if key == 'compression'), len(fields) - 1) + 1
+        fields.insert(position, ('content', content))
+        return dict(fields)
+
+    def _merkle_children(self) -> dict:
+        """The content of lazy attachments is digested as it is read from the source."""
+        children = super()._merkle_children()
+        if self._source is not None:
+            children['content'] = self._source.digest(self._hash_scheme or get_hash_scheme())
+        return children
+
+    @classmethod
+    def from_source(cls, source: AttachmentSource, from_file_hash: str | None = None, **fields: Any) -> Attachment:
+        """Create a lazy attachment whose content is read from the given source whenever it is needed.
+
+        .. warning:: The source file must not change or move for the lifetime of the attachment.
+
+        Parameters
+        ----------
+        source : AttachmentSource
+            Where the encoded content is read from.
+        from_file_hash : str | None
+            The hash the attachment was saved with. If given, it is checked against the hash of the content.
+        fields
+            The other fields of the attachment, e.g. name, comment, encoding, and compression.
+        """
+        # validate the other fields with placeholder content and then swap the content for the source
+        attachment = cls.model_validate({**fields, 'content': b''})
+        del attachment.__dict__['content']
+        attachment.__dict__.pop('hash', None)
+        attachment.__dict__['from_file_hash'] = from_file_hash
+        attachment._source = source
+        return attachment.check_hash()
+
+    def iter_encoded(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Yield the encoded content in chunks, without reading all of a lazy attachment's content at once."""
+        if self._source is not None:
+            yield from self._source.iter_encoded(chunk_size)
+            return
+        content = self.__dict__['content']
+        for start in range(0, len(content), chunk_size):
+            yield content[start:start + chunk_size]
+
+    def iter_decoded(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Yield the content with its encoding removed, but still compressed, one chunk at a time."""
+        decoder = get_stream_decoder(self.encoding)
+        for chunk in self.iter_encoded(chunk_size):
+            decoded = decoder.update(chunk)
+            if decoded:
+                yield decoded
+        yield decoder.flush()
+
+    def to_stream(self, f: BinaryIO, chunk_size: int = CHUNK_SIZE) -> None:
+        """Decode and decompress the content into a binary file object, one chunk at a time.
+
+        Parameters
+        ----------
+        f : file-like
+            A binary file object opened for writing.
+        chunk_size : int
+            The size of the encoded chunks that are decoded at a time.
+        """
+        with phase('attachment.decode', objects=1) as p:
+            for chunk in p.counted(decode_stream(self.iter_encoded(chunk_size), self.compression, self.encoding)):
+                f.write(chunk)
 
     def to_file(self, path: str | None = None) -> None:
         """Write the content of an attachment to a file on disk.
@@ -85,17 +563,63 @@ class Attachment(HashModel, validate_assignment=True):
             The path to write the file to. If None, the name of the file in the document will be used and
             will be written to the current working directory.
         """
-        decoder = get_decoder(self.encoding)
-        decompressor = get_decompresser(self.compression)
-        # Decode and decompress the content
-        decoded_content = decoder(self.content)
-        decomp_content = decompressor(decoded_content)
         path = path or self.name
+        if isinstance(self._source, FileSource):
+            # the content is the source file itself; there's no need to encode and decode it again
+            if Path(path).absolute() != Path(self._source.path).absolute():
+                shutil.copyfile(self._source.path, path)
+            return
         with open(path, 'wb') as f:
-            f.write(decomp_content)
+            self.to_stream(f)
+
+    async def ato_file(self, path: str | Path | None = None, executor: Executor | None = None) -> None:
+        """Write the content of the attachment to a file without blocking the event loop. See :meth:`to_file`.
+
+        Parameters
+        ----------
+        path : str or Path, optional
+            The path to write the file to. If None, the name of the attachment is used.
+        executor : Executor | None
+            The executor to decode and write the file in. If None, the event loop's default thread pool is used.
+        """
+        await run_blocking(self.to_file, path, executor=executor)
+
+    @classmethod
+    def from_stream(cls, f: BinaryIO, name: str, type: str | None = None, comment: str = '', compression: str | None = 'gzip', encoding: str = 'base64', chunk_size: int = CHUNK_SIZE, compression_level: int | None = None) -> Attachment:
+        """Load an attachment from a binary file object, compressing and encoding it one chunk at a time.
+
+        Only the encoded content and a single chunk are held in memory.
+
+        Parameters
+        ----------
+        f : file-like
+            A binary file object opened for reading.
+        name : str
+            The name of the file.
+        type : str | None
+            The type of the file. E.g. png, json, zip, etc. If None, the extension of the name will be used.
+        comment : str
+            A comment about the file.
+        compression : str | None
+            The compression to use when serializing the file. See :meth:`from_file`.
+        encoding : str
+            The encoding to use when serializing the file. See :meth:`from_file`.
+        chunk_size : int
+            The number of bytes to read from the file object at a time.
+        compression_level : int | None
+            The compression level. See :meth:`from_file`.
+        """
+        chunks = iter_chunks(f, chunk_size)
+        if compression == AUTO_COMPRESSION:
+            sample = f.read(AUTO_SAMPLE_SIZE)
+            compression = choose_compression(sample)
+            chunks = itertools.chain([sample], chunks)
+        with phase('attachment.encode', objects=1) as p:
+            content = b''.join(encode_stream(p.counted(chunks), compression, encoding, compression_level))
+        return Attachment(name=name, type=type or Path(name).suffix.replace('.', ''), encoding=encoding, comment=comment, compression=compression, content=content)
 
     @classmethod
-    def from_file(cls, path: str | Path, name: str | None = None, type: str | None = None, comment: str = '', compression: str | None = 'gzip', encoding: str = 'base64') -> Attachment:
+    def from_file(cls, path: str | Path, name: str | None = None, type: str | None = None, comment: str = '', compression: str | None = 'gzip', encoding: str = 'base64', lazy: bool = False, compression_level: int | None = None) -> Attachment:
         """Load a file from disk into an attachment.
 
         Parameters
@@ -110,8 +634,10 @@ class Attachment(HashModel, validate_assignment=True):
         comment : str
             A comment about the file.
         compression : str | None
-            The compression to use when serializing the file. Default is 'gzip'.
-            If None, no compression will be used.
+            The compression to use when serializing the file. Default is 'gzip'. See :class:`Compression` for the options.
+            If None, no compression will be used. The compression is recorded on the attachment, so readers decompress it automatically.
+            If 'auto', the file is gzipped only if it is not already in a compressed format (PNG, JPEG, ZIP, etc.)
+            and a sample of it compresses well; the compression actually applied is recorded. See :func:`choose_compression`.
 
             .. note:: This is not saying that the file is ALREADY compressed. This is the compression that **will** be applied when serializing the file.
 
@@ -119,13 +645,89 @@ class Attachment(HashModel, validate_assignment=True):
             The encoding to use when serializing the file. Default is 'base64'.
 
             .. note:: This is not saying that the file is ALREADY encoded. This is the encoding that **will** be applied when serializing the file.
+
+        lazy : bool
+            If True, the file is not read now. Its content is compressed and encoded from the file each time
+            it is needed, e.g. when hashing or serializing, and is never held by the attachment.
+            The file must not change or move while the attachment is in use.
+        compression_level : int | None
+            The compression level, e.g. 1 for fast gzip. If None, the compression's default is used. See :class:`Compression`.
         """
         path = Path(path)  # force-convert to Path
+        type = type or path.suffix.replace('.', '')
+        if compression == AUTO_COMPRESSION:
+            with open(path, 'rb') as f:
+                compression = choose_compression(f.read(AUTO_SAMPLE_SIZE))
+        if lazy:
+            return cls.from_source(FileSource(path.absolute(), compression=compression, encoding=encoding, level=compression_level), name=name or path.name,
+                                   type=type, encoding=encoding, comment=comment, compression=compression)
         with open(path, 'rb') as f:
-            raw_content = f.read()
-        encoder = get_encoder(encoding)
-        compressor = get_compressor(compression)
-        # Decode and decompress the content
-        comp_content = compressor(raw_content)
-        enc_content = encoder(comp_content)
-        return Attachment(name=name or path.name, type=type or path.suffix.replace('.', ''), encoding=encoding, comment=comment, compression=compression, content=enc_content)
+            return cls.from_stream(f, name=name or path.name, type=type, comment=comment, compression=compression, encoding=encoding, compression_level=compression_level)
+
+    @classmethod
+    def from_files(cls, paths: Iterable[str | Path], workers: int | None = None, **kwargs: Any) -> list[Attachment]:
+        """Load many files into attachments in parallel.
+
+        Parameters
+        ----------
+        paths : iterable of str or Path
+            The paths to the files to load.
+        workers : int | None
+            The number of threads. If None, the :class:`~concurrent.futures.ThreadPoolExecutor` default is used.
+        kwargs
+            Passed to :meth:`from_file` for each file, e.g. ``compression``. The name defaults to each file's name.
+
+        Returns
+        -------
+        list of Attachment
+            The attachments, in the order of the paths.
+
+        Raises
+        ------
+        BulkAttachmentError
+            If any file fails to load. The error of each failed path is in ``errors`` and the loaded attachments are in ``results``.
+        """
+        return map_in_threads(partial(cls.from_file, **kwargs), paths, workers)
+
+    @classmethod
+    async def afrom_file(cls, path: str | Path, executor: Executor | None = None, **kwargs: Any) -> Attachment:
+        """Load a file into an attachment without blocking the event loop. The file is read and encoded in an executor.
+
+        Parameters
+        ----------
+        path : str or Path
+            The path to the file to load.
+        executor : Executor | None
+            The executor to read and encode the file in. If None, the event loop's default thread pool is used.
+        kwargs
+            Passed to :meth:`from_file`, e.g. ``compression``.
+        """
+        return await run_blocking(cls.from_file, path, executor=executor, **kwargs)
+
+    @classmethod
+    async def afrom_files(cls, paths: Iterable[str | Path], limit: int | asyncio.Semaphore | None = DEFAULT_LIMIT,
+                          executor: Executor | None = None, **kwargs: Any) -> list[Attachment]:
+        """Load many files into attachments without blocking the event loop, with at most ``limit`` files loading at once.
+
+        Parameters
+        ----------
+        paths : iterable of str or Path
+            The paths to the files to load.
+        limit : int | asyncio.Semaphore | None
+            The number of files loaded at once. See :func:`~quaac.aio.amap`.
+        executor : Executor | None
+            The executor to read and encode the files in. If None, the event loop's default thread pool is used.
+        kwargs
+            Passed to :meth:`from_file` for each file, e.g. ``compression``.
+
+        Raises
+        ------
+        BulkAttachmentError
+            If any file fails to load. See :meth:`from_files`.
+        """
+        paths = list(paths)
+        results = await amap(partial(cls.afrom_file, executor=executor, **kwargs), paths, limit, return_exceptions=True)
+        errors = {path: result for path, result in zip(paths, results) if isinstance(result, Exception)}
+        if errors:
+            raise BulkAttachmentError(errors, [None if isinstance(result, Exception) else result for result in results])
+        return results
@@ -0,0 +1,188 @@
+"""A compact, self-describing binary format for QuAAC documents.
+
+A file starts with the signature ``QUAACB`` and a one-byte format version, followed by a single value: the document,
+with the same structure as the JSON format. Each value is a one-byte tag followed by its data:
+
+* ``N``, ``T``, ``F``: None, True, and False.
+* ``i``: an 8-byte signed integer. ``n``: a larger integer, as a length-prefixed decimal string.
+* ``d``: an 8-byte float.
+* ``s``: a string; a 4-byte length and the UTF-8 bytes. ``b``: bytes; an 8-byte length and the bytes.
+* ``t``: a datetime; 8 bytes of microseconds since 0001-01-01, a byte for whether it has a UTC offset, and 8 bytes of the offset in microseconds.
+* ``l``: a list; a 4-byte count and the values. ``m``: a map; a 4-byte count and, for each item, a 4-byte length and UTF-8 key, and the value.
+
+All numbers are little-endian.
+"""
+from __future__ import annotations
+
+import mmap
+import struct
+from datetime import datetime, timedelta, timezone
+from typing import Any, BinaryIO, Callable, Iterable
+
+MAGIC = b'QUAACB'
+FORMAT_VERSION = 1
+
+# each value starts with a one-byte tag. Lengths and counts are little-endian unsigned integers.
+_NONE, _TRUE, _FALSE = b'N', b'T', b'F'
+_INT, _BIG_INT, _FLOAT = b'i', b'n', b'd'
+_STR, _BYTES = b's', b'b'
+_LIST, _MAP = b'l', b'm'
+_DATETIME = b't'
+
+_INT64 = struct.Struct('<q')
+_FLOAT64 = struct.Struct('<d')
+_UINT32 = struct.Struct('<I')
+_UINT64 = struct.Struct('<Q')
+# microseconds since 0001-01-01, whether it has a UTC offset, and the offset in microseconds
+_DATETIME_FIELDS = struct.Struct('<q?q')
+_INT64_RANGE = range(-2 ** 63, 2 ** 63)
+
+
+class ByteStream:
+    """Bytes that are written one chunk at a time, e.g. the content of a large attachment.
+    Its length is written once all the chunks have been, so the file must be seekable."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = chunks
+
+
+def write_header(f: BinaryIO) -> None:
+    """Write the signature and format version of a binary QuAAC file."""
+    f.write(MAGIC + bytes([FORMAT_VERSION]))
+
+
+def write_value(f: BinaryIO, value: Any) -> None:
+    """Write a value in the binary format.
+
+    Supported values are None, bools, ints, floats, strings, bytes, :class:`ByteStream`, datetimes, lists, tuples,
+    and dicts with string keys. Datetimes keep their UTC offset, but not the name of their time zone.
+    """
+    if value is None:
+        f.write(_NONE)
+    elif value is True:
+        f.write(_TRUE)
+    elif value is False:
+        f.write(_FALSE)
+    elif isinstance(value, int):
+        if value in _INT64_RANGE:
+            f.write(_INT + _INT64.pack(value))
+        else:
+            _write_sized(f, _BIG_INT, str(value).encode('ascii'))
+    elif isinstance(value, float):
+        f.write(_FLOAT + _FLOAT64.pack(value))
+    elif isinstance(value, str):
+        _write_sized(f, _STR, value.encode('utf-8'), _UINT32)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        _write_sized(f, _BYTES, bytes(value))
+    elif isinstance(value, ByteStream):
+        f.write(_BYTES)
+        start = f.tell()
+        f.write(_UINT64.pack(0))
+        for chunk in value.chunks:
+            f.write(chunk)
+        end = f.tell()
+        f.seek(start)
+        f.write(_UINT64.pack(end - start - _UINT64.size))
+        f.seek(end)
+    elif isinstance(value, datetime):
+        offset = value.utcoffset()
+        naive = value.replace(tzinfo=None) - datetime.min
+        f.write(_DATETIME + _DATETIME_FIELDS.pack(naive // timedelta(microseconds=1), offset is not None,
+                                                  (offset or timedelta()) // timedelta(microseconds=1)))
+    elif isinstance(value, (list, tuple)):
+        f.write(_LIST + _UINT32.pack(len(value)))
+        for item in value:
+            write_value(f, item)
+    elif isinstance(value, dict):
+        f.write(_MAP + _UINT32.pack(len(value)))
+        for key, item in value.items():
+            if not isinstance(key, str):
+                raise ValueError(f"Only string keys can be written to the binary format, not {key!r}")
+            _write_sized(f, b'', key.encode('utf-8'), _UINT32)
+            write_value(f, item)
+    else:
+        raise ValueError(f"Values of type {type(value).__name__} can't be written to the binary format.")
+
+
+def _write_sized(f: BinaryIO, tag: bytes, data: bytes, size: struct.Struct = _UINT64) -> None:
+    f.write(tag + size.pack(len(data)) + data)
+
+
+class BinaryReader:
+    """Read values of the binary format from a buffer, e.g. a memory-mapped file.
+
+    Parameters
+    ----------
+    buffer : bytes-like
+        The data to read.
+    offset : int
+        The position of the first value.
+    """
+
+    def __init__(self, buffer: bytes | mmap.mmap, offset: int = 0):
+        self.buffer = buffer
+        self.offset = offset
+        self._readers: dict[bytes, Callable[[], Any]] = {
+            _NONE: lambda: None, _TRUE: lambda: True, _FALSE: lambda: False,
+            _INT: lambda: self._unpack(_INT64), _FLOAT: lambda: self._unpack(_FLOAT64),
+            _BIG_INT: lambda: int(self._read_sized(_UINT64)),
+            _STR: lambda: self._read_sized(_UINT32).decode('utf-8'),
+            _BYTES: lambda: self._read_sized(_UINT64),
+            _DATETIME: self._read_datetime, _LIST: self._read_list, _MAP: self._read_map,
+        }
+
+    @classmethod
+    def from_header(cls, buffer: bytes | mmap.mmap) -> BinaryReader:
+        """A reader of a binary QuAAC file, positioned after the header. Raises ValueError if the header is not valid."""
+        header = buffer[:len(MAGIC) + 1]
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError("The file is not a binary QuAAC file.")
+        if header[len(MAGIC)] > FORMAT_VERSION:
+            raise ValueError(f"Unsupported binary QuAAC format version: {header[len(MAGIC)]}")
+        return cls(buffer, len(header))
+
+    def read_value(self) -> Any:
+        """Read the next value."""
+        tag = self.buffer[self.offset:self.offset + 1]
+        self.offset += 1
+        try:
+            reader = self._readers[tag]
+        except KeyError:
+            raise ValueError(f"Invalid value tag {tag!r} at byte {self.offset - 1}.") from None
+        return reader()
+
+    def _unpack(self, fmt: struct.Struct) -> Any:
+        return self._unpack_all(fmt)[0]
+
+    def _unpack_all(self, fmt: struct.Struct) -> tuple:
+        try:
+            values = fmt.unpack_from(self.buffer, self.offset)
+        except struct.error:
+            raise ValueError("The binary QuAAC file is truncated.") from None
+        self.offset += fmt.size
+        return values
+
+    def _read_sized(self, size: struct.Struct) -> bytes:
+        length = self._unpack(size)
+        if self.offset + length > len(self.buffer):
+            raise ValueError("The binary QuAAC file is truncated.")
+        data = self.buffer[self.offset:self.offset + length]
+        self.offset += length
+        return data
+
+    def _read_datetime(self) -> datetime:
+        micros, aware, offset = self._unpack_all(_DATETIME_FIELDS)
+        value = datetime.min + timedelta(microseconds=micros)
+        if aware:
+            value = value.replace(tzinfo=timezone(timedelta(microseconds=offset)) if offset else timezone.utc)
+        return value
+
+    def _read_list(self) -> list:
+        return [self.read_value() for _ in range(self._unpack(_UINT32))]
+
+    def _read_map(self) -> dict:
+        result = {}
+        for _ in range(self._unpack(_UINT32)):
+            key = self._read_sized(_UINT32).decode('utf-8')
+            result[key] = self.read_value()
+        return result
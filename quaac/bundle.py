@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, ContextManager, Iterator
+
+from .attachments import CHUNK_SIZE, Attachment, AttachmentSource, get_stream_encoder, iter_chunks
+
+DOCUMENT_NAME = 'document.json'
+BLOB_DIRECTORY = 'blobs'
+
+
+def blob_name(attachment_hash: str) -> str:
+    """The name of the blob of an attachment within a bundle. Scheme prefixes are separated by '-' as ':' is not allowed in file names."""
+    return f"{BLOB_DIRECTORY}/{attachment_hash.replace(':', '-')}"
+
+
+@dataclass(frozen=True)
+class BlobSource(AttachmentSource):
+    """The content of an attachment stored in a bundle. Blobs hold the compressed content before encoding,
+    so it is encoded as it is read."""
+    path: Path
+    name: str
+    encoding: str = 'base64'
+
+    def iter_encoded(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        encoder = get_stream_encoder(self.encoding)
+        with _open_member(self.path, self.name) as f:
+            for chunk in iter_chunks(f, chunk_size):
+                encoded = encoder.update(chunk)
+                if encoded:
+                    yield encoded
+        yield encoder.flush()
+
+
+class Bundle:
+    """A QuAAC document with its attachments stored alongside rather than inlined.
+
+    A bundle is a directory or a zip file containing the document, e.g. ``document.json``, and a ``blobs/`` store
+    with the content of each attachment in a file named by the attachment's hash. The document is the usual
+    JSON format except that attachments have no ``content``; it is read from the store when needed.
+    Blobs are stored compressed but not encoded, so they are about 25% smaller than the inlined content.
+
+    Several documents can be written to the same bundle; attachments they share are only stored once.
+    Documents are never replaced: writing a document with the name of one already in the bundle raises a ValueError.
+
+    Parameters
+    ----------
+    path : str or Path
+        The path of the bundle. Paths ending in ``.zip`` and existing zip files are zip bundles; anything else is a directory.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        if self.path.is_file():
+            if not zipfile.is_zipfile(self.path):
+                raise ValueError(f"{self.path} is not a directory or zip file.")
+            self.is_zip = True
+        else:
+            self.is_zip = self.path.suffix == '.zip'
+        self._zip: zipfile.ZipFile | None = None
+
+    def __enter__(self) -> Bundle:
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def open(self) -> None:
+        """Open the bundle for writing, creating it if it doesn't exist."""
+        if self.is_zip:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._zip = zipfile.ZipFile(self.path, 'a')
+        else:
+            (self.path / BLOB_DIRECTORY).mkdir(parents=True, exist_ok=True)
+
+    def close(self) -> None:
+        """Close a zip bundle."""
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+    def names(self) -> set[str]:
+        """The names of the files in the bundle, e.g. ``'document.json'`` and ``'blobs/<hash>'``."""
+        if self.is_zip:
+            if self._zip is not None:
+                return set(self._zip.namelist())
+            with zipfile.ZipFile(self.path) as zf:
+                return set(zf.namelist())
+        return {p.relative_to(self.path).as_posix() for p in self.path.rglob('*') if p.is_file()}
+
+    def has_blob(self, attachment_hash: str) -> bool:
+        """Whether the content of the attachment with the given hash is stored."""
+        return self._has(blob_name(attachment_hash))
+
+    def has_document(self, name: str = DOCUMENT_NAME) -> bool:
+        """Whether the bundle contains a document of the given name."""
+        return self._has(name)
+
+    def _has(self, name: str) -> bool:
+        if self._zip is not None:
+            return name in self._zip.NameToInfo
+        return name in self.names() if self.is_zip else (self.path / name).is_file()
+
+    def add(self, attachment: Attachment) -> None:
+        """Store the content of an attachment, unless it is already stored."""
+        if self.has_blob(attachment.hash):
+            return
+        name = blob_name(attachment.hash)
+        if self.is_zip:
+            # the content is already compressed, so it is stored as-is
+            with self._zip.open(zipfile.ZipInfo(name), 'w', force_zip64=True) as f:
+                for chunk in attachment.iter_decoded():
+                    f.write(chunk)
+            return
+        # write to a temporary file first so that an interrupted write doesn't leave a partial blob
+        with tempfile.NamedTemporaryFile('wb', dir=self.path / BLOB_DIRECTORY, delete=False) as f:
+            for chunk in attachment.iter_decoded():
+                f.write(chunk)
+        os.replace(f.name, self.path / name)
+
+    def source(self, attachment_hash: str, encoding: str = 'base64') -> BlobSource:
+        """The source of a stored attachment's content. See :meth:`Attachment.from_source <quaac.attachments.Attachment.from_source>`.
+        The content is not checked to exist until it is read."""
+        return BlobSource(self.path.absolute(), blob_name(attachment_hash), encoding)
+
+    def add_document(self, path: str | Path, name: str = DOCUMENT_NAME) -> None:
+        """Copy a written document file into the bundle. A ValueError is raised if the bundle already contains a document of the name."""
+        if self.has_document(name):
+            raise ValueError(f"The bundle {self.path} already contains {name}.")
+        if self.is_zip:
+            self._zip.write(path, name, compress_type=zipfile.ZIP_DEFLATED)
+        else:
+            shutil.copyfile(path, self.path / name)
+
+    def open_document(self, name: str = DOCUMENT_NAME) -> ContextManager[IO[bytes]]:
+        """Open a document of the bundle for reading, as a context manager."""
+        return _open_member(self.path, name)
+
+
+@contextmanager
+def _open_member(path: Path, name: str) -> Iterator[IO[bytes]]:
+    """Open a file of a directory or zip bundle for reading."""
+    if not path.is_file():
+        with open(path / name, 'rb') as f:
+            yield f
+        return
+    with zipfile.ZipFile(path) as zf:
+        try:
+            member = zf.open(name)
+        except KeyError:
+            raise ValueError(f"The bundle {path} has no file {name}.") from None
+        with member:
+            yield member
@@ -0,0 +1,313 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterable
+
+from .columns import posix_timestamp
+from .common import parse_datetime
+from .models import DataPoint, Document, Equipment, User
+from .registry import hash_key
+
+PATTERNS = ('*.json', '*.yaml', '*.yml')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS datapoints (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    name TEXT NOT NULL,
+    perform_timestamp REAL NOT NULL,
+    measurement_value TEXT,
+    measurement_unit TEXT,
+    reference_value TEXT,
+    equipment_hash TEXT NOT NULL,
+    performer_hash TEXT NOT NULL,
+    reviewer_hash TEXT,
+    PRIMARY KEY (file_id, position)
+);
+CREATE INDEX IF NOT EXISTS datapoints_name ON datapoints (name, perform_timestamp);
+CREATE INDEX IF NOT EXISTS datapoints_time ON datapoints (perform_timestamp);
+CREATE INDEX IF NOT EXISTS datapoints_equipment ON datapoints (equipment_hash);
+CREATE INDEX IF NOT EXISTS datapoints_performer ON datapoints (performer_hash);
+CREATE TABLE IF NOT EXISTS equipment (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    hash TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT,
+    serial_number TEXT,
+    manufacturer TEXT,
+    model TEXT,
+    PRIMARY KEY (file_id, hash)
+);
+CREATE INDEX IF NOT EXISTS equipment_name ON equipment (name);
+CREATE TABLE IF NOT EXISTS users (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    hash TEXT NOT NULL,
+    name TEXT NOT NULL,
+    email TEXT,
+    PRIMARY KEY (file_id, hash)
+);
+CREATE INDEX IF NOT EXISTS users_name ON users (name);
+CREATE TABLE IF NOT EXISTS attachments (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    datapoint_position INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attachments_hash ON attachments (hash);
+"""
+
+
+@dataclass(frozen=True)
+class CatalogEntry:
+    """A datapoint found in a :class:`Catalog`. The datapoint itself is loaded from its file with :meth:`load`."""
+    path: Path
+    position: int
+    hash: str
+    name: str
+    perform_timestamp: float
+    measurement_value: Any
+    measurement_unit: str
+    reference_value: Any
+    equipment_hash: str
+    performer_hash: str
+
+    def load(self) -> DataPoint:
+        """Load the datapoint from its file. Raises a ValueError if the file has changed since it was indexed."""
+        return self.check(load_datapoints(self.path, [self.position])[0])
+
+    def check(self, datapoint: DataPoint) -> DataPoint:
+        """Check that a datapoint loaded for this entry is the one that was indexed."""
+        if datapoint.hash != self.hash:
+            raise ValueError(f"{self.path} has changed since it was indexed. Refresh the catalog.")
+        return datapoint
+
+
+@dataclass(frozen=True)
+class RefreshResult:
+    """What :meth:`Catalog.refresh` did to each file."""
+    added: list[Path]
+    updated: list[Path]
+    unchanged: list[Path]
+    removed: list[Path]
+    errors: dict[Path, Exception]
+
+
+class Catalog:
+    """A SQLite index of the datapoints, equipment, users, and attachments of many QuAAC files.
+
+    Queries are answered from the index; documents and datapoints are only loaded from their files when asked for.
+    :meth:`refresh` only re-indexes the files that have changed since they were last indexed.
+
+    .. code-block:: python
+
+        with Catalog('qa_catalog.sqlite') as catalog:
+            catalog.refresh('/share/quaac')
+            for entry in catalog.query(name='6MV Output', equipment='TrueBeam 2', since='2024-07-01'):
+                print(entry.perform_timestamp, entry.measurement_value)
+
+    Parameters
+    ----------
+    path : str or Path
+        The path of the SQLite database. It is created if it doesn't exist. Use ``':memory:'`` for a temporary catalog.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = path
+        self.connection = sqlite3.connect(str(path))
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(_SCHEMA)
+
+    def __enter__(self) -> Catalog:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the database."""
+        self.connection.close()
+
+    def refresh(self, directory: str | Path, patterns: Iterable[str] = PATTERNS, check_hash: bool = True) -> RefreshResult:
+        """Index the QuAAC files in a directory and its subdirectories.
+
+        Files that are new, or whose modification time or size has changed, are read; of those, only files whose content
+        has changed are re-indexed. Files of the directory that have been deleted are removed from the catalog.
+        Files that fail to load are left out of the catalog and reported in the result.
+
+        Parameters
+        ----------
+        directory : str or Path
+            The directory to index.
+        patterns : iterable of str
+            The glob patterns of the files to index.
+        check_hash : bool
+            Whether to check the hashes of the files as they are indexed.
+        """
+        directory = Path(directory).absolute()
+        found = sorted({p for pattern in patterns for p in directory.rglob(pattern) if p.is_file()})
+        known = {Path(row[0]): row[1:] for row in self.connection.execute('SELECT path, id, mtime, size, digest FROM files')}
+        result = RefreshResult(added=[], updated=[], unchanged=[], removed=[], errors={})
+        for path in found:
+            stat = path.stat()
+            record = known.get(path)
+            if record is not None and (record[1], record[2]) == (stat.st_mtime, stat.st_size):
+                result.unchanged.append(path)
+                continue
+            digest = _file_digest(path)
+            if record is not None and record[3] == digest:
+                # touched, but not changed
+                with self.connection:
+                    self.connection.execute('UPDATE files SET mtime = ?, size = ? WHERE id = ?', (stat.st_mtime, stat.st_size, record[0]))
+                result.unchanged.append(path)
+                continue
+            try:
+                self._index(path, stat, digest, check_hash)
+            except Exception as e:
+                result.errors[path] = e
+                self.remove(path)
+                continue
+            (result.added if record is None else result.updated).append(path)
+        found = set(found)
+        for path in known:
+            if directory in path.parents and path not in found:
+                self.remove(path)
+                result.removed.append(path)
+        return result
+
+    def remove(self, path: str | Path) -> None:
+        """Remove a file from the catalog."""
+        with self.connection:
+            self.connection.execute('DELETE FROM files WHERE path = ?', (str(Path(path).absolute()),))
+
+    def _index(self, path: Path, stat: os.stat_result, digest: str, check_hash: bool) -> None:
+        """Replace the entries of a file with those of its current content."""
+        if path.suffix == '.json':
+            datapoints = list(Document.iter_datapoints(path, check_hash=check_hash, lazy_attachments=True))
+        else:
+            datapoints = Document.from_yaml_file(path, check_hash=check_hash).datapoints
+        equipment, users = {}, {}
+        for d in datapoints:
+            for e in (d.primary_equipment, *d.ancillary_equipment):
+                equipment[e.hash] = e
+            for u in (d.performer, d.reviewer):
+                if u is not None:
+                    users[u.hash] = u
+        with self.connection:
+            self.connection.execute('DELETE FROM files WHERE path = ?', (str(path),))
+            file_id = self.connection.execute('INSERT INTO files (path, mtime, size, digest) VALUES (?, ?, ?, ?)',
+                                              (str(path), stat.st_mtime, stat.st_size, digest)).lastrowid
+            self.connection.executemany('INSERT INTO datapoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+                (file_id, position, d.hash, d.name, posix_timestamp(d.perform_datetime), json.dumps(d.measurement_value, default=str), d.measurement_unit,
+                 json.dumps(d.reference_value, default=str), d.primary_equipment.hash, d.performer.hash, d.reviewer.hash if d.reviewer else None)
+                for position, d in enumerate(datapoints)])
+            self.connection.executemany('INSERT INTO equipment VALUES (?, ?, ?, ?, ?, ?, ?)', [
+                (file_id, h, e.name, e.type, e.serial_number, e.manufacturer, e.model) for h, e in equipment.items()])
+            self.connection.executemany('INSERT INTO users VALUES (?, ?, ?, ?)', [(file_id, h, u.name, u.email) for h, u in users.items()])
+            self.connection.executemany('INSERT INTO attachments VALUES (?, ?, ?, ?)', [
+                (file_id, position, a.hash, a.name) for position, d in enumerate(datapoints) for a in d.attachments])
+
+    def files(self) -> list[Path]:
+        """The files in the catalog."""
+        return [Path(row[0]) for row in self.connection.execute('SELECT path FROM files ORDER BY path')]
+
+    def query(self, name: str | None = None, equipment: Equipment | str | None = None, performer: User | str | None = None,
+              since: datetime | str | None = None, until: datetime | str | None = None, attachment: str | None = None) -> list[CatalogEntry]:
+        """Find the datapoints that match all the given filters, ordered by perform datetime. See :meth:`Document.query <quaac.models.Document.query>`.
+
+        Parameters
+        ----------
+        name : str | None
+            The name of the datapoints.
+        equipment : Equipment | str | None
+            The primary equipment, as an object, hash, named hash, or name.
+        performer : User | str | None
+            The performer, as an object, hash, named hash, or name.
+        since : datetime | str | None
+            The earliest perform datetime, inclusive. Strings are parsed as ISO 8601. Datetimes without a time zone are taken to be UTC.
+        until : datetime | str | None
+            The latest perform datetime, inclusive.
+        attachment : str | None
+            The hash or named hash of an attachment of the datapoints.
+        """
+        conditions, parameters = [], []
+        if name is not None:
+            conditions.append('d.name = ?')
+            parameters.append(name)
+        for column, table, reference in (('equipment_hash', 'equipment', equipment), ('performer_hash', 'users', performer)):
+            if reference is None:
+                continue
+            if isinstance(reference, str):
+                conditions.append(f'(d.{column} = ? OR d.{column} IN (SELECT hash FROM {table} WHERE file_id = d.file_id AND name = ?))')
+                parameters.extend([hash_key(reference), reference])
+            else:
+                conditions.append(f'd.{column} = ?')
+                parameters.append(reference.hash)
+        for operator, value in (('>=', since), ('<=', until)):
+            if value is not None:
+                conditions.append(f'd.perform_timestamp {operator} ?')
+                parameters.append(posix_timestamp(parse_datetime(value) if isinstance(value, str) else value))
+        if attachment is not None:
+            conditions.append('d.position IN (SELECT datapoint_position FROM attachments WHERE file_id = d.file_id AND hash = ?)')
+            parameters.append(hash_key(attachment))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        rows = self.connection.execute(
+            'SELECT f.path, d.position, d.hash, d.name, d.perform_timestamp, d.measurement_value, d.measurement_unit, d.reference_value, '
+            f'd.equipment_hash, d.performer_hash FROM datapoints d JOIN files f ON f.id = d.file_id {where} '
+            'ORDER BY d.perform_timestamp, f.path, d.position', parameters)
+        return [CatalogEntry(Path(row[0]), *row[1:5], json.loads(row[5]), row[6], json.loads(row[7]), *row[8:]) for row in rows]
+
+    def load_datapoints(self, entries: Iterable[CatalogEntry]) -> list[DataPoint]:
+        """Load the datapoints of catalog entries, reading each file once. The datapoints are in the order of the entries."""
+        entries = list(entries)
+        positions = {}
+        for entry in entries:
+            positions.setdefault(entry.path, []).append(entry.position)
+        loaded = {path: dict(zip(sorted(set(p)), load_datapoints(path, p))) for path, p in positions.items()}
+        return [entry.check(loaded[entry.path][entry.position]) for entry in entries]
+
+    def load_documents(self, entries: Iterable[CatalogEntry]) -> list[Document]:
+        """Load the documents that contain the given catalog entries, once each."""
+        paths = dict.fromkeys(entry.path for entry in entries)
+        return [Document.from_json_file(path) if path.suffix == '.json' else Document.from_yaml_file(path) for path in paths]
+
+
+def load_datapoints(path: str | Path, positions: Iterable[int]) -> list[DataPoint]:
+    """Load the datapoints at the given positions of a file, in position order. JSON files are only read as far as the last position."""
+    path = Path(path)
+    wanted = sorted(set(positions))
+    if not wanted:
+        return []
+    if path.suffix != '.json':
+        datapoints = Document.from_yaml_file(path).datapoints
+        return [datapoints[p] for p in wanted]
+    selected = []
+    for position, datapoint in enumerate(Document.iter_datapoints(path, lazy_attachments=True)):
+        if position == wanted[len(selected)]:
+            selected.append(datapoint)
+            if len(selected) == len(wanted):
+                break
+    if len(selected) < len(wanted):
+        raise ValueError(f"{path} has fewer datapoints than the catalog expects. Refresh the catalog.")
+    return selected
+
+
+def _file_digest(path: Path) -> str:
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            md5.update(chunk)
+    return md5.hexdigest()
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import math
+from array import array
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from functools import lru_cache
+from operator import itemgetter
+from typing import TYPE_CHECKING, Any, Iterable, Literal, Sequence
+
+if TYPE_CHECKING:
+    from .models import DataPoint, Equipment, User
+
+NAN = float('nan')
+
+
+@lru_cache(maxsize=None)
+def _numpy() -> Any:
+    """NumPy, or None if it isn't installed, in which case the columns are array.array instead.
+    NumPy is slow to import, so it is imported when columns are first built or analysed."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+@dataclass(frozen=True)
+class Columns:
+    """The datapoints of a document as columns for trend analysis, ordered by perform datetime.
+
+    Each column is a NumPy array if NumPy is installed and an :class:`array.array` otherwise.
+    Names, equipment, and performers are dictionary-encoded: each column holds the position of the value
+    in the matching lookup list, e.g. ``columns.equipment[columns.equipment_codes[0]]`` is the primary equipment of the first datapoint.
+
+    Attributes
+    ----------
+    timestamps : array of float
+        The perform datetimes as POSIX timestamps. Datetimes without a time zone are taken to be UTC.
+    values : array of float
+        The measurement values. Values that aren't numbers are NaN.
+    references : array of float
+        The reference values. Missing values and values that aren't numbers are NaN.
+    name_codes, equipment_codes, performer_codes : array of int
+        The positions of the name, primary equipment, and performer of each datapoint in :attr:`names`, :attr:`equipment`, and :attr:`performers`.
+    names : list of str
+        The unique names.
+    equipment : list of Equipment
+        The unique primary equipment.
+    performers : list of User
+        The unique performers.
+    """
+    timestamps: Any
+    values: Any
+    references: Any
+    name_codes: Any
+    equipment_codes: Any
+    performer_codes: Any
+    names: list[str]
+    equipment: list[Equipment]
+    performers: list[User]
+
+    @classmethod
+    def from_datapoints(cls, datapoints: Iterable[DataPoint]) -> Columns:
+        """Build the columns of the given datapoints. Datetimes without a time zone are taken to be UTC, see :func:`posix_timestamp`."""
+        # sort on the timestamps rather than the datetimes, which can't be compared if only some have a time zone
+        pairs = sorted(((posix_timestamp(d.perform_datetime), d) for d in datapoints), key=itemgetter(0))
+        datapoints = [d for _, d in pairs]
+        names, equipment, performers = {}, {}, {}
+        name_codes = [names.setdefault(d.name, len(names)) for d in datapoints]
+        equipment_codes = [equipment.setdefault(d.primary_equipment.hash, (len(equipment), d.primary_equipment))[0] for d in datapoints]
+        performer_codes = [performers.setdefault(d.performer.hash, (len(performers), d.performer))[0] for d in datapoints]
+        return cls(
+            timestamps=_array('d', [t for t, _ in pairs]),
+            values=_array('d', [_to_float(d.measurement_value) for d in datapoints]),
+            references=_array('d', [_to_float(d.reference_value) for d in datapoints]),
+            name_codes=_array('l', name_codes),
+            equipment_codes=_array('l', equipment_codes),
+            performer_codes=_array('l', performer_codes),
+            names=list(names),
+            equipment=[e for _, e in equipment.values()],
+            performers=[p for _, p in performers.values()],
+        )
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def datetimes(self) -> list[datetime]:
+        """The perform datetimes, in UTC."""
+        return [datetime.fromtimestamp(t, tz=timezone.utc) for t in self.timestamps]
+
+    def take(self, positions: Sequence[int]) -> Columns:
+        """The columns of the datapoints at the given positions. The lookup lists are shared."""
+        return replace(self, **{name: _take(getattr(self, name), positions) for name in
+                                ('timestamps', 'values', 'references', 'name_codes', 'equipment_codes', 'performer_codes')})
+
+    def group_by(self, key: Literal['name', 'equipment', 'performer']) -> dict[str, Columns]:
+        """Split the columns by name, primary equipment, or performer.
+
+        Returns a dict of the columns of each group, keyed by the name or by the hash of the equipment or performer.
+        """
+        codes, lookup = {'name': (self.name_codes, self.names),
+                         'equipment': (self.equipment_codes, [e.hash for e in self.equipment]),
+                         'performer': (self.performer_codes, [p.hash for p in self.performers])}[key]
+        np = _numpy()
+        if np is not None:
+            return {lookup[code]: self.take(np.flatnonzero(codes == code)) for code in range(len(lookup))}
+        groups = [[] for _ in lookup]
+        for position, code in enumerate(codes):
+            groups[code].append(position)
+        return {lookup[code]: self.take(positions) for code, positions in enumerate(groups)}
+
+    def deviation(self, relative: bool = False) -> Any:
+        """The deviation of each value from its reference. See :func:`deviation`."""
+        return deviation(self.values, self.references, relative)
+
+
+def deviation(values: Sequence[float], references: Sequence[float], relative: bool = False) -> Any:
+    """The deviation of values from their references, e.g. for comparing against a tolerance.
+
+    Parameters
+    ----------
+    values : array of float
+        The measured values.
+    references : array of float
+        The reference values.
+    relative : bool
+        If True, the deviation is a percentage of the reference. Otherwise, it is the difference.
+    """
+    np = _numpy()
+    if np is not None:
+        values, references = np.asarray(values, dtype=float), np.asarray(references, dtype=float)
+        difference = values - references
+        if not relative:
+            return difference
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(references == 0, NAN, 100 * difference / references)
+    if not relative:
+        return array('d', [v - r for v, r in zip(values, references)])
+    return array('d', [100 * (v - r) / r if r else NAN for v, r in zip(values, references)])
+
+
+def rolling_mean(values: Sequence[float], window: int) -> Any:
+    """The mean of each window of ``window`` consecutive values, aligned to the last value of the window.
+
+    The first ``window - 1`` results, and those of windows that contain NaN, are NaN.
+    """
+    sums, counts = _rolling_sums(values, window, power=1)
+    np = _numpy()
+    if np is not None:
+        return np.where(counts == window, sums / window, NAN)
+    return array('d', [s / window if c == window else NAN for s, c in zip(sums, counts)])
+
+
+def rolling_std(values: Sequence[float], window: int, ddof: int = 1) -> Any:
+    """The standard deviation of each window of ``window`` consecutive values, aligned to the last value of the window.
+
+    The first ``window - 1`` results, and those of windows that contain NaN, are NaN.
+
+    Parameters
+    ----------
+    values : array of float
+        The values.
+    window : int
+        The number of values in each window.
+    ddof : int
+        The delta degrees of freedom. The default of 1 gives the sample standard deviation.
+    """
+    if window <= ddof:
+        raise ValueError("The window must be larger than the delta degrees of freedom.")
+    # the variance is computed around the mean of each window rather than from running sums of the values and their
+    # squares, which cancel catastrophically for large values with a small spread, e.g. readings near 1e6 varying by 0.01
+    np = _numpy()
+    if np is not None:
+        values = np.asarray(values, dtype=float)
+        result = np.full(len(values), NAN)
+        if len(values) >= window:
+            # windows with NaN give NaN
+            result[window - 1:] = np.lib.stride_tricks.sliding_window_view(values, window).std(axis=1, ddof=ddof)
+        return result
+    # Welford's algorithm, adding the value entering each window and removing the one leaving it
+    result = array('d', [NAN] * len(values))
+    count, mean, m2 = 0, 0.0, 0.0
+    for i, value in enumerate(values):
+        if not math.isnan(value):
+            count += 1
+            delta = value - mean
+            mean += delta / count
+            m2 += delta * (value - mean)
+        if i >= window:
+            dropped = values[i - window]
+            if not math.isnan(dropped):
+                count -= 1
+                if count:
+                    delta = dropped - mean
+                    mean -= delta / count
+                    m2 -= delta * (dropped - mean)
+                else:
+                    mean, m2 = 0.0, 0.0
+        if i >= window - 1 and count == window:
+            result[i] = math.sqrt(max(m2, 0) / (window - ddof))
+    return result
+
+
+def _rolling_sums(values: Sequence[float], window: int, power: int) -> tuple[Any, Any]:
+    """The sum of the values (to the given power) of each window and the number of values in it that aren't NaN."""
+    if window < 1:
+        raise ValueError("The window must be at least 1.")
+    np = _numpy()
+    if np is not None:
+        values = np.asarray(values, dtype=float)
+        valid = ~np.isnan(values)
+        cumulative = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0) ** power)))
+        cumulative_count = np.concatenate(([0], np.cumsum(valid)))
+        sums, counts = np.zeros(len(values)), np.zeros(len(values), dtype=int)
+        if len(values) >= window:
+            sums[window - 1:] = cumulative[window:] - cumulative[:-window]
+            counts[window - 1:] = cumulative_count[window:] - cumulative_count[:-window]
+        return sums, counts
+    sums, counts = array('d', bytes(8 * len(values))), array('l', [0] * len(values))
+    total, count = 0.0, 0
+    for i, value in enumerate(values):
+        if not math.isnan(value):
+            total += value ** power
+            count += 1
+        if i >= window:
+            dropped = values[i - window]
+            if not math.isnan(dropped):
+                total -= dropped ** power
+                count -= 1
+        if i >= window - 1:
+            sums[i], counts[i] = total, count
+    return sums, counts
+
+
+def _array(typecode: str, values: list) -> Any:
+    np = _numpy()
+    if np is not None:
+        return np.array(values, dtype=float if typecode == 'd' else np.int64)
+    return array(typecode, values)
+
+
+def _take(column: Any, positions: Sequence[int]) -> Any:
+    np = _numpy()
+    if np is not None:
+        return column[np.asarray(positions, dtype=np.int64)]
+    return array(column.typecode, [column[i] for i in positions])
+
+
+def posix_timestamp(value: datetime) -> float:
+    """The POSIX timestamp of a datetime. Datetimes without a time zone are taken to be UTC, not local time,
+    so that the timestamp is the same on every machine."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _to_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
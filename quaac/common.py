@@ -1,33 +1,107 @@
 from __future__ import annotations
 
+import copy
 import hashlib
 import json
+import re
 
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
 from functools import cached_property
-from typing import Any
+from typing import Any, Callable, Iterator
 
-from pydantic import BaseModel, Field, computed_field, model_validator
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, computed_field, model_validator
+from pydantic_core import PydanticUndefined
 from pydantic_core.core_schema import ValidationInfo
 
+from .stats import phase
+
+LEGACY_HASH_SCHEME = 'md5'
+MERKLE_HASH_SCHEME = 'merkle-md5'
+BLAKE2B_HASH_SCHEME = 'merkle-blake2b'
+
+
+def _blake2b() -> Any:
+    # 16 bytes, the same length as MD5
+    return hashlib.blake2b(digest_size=16)
+
+
+# the hash algorithm of each scheme, and whether it is a Merkle scheme. See register_hash_scheme().
+HASH_SCHEMES: dict[str, tuple[Callable[[], Any], bool]] = {
+    LEGACY_HASH_SCHEME: (hashlib.md5, False),
+    MERKLE_HASH_SCHEME: (hashlib.md5, True),
+    BLAKE2B_HASH_SCHEME: (_blake2b, True),
+}
+_current_hash_scheme: ContextVar[str] = ContextVar('quaac_hash_scheme', default=LEGACY_HASH_SCHEME)
+# whether hashes loaded from a file are kept for verify() rather than checked as entries are validated
+_defer_hash_checks: ContextVar[bool] = ContextVar('quaac_defer_hash_checks', default=False)
+# large string values that are serialized as placeholders and streamed in afterwards. See streamed_values().
+_current_streams: ContextVar[dict | None] = ContextVar('quaac_streams', default=None)
+_PLACEHOLDER = '\x00quaac-stream:{}\x00'
+_PLACEHOLDER_JSON = re.compile(r'"\\u0000quaac-stream:(\d+)\\u0000"')
+
 
 class HashModel(BaseModel):
     """A mixin to add a computed hash field to a model. This also checks the hash
     on the way in from a file to ensure it hasn't changed.
 
      This verifies that data has not been modified since it was created."""
+    # the validators and serializers of the models are built when they are first used rather than when quaac is imported
+    model_config = ConfigDict(defer_build=True)
     from_file_hash: str | None = Field(exclude=True, default=None, description="The original hash of the entry. Only populates when loading from JSON/YAML.")
+    _hash_scheme: str | None = PrivateAttr(default=None)
 
     @computed_field()
     @cached_property
     def hash(self) -> str:
-        """A dynamic MD5 hash of the entry. This is used to create keys for the files, equipment and data points on the fly."""
-        return create_hash_from_entry(self.model_dump(exclude={'hash'}, mode='json'))
+        """A dynamic MD5 hash of the entry. This is used to create keys for the files, equipment and data points on the fly.
+
+        The scheme is the one the entry was loaded with, or the current :func:`hash_scheme` for new entries."""
+        scheme = self._hash_scheme or get_hash_scheme()
+        if is_merkle_scheme(scheme):
+            return prefix_hash(scheme, create_hash_from_entry(self._merkle_entry(), scheme=scheme))
+        with streamed_values() as streams:
+            entry = self._hash_entry()
+        return prefix_hash(scheme, create_hash_from_entry(entry, streams, scheme=scheme))
+
+    def _hash_entry(self) -> dict:
+        """The serialized form of the entry that the legacy hash is computed from."""
+        return self.model_dump(exclude={'hash'}, mode='json')
+
+    def _merkle_entry(self) -> dict:
+        """The serialized form of the entry that the Merkle hash is computed from.
+
+        Nested hashed entries are replaced by their (cached) hashes rather than serialized again, binary fields
+        are digested directly, and computed fields are left out as they are derived from the other fields."""
+        children = self._merkle_children()
+        entry = self.model_dump(exclude={*type(self).model_computed_fields, *children}, mode='json')
+        entry.update(children)
+        return entry
+
+    def _merkle_children(self) -> dict:
+        """The fields of the entry that are represented by a hash in the Merkle entry."""
+        children = {}
+        scheme = self._hash_scheme or get_hash_scheme()
+        values = {**self.__dict__, **(self.model_extra or {})}
+        for name in (*type(self).model_fields, *(self.model_extra or {})):
+            value = values.get(name)
+            if isinstance(value, bytes):
+                children[name] = new_hasher(scheme, value).hexdigest()
+            elif isinstance(value, HashModel):
+                children[name] = value.hash
+            elif isinstance(value, (list, tuple)) and value and all(isinstance(v, HashModel) for v in value):
+                children[name] = [v.hash for v in value]
+        return children
 
     @model_validator(mode='before')
     @classmethod
     def save_original_hash_key(cls: dict, data: Any, info: ValidationInfo) -> dict:
         """Check that the hash key from the file matches the dynamic hash. This only happens when loading from JSON/YAML."""
         # this is None when creating the model.
+        # the same dict may be referenced by several entries, so it is copied rather than popped in place
+        data = dict(data)
         original_hash = data.pop('hash', None)
         if info.context and info.context.get('check_hash', True):
             data['from_file_hash'] = original_hash
@@ -36,19 +110,293 @@ class HashModel(BaseModel):
     @model_validator(mode='after')
     def check_hash(self):
         """Check that the hash key from the file matches the dynamic hash. This only happens when loading from JSON/YAML."""
-        if self.from_file_hash and self.hash != self.from_file_hash:
-            raise ValueError("The hash key from the file does not match the dynamic hash. The file has been edited since created.")
+        self._hash_scheme = scheme_of_hash(self.from_file_hash) if self.from_file_hash else get_hash_scheme()
+        if self.from_file_hash and not _defer_hash_checks.get():
+            with phase('hash.check', objects=1):
+                matches = self.hash == self.from_file_hash
+            if not matches:
+                raise ValueError("The hash key from the file does not match the dynamic hash. The file has been edited since created.")
         return self
 
+    def verify(self) -> HashMismatch | None:
+        """Recompute the hash of the entry and compare it with the hash it was loaded with.
+
+        Use this to check entries that were loaded without checking, e.g. within :func:`deferred_hash_checks` or with
+        :meth:`construct_trusted`. Nested entries are not verified; their current hashes are used.
+        Returns the mismatch, or None if the hashes match or the entry wasn't loaded from a file.
+        """
+        if not self.from_file_hash:
+            return None
+        # the cached hash may be the one from the file, e.g. for trusted entries
+        self.__dict__.pop('hash', None)
+        if self.hash == self.from_file_hash:
+            return None
+        return HashMismatch(self, self.from_file_hash, self.hash)
+
+    @classmethod
+    def construct_trusted(cls, data: dict) -> HashModel:
+        """Build an entry from serialized data without validating it, e.g. when reloading a file written by this library.
+
+        This is several times faster than validating, but nothing is checked or coerced, except that datetime fields
+        given as ISO 8601 strings are parsed. The hash from the data, if any, is used as the hash of the entry rather than recomputed.
+        Nested entries, e.g. the equipment of a data point, must already have been built.
+        """
+        extra = dict(data)
+        original_hash = extra.pop('hash', None)
+        values = {}
+        for name, alias, field_info, is_datetime in _field_layout(cls):
+            if alias in extra:
+                value = extra.pop(alias)
+            elif name in extra:
+                value = extra.pop(name)
+            elif field_info.is_required():
+                continue
+            else:
+                value = field_info.get_default(call_default_factory=True)
+            values[name] = parse_datetime(value) if is_datetime and isinstance(value, str) else value
+        values['from_file_hash'] = original_hash
+        # the same attributes as set by BaseModel.model_construct, without its per-call introspection
+        entry = cls.__new__(cls)
+        object.__setattr__(entry, '__dict__', values)
+        object.__setattr__(entry, '__pydantic_fields_set__', set(values))
+        object.__setattr__(entry, '__pydantic_extra__', extra if cls.model_config.get('extra') == 'allow' else None)
+        object.__setattr__(entry, '__pydantic_private__', _private_defaults(cls))
+        if original_hash is not None:
+            values['hash'] = original_hash
+        entry._hash_scheme = scheme_of_hash(original_hash) if original_hash else get_hash_scheme()
+        return entry
+
     def named_hash(self) -> str:
         """Return the hash with the name of the object. Adds some clarity when perusing a QuAAC document."""
         return f"({self.name}) {self.hash}"
 
 
-def create_hash_from_entry(entry: dict) -> str:
-    """Create an MD5 hash of the given content. This is for creating keys for the files, equipment and data points on the fly."""
-    entry_str = json.dumps(entry, sort_keys=True).encode('utf-8')
-    return hashlib.md5(entry_str).hexdigest()
+_FIELD_LAYOUTS: dict[type, list] = {}
+
+
+def _field_layout(model: type[BaseModel]) -> list[tuple[str, str, Any, bool]]:
+    """The name, serialized key, field info, and whether it is a datetime, of each field of a model except ``from_file_hash``."""
+    if model not in _FIELD_LAYOUTS:
+        _FIELD_LAYOUTS[model] = [(name, info.alias or name, info, info.annotation is datetime)
+                                 for name, info in model.model_fields.items() if name != 'from_file_hash']
+    return _FIELD_LAYOUTS[model]
+
+
+def _private_defaults(model: type[BaseModel]) -> dict[str, Any]:
+    """The default values of the private attributes of a model."""
+    defaults = {}
+    for name, attr in model.__private_attributes__.items():
+        if attr.default_factory is not None:
+            defaults[name] = attr.default_factory()
+        elif attr.default is not PydanticUndefined:
+            defaults[name] = copy.deepcopy(attr.default)
+    return defaults
+
+
+@dataclass(frozen=True)
+class HashMismatch:
+    """An entry whose hash doesn't match the hash it was saved with, i.e. it has been edited since."""
+    entry: HashModel
+    expected: str
+    actual: str
+
+
+@dataclass
+class VerificationReport:
+    """The result of verifying the hashes of the entries of a document. See :meth:`Document.verify <quaac.models.Document.verify>`.
+
+    Attributes
+    ----------
+    checked : int
+        The number of entries verified.
+    mismatches : list of HashMismatch
+        Every entry whose hash doesn't match, in the order they were checked.
+    """
+    checked: int = 0
+    mismatches: list[HashMismatch] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        """Whether every hash matched."""
+        return not self.mismatches
+
+    def check(self) -> None:
+        """Raise a :class:`HashMismatchError` if any hash didn't match."""
+        if self.mismatches:
+            raise HashMismatchError(self)
+
+
+class HashMismatchError(ValueError):
+    """Raised when entries have been edited since they were saved. Unlike the error raised while loading,
+    it lists every mismatched entry, in :attr:`report`."""
+
+    def __init__(self, report: VerificationReport):
+        self.report = report
+        names = ', '.join(f"{type(m.entry).__name__} '{getattr(m.entry, 'name', '')}'".replace(" ''", '') for m in report.mismatches[:5])
+        more = f" and {len(report.mismatches) - 5} more" if len(report.mismatches) > 5 else ''
+        super().__init__(f"{len(report.mismatches)} of {report.checked} entries have been edited since they were saved: {names}{more}")
+
+
+@contextmanager
+def deferred_hash_checks(defer: bool = True) -> Iterator[None]:
+    """Keep the hashes of entries loaded in this context without checking them, so that they can be checked later with
+    :meth:`HashModel.verify` or :meth:`Document.verify <quaac.models.Document.verify>`."""
+    token = _defer_hash_checks.set(defer)
+    try:
+        yield
+    finally:
+        _defer_hash_checks.reset(token)
+
+
+def parse_datetime(value: str) -> datetime:
+    """Parse an ISO 8601 datetime as serialized by pydantic, including a ``Z`` suffix for UTC."""
+    if value.endswith(('Z', 'z')):
+        value = value[:-1] + '+00:00'
+    return datetime.fromisoformat(value)
+
+
+def get_hash_scheme() -> str:
+    """The hash scheme that new entries are hashed with."""
+    return _current_hash_scheme.get()
+
+
+def set_hash_scheme(scheme: str) -> None:
+    """Set the hash scheme that new entries are hashed with.
+
+    Parameters
+    ----------
+    scheme : str
+        One of :data:`HASH_SCHEMES`. ``'md5'`` (the default) hashes the full serialization of each entry.
+        ``'merkle-md5'`` builds the hash of an entry from the hashes of the entries it contains plus its own fields,
+        so hashing a data point or document does not re-serialize its equipment, users, or attachment contents.
+        ``'merkle-blake2b'`` is the same with BLAKE2b, which is faster than MD5 on most 64-bit machines.
+        Other schemes can be added with :func:`register_hash_scheme`.
+    """
+    if scheme not in HASH_SCHEMES:
+        raise ValueError(f"Unsupported hash scheme: {scheme}")
+    _current_hash_scheme.set(scheme)
+
+
+@contextmanager
+def hash_scheme(scheme: str) -> Iterator[None]:
+    """Temporarily hash new entries with the given scheme. See :func:`set_hash_scheme`."""
+    if scheme not in HASH_SCHEMES:
+        raise ValueError(f"Unsupported hash scheme: {scheme}")
+    token = _current_hash_scheme.set(scheme)
+    try:
+        yield
+    finally:
+        _current_hash_scheme.reset(token)
+
+
+def register_hash_scheme(name: str, algorithm: Callable[[], Any], merkle: bool = True) -> None:
+    """Add a hash scheme, or replace one.
+
+    Hashes of the scheme are prefixed with its name, e.g. ``'merkle-sha256:...'``, so that files record how they were hashed.
+    Files hashed with a scheme can only be loaded where it has been registered.
+
+    Parameters
+    ----------
+    name : str
+        The name of the scheme. It can't contain ``':'`` or ``')'``.
+    algorithm : callable
+        Returns a new hash object with ``update()`` and ``hexdigest()`` methods, like :func:`hashlib.sha256`.
+    merkle : bool
+        Whether the hash of an entry is built from the hashes of the entries it contains, as for ``'merkle-md5'``,
+        or from its full serialization, as for ``'md5'``.
+    """
+    if ':' in name or ')' in name:
+        raise ValueError(f"Hash scheme names can't contain ':' or ')': {name}")
+    if name == LEGACY_HASH_SCHEME:
+        raise ValueError(f"The {LEGACY_HASH_SCHEME} scheme can't be replaced.")
+    HASH_SCHEMES[name] = (algorithm, merkle)
+
+
+def is_merkle_scheme(scheme: str) -> bool:
+    """Whether the hashes of the scheme are built from the hashes of nested entries."""
+    return HASH_SCHEMES[scheme][1]
+
+
+def new_hasher(scheme: str, data: bytes = b'') -> Any:
+    """A new hash object of the algorithm of the scheme, updated with ``data``."""
+    hasher = HASH_SCHEMES[scheme][0]()
+    hasher.update(data)
+    return hasher
+
+
+def prefix_hash(scheme: str, digest: str) -> str:
+    """The hash as it is saved: the digest, prefixed with the scheme unless it is the legacy scheme."""
+    return digest if scheme == LEGACY_HASH_SCHEME else f"{scheme}:{digest}"
+
+
+def scheme_of_hash(hash_value: str) -> str:
+    """The scheme a hash was created with. Legacy hashes have no prefix; others are prefixed with ``'<scheme>:'``."""
+    if ':' not in hash_value:
+        return LEGACY_HASH_SCHEME
+    scheme = hash_value.split(':')[0]
+    if scheme not in HASH_SCHEMES:
+        raise ValueError(f"Unsupported hash scheme: {scheme}")
+    return scheme
+
+
+def create_hash_from_entry(entry: dict, streams: dict | None = None, scheme: str = LEGACY_HASH_SCHEME) -> str:
+    """Create a hash of the given content. This is for creating keys for the files, equipment and data points on the fly.
+
+    Parameters
+    ----------
+    entry : dict
+        The serialized entry.
+    streams : dict | None
+        The values of any placeholders in the entry. See :func:`streamed_values`.
+    scheme : str
+        The hash scheme whose algorithm is used. MD5 by default. The digest is not prefixed with the scheme.
+    """
+    entry_str = json.dumps(entry, sort_keys=True)
+    if not streams:
+        return new_hasher(scheme, entry_str.encode('utf-8')).hexdigest()
+    hasher = new_hasher(scheme)
+    for piece in iter_streamed_json(entry_str, streams):
+        hasher.update(piece.encode('utf-8'))
+    return hasher.hexdigest()
+
+
+@contextmanager
+def streamed_values() -> Iterator[dict]:
+    """Serialize large string values (e.g. lazy attachment content) as placeholders while in this context.
+
+    Yields the dict that the placeholders are registered in. Pass it to :func:`iter_streamed_json` or
+    :func:`create_hash_from_entry` along with the JSON dumped in the context to stream the real values back in.
+    """
+    streams = {}
+    token = _current_streams.set(streams)
+    try:
+        yield streams
+    finally:
+        _current_streams.reset(token)
+
+
+def stream_placeholder(chunks: Callable[[], Iterator[str]]) -> str | None:
+    """Register a callable that yields the chunks of a string value and return its placeholder.
+    Returns None if not inside :func:`streamed_values`."""
+    streams = _current_streams.get()
+    if streams is None:
+        return None
+    streams[str(len(streams))] = chunks
+    return _PLACEHOLDER.format(len(streams) - 1)
+
+
+def iter_streamed_json(text: str, streams: dict) -> Iterator[str]:
+    """Yield the pieces of JSON text with each placeholder replaced by the JSON-escaped chunks of its value."""
+    # split() alternates between the text around the placeholders and the placeholder ids
+    pieces = _PLACEHOLDER_JSON.split(text)
+    for i, piece in enumerate(pieces):
+        if i % 2 == 0:
+            yield piece
+            continue
+        yield '"'
+        for chunk in streams[piece]():
+            yield json.dumps(chunk)[1:-1]
+        yield '"'
 
 
 def split_hash(named_hash: str) -> str:
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import IO, Any, Iterable, Iterator, Literal
+
+from .models import REFERENCE_MODELS, DataPoint, Document, resolve_references
+from .streaming import DocumentWriter
+
+HEADER = 'header'
+# the record type of each reference table
+RECORD_TYPES = {'equipment': 'equipment', 'user': 'users', 'attachment': 'attachments'}
+
+
+class Journal:
+    """An append-only QuAAC document in JSON Lines format, for adding datapoints one at a time.
+
+    Each line is a record: a header with the version and extra fields of the document, then the equipment, users,
+    and attachments the first time they are referenced, and the datapoints. Appending a datapoint only writes
+    the new records, so it takes the same time however long the journal is. Use :meth:`read` to load the
+    journal as a :class:`~quaac.models.Document` and :meth:`compact` to write it as a regular QuAAC file.
+
+    A record that was only partly written, e.g. because the process was killed, is dropped when the journal is opened.
+    If the header itself was only partly written, the journal is started again with a new header.
+
+    .. code-block:: python
+
+        with Journal('daily.jsonl') as journal:
+            journal.append(datapoint)
+
+    Parameters
+    ----------
+    path : str or Path
+        The path of the journal. It is created if it doesn't exist.
+    sync : bool
+        Whether to flush each append to disk with :func:`os.fsync`. Slower, but appended datapoints survive a power loss.
+    version : str
+        The QuAAC version of a new journal.
+    extras
+        Any extra top-level fields of a new journal.
+    """
+
+    def __init__(self, path: str | Path, sync: bool = False, version: str = '1.0', **extras: Any):
+        self.path = Path(path)
+        self.sync = sync
+        self.version = version
+        self.extras = extras
+        self._file: IO[str] | None = None
+        self._hashes: set[str] = set()
+
+    def __enter__(self) -> Journal:
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def open(self) -> None:
+        """Open the journal for appending, creating it if it doesn't exist."""
+        if self.path.exists() and self.path.stat().st_size:
+            header, valid_size = None, 0
+            for record, end in _iter_records(self.path):
+                if header is None:
+                    if record['type'] != HEADER:
+                        raise ValueError(f"{self.path} is not a QuAAC journal; its first record is not a header.")
+                    header = record
+                elif 'hash' in record.get('entry', {}):
+                    self._hashes.add(record['entry']['hash'])
+                valid_size = end
+            if header is not None:
+                if valid_size < self.path.stat().st_size:
+                    # drop a partly written record
+                    os.truncate(self.path, valid_size)
+                self.version, self.extras = header['version'], header.get('extras', {})
+                self._file = open(self.path, 'a', encoding='utf-8')
+                return
+            # not even the header was completely written, so the journal is started again
+        self._file = open(self.path, 'w', encoding='utf-8')
+        self._write([{'type': HEADER, 'version': self.version, 'extras': json.loads(json.dumps(self.extras))}])
+
+    def close(self) -> None:
+        """Close the journal."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, datapoint: DataPoint) -> None:
+        """Append a datapoint and any equipment, users, and attachments it references that aren't in the journal yet."""
+        records = []
+        references = [('equipment', datapoint.primary_equipment), *(('equipment', e) for e in datapoint.ancillary_equipment),
+                      ('user', datapoint.performer), *([('user', datapoint.reviewer)] if datapoint.reviewer is not None else []),
+                      *(('attachment', a) for a in datapoint.attachments)]
+        for record_type, entry in references:
+            if entry.hash not in self._hashes:
+                records.append({'type': record_type, 'entry': entry.model_dump(mode='json', by_alias=True)})
+                self._hashes.add(entry.hash)
+        records.append({'type': 'datapoint', 'entry': datapoint.model_dump(mode='json', by_alias=True)})
+        self._write(records)
+
+    def append_many(self, datapoints: Iterable[DataPoint]) -> None:
+        """Append several datapoints."""
+        for datapoint in datapoints:
+            self.append(datapoint)
+
+    def _write(self, records: list[dict]) -> None:
+        # the records of a datapoint are written at once so that a datapoint is never written without its references
+        self._file.write(''.join(json.dumps(record) + '\n' for record in records))
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+
+    @staticmethod
+    def iter_datapoints(path: str | Path, check_hash: bool = True) -> Iterator[DataPoint]:
+        """Iterate over the datapoints of a journal in the order they were appended.
+
+        Parameters
+        ----------
+        path : str or Path
+            The path of the journal.
+        check_hash : bool
+            Whether to check the hashes of the entries. This is True by default.
+        """
+        context = {'check_hash': check_hash}
+        tables = {key: {} for key in REFERENCE_MODELS}
+        for record, _ in _iter_records(Path(path)):
+            if record['type'] == HEADER:
+                continue
+            if record['type'] == 'datapoint':
+                datapoint = resolve_references(record['entry'], tables['equipment'], tables['users'], tables['attachments'])
+                yield DataPoint.model_validate(datapoint, context=context)
+                continue
+            key = RECORD_TYPES[record['type']]
+            tables[key][record['entry']['hash']] = REFERENCE_MODELS[key].model_validate(record['entry'], context=context)
+
+    @classmethod
+    def read(cls, path: str | Path, check_hash: bool = True) -> Document:
+        """Load a journal as a document. See :meth:`iter_datapoints`."""
+        header = next((record for record, _ in _iter_records(Path(path)) if record['type'] == HEADER), {})
+        datapoints = list(cls.iter_datapoints(path, check_hash=check_hash))
+        return Document(version=header.get('version', '1.0'), datapoints=datapoints, **header.get('extras', {}))
+
+    @classmethod
+    def compact(cls, path: str | Path, output: str | Path, format: Literal['json', 'yaml'] = 'json', check_hash: bool = True) -> int:
+        """Write a journal as a regular QuAAC document, one datapoint at a time.
+
+        Parameters
+        ----------
+        path : str or Path
+            The path of the journal.
+        output : str or Path
+            The path of the QuAAC file to write. It can be read with e.g. :meth:`Document.from_json_file <quaac.models.Document.from_json_file>`.
+        format : str
+            The format of the output; 'json' or 'yaml'.
+        check_hash : bool
+            Whether to check the hashes of the entries of the journal.
+
+        Returns
+        -------
+        int
+            The number of datapoints written.
+        """
+        header = next((record for record, _ in _iter_records(Path(path)) if record['type'] == HEADER), {})
+        count = 0
+        with DocumentWriter(output, format=format, version=header.get('version', '1.0'), **header.get('extras', {})) as writer:
+            for datapoint in cls.iter_datapoints(path, check_hash=check_hash):
+                writer.write(datapoint)
+                count += 1
+        return count
+
+
+def _iter_records(path: Path) -> Iterator[tuple[dict, int]]:
+    """The complete records of a journal, each with the byte position of its end. A partly written last record is skipped."""
+    position = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                return
+            position += len(line)
+            yield json.loads(line), position
@@ -1,15 +1,33 @@
 from __future__ import annotations
 
 import json
+import mmap
+import os
+import tempfile
 from datetime import datetime
-from typing import Any, Literal, Set
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, List, Literal, Set
 
-import yaml
-from pydantic import computed_field, Field, field_serializer, ConfigDict, model_validator, EmailStr
+from pydantic import computed_field, Field, field_serializer, ConfigDict, model_validator, EmailStr, PrivateAttr, TypeAdapter
 from pydantic_core.core_schema import ValidationInfo
 
-from .common import HashModel, split_hash
-from .attachments import Attachment
+from .aio import run_blocking
+from .common import HashModel, VerificationReport, deferred_hash_checks, parse_datetime, split_hash
+from .attachments import Attachment, ByteRangeSource, get_encoder, map_in_threads
+from .binary import BinaryReader, ByteStream, write_header, write_value
+from .bundle import DOCUMENT_NAME, Bundle
+from .columns import Columns
+from .registry import DatapointIndex, ReferenceRegistry, hash_key
+from .stats import phase
+from .streaming import DocumentWriter, JSONStreamReader, load_yaml, merge_datapoints
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+
+
+# how the hashes of entries loaded from a file are checked. See Document.from_json_file().
+HashCheck = Literal['eager', 'deferred', 'parallel']
 
 
 class DataPoint(HashModel, validate_assignment=True):
@@ -31,6 +49,31 @@ class DataPoint(HashModel, validate_assignment=True):
     ancillary_equipment: list[Equipment] = Field(default_factory=list, alias="ancillary equipment", title="Ancillary Equipment", description="The internal IDs of any ancillary equipment used to perform the measurement.", examples=["1"], json_schema_extra={'type': 'string'})
     attachments: list[Attachment] = Field(default_factory=list, title="Attachments", description="The files associated with the measurement.", examples=["1"], json_schema_extra={'type': 'string'})
 
+    @classmethod
+    def from_records(cls, rows: Iterable[dict[str, Any]], trusted: bool = False, **defaults: Any) -> list[DataPoint]:
+        """Build data points from rows of fields, e.g. from a :class:`csv.DictReader` or a database query.
+
+        The rows are validated together in a single call rather than one model at a time.
+
+        .. code-block:: python
+
+            with open('outputs.csv', newline='') as f:
+                datapoints = DataPoint.from_records(csv.DictReader(f), primary_equipment=linac, performer=user, measurement_unit='cGy')
+
+        Parameters
+        ----------
+        rows : iterable of dict
+            The fields of each data point, keyed by field name or alias, e.g. ``'perform_datetime'`` or ``'perform datetime'``.
+        trusted : bool
+            If True, the data points are built without validation. See :meth:`~quaac.common.HashModel.construct_trusted`.
+        defaults
+            Fields shared by every row, e.g. the primary equipment and performer. Fields of the row take precedence.
+        """
+        records = [{**defaults, **row} for row in rows]
+        if trusted:
+            return [cls.construct_trusted(record) for record in records]
+        return _datapoints_adapter().validate_python(records)
+
     @field_serializer('primary_equipment', when_used='json')
     def serialize_primary_equipment(self, primary_equipment: Equipment, _info) -> str:
         """Serialize the primary equipment to its hash. This happens when dumped to JSON/YAML so
@@ -81,67 +124,605 @@ class Document(HashModel, validate_assignment=True):
     version: Literal['1.0'] = Field(title="Version", default="1.0", description="The version of the QuAAC document.")
     datapoints: list[DataPoint] = Field(title="Data Points", description="The data points in the document.")
 
+    _registry: ReferenceRegistry = PrivateAttr(default_factory=ReferenceRegistry)
+    _index: DatapointIndex = PrivateAttr(default_factory=DatapointIndex)
+
     @computed_field(return_type=Set[Equipment])
     @property
     def equipment(self) -> Set[Equipment]:
         """The unique equipment from the datapoints."""
-        return {d.primary_equipment for d in self.datapoints} | {e for d in self.datapoints for e in
-                                                                 d.ancillary_equipment}
+        return set(self.registry().equipment.values())
 
     @computed_field(return_type=Set[User])
     @property
     def users(self) -> Set[User]:
         """The unique users from the datapoints."""
-        return {d.performer for d in self.datapoints} | {d.reviewer for d in self.datapoints if d.reviewer is not None}
+        return set(self.registry().users.values())
 
     @computed_field(return_type=Set[Attachment])
     @property
     def attachments(self) -> Set[Attachment]:
         """The unique attachments from the datapoints."""
-        return {f for d in self.datapoints for f in d.attachments}
+        return set(self.registry().attachments.values())
+
+    def registry(self) -> ReferenceRegistry:
+        """The index of the equipment, users, and attachments referenced by the datapoints, keyed by hash.
+
+        The index is built on first use. Datapoints added with :meth:`add_datapoints` or appended to :attr:`datapoints`
+        are indexed incrementally; any other change to :attr:`datapoints`, e.g. ``doc.datapoints[0] = dp``, rebuilds the index.
+        """
+        return self._registry.sync(self.datapoints)
+
+    def add_datapoints(self, datapoints: list[DataPoint]) -> None:
+        """Append datapoints to the document, updating the reference index and the hash."""
+        self.datapoints.extend(datapoints)
+        self.registry()
+        # the hash is a cached property and is now stale
+        self.__dict__.pop('hash', None)
+
+    def equipment_by_hash(self, reference: str) -> Equipment:
+        """Look up equipment by its hash or named hash."""
+        return self.registry().equipment[hash_key(reference)]
+
+    def user_by_hash(self, reference: str) -> User:
+        """Look up a user by their hash or named hash."""
+        return self.registry().users[hash_key(reference)]
+
+    def attachment_by_hash(self, reference: str) -> Attachment:
+        """Look up an attachment by its hash or named hash."""
+        return self.registry().attachments[hash_key(reference)]
+
+    def datapoints_for_equipment(self, equipment: Equipment | str) -> list[DataPoint]:
+        """The datapoints that use the given equipment, as primary or ancillary equipment. The equipment can be passed as an object, hash, or named hash."""
+        return list(self.registry().datapoints_by_equipment.get(hash_key(equipment), []))
+
+    def datapoints_for_user(self, user: User | str) -> list[DataPoint]:
+        """The datapoints that the given user performed or reviewed. The user can be passed as an object, hash, or named hash."""
+        return list(self.registry().datapoints_by_user.get(hash_key(user), []))
+
+    def datapoints_for_attachment(self, attachment: Attachment | str) -> list[DataPoint]:
+        """The datapoints that reference the given attachment. The attachment can be passed as an object, hash, or named hash."""
+        return list(self.registry().datapoints_by_attachment.get(hash_key(attachment), []))
+
+    def query(self, name: str | None = None, equipment: Equipment | str | None = None, performer: User | str | None = None,
+              since: datetime | str | None = None, until: datetime | str | None = None) -> list[DataPoint]:
+        """Find the datapoints that match all the given filters, in document order.
+
+        The filters use indexes that are built on first use and kept up to date like :meth:`registry`, so repeated
+        queries don't scan the datapoints.
+
+        .. code-block:: python
+
+            doc.query(name='6MV Output', equipment=linac, since='2024-01-01', until='2024-06-30T23:59:59')
+
+        Parameters
+        ----------
+        name : str | None
+            The name of the datapoints.
+        equipment : Equipment | str | None
+            The primary equipment, as an object, hash, or named hash.
+        performer : User | str | None
+            The performer, as an object, hash, or named hash.
+        since : datetime | str | None
+            The earliest perform datetime, inclusive. Strings are parsed as ISO 8601.
+            Datetimes without a time zone are taken to be UTC, for both the filters and the datapoints.
+        until : datetime | str | None
+            The latest perform datetime, inclusive. Strings are parsed as ISO 8601.
+        """
+        since = parse_datetime(since) if isinstance(since, str) else since
+        until = parse_datetime(until) if isinstance(until, str) else until
+        positions = self._index.sync(self.datapoints).select(name=name, equipment=equipment, performer=performer, since=since, until=until)
+        return [self.datapoints[i] for i in positions]
+
+    def to_columns(self, group_by: Literal['name', 'equipment', 'performer'] | None = None) -> Columns | dict[str, Columns]:
+        """The datapoints as columns of arrays for trend analysis, ordered by perform datetime. See :class:`~quaac.columns.Columns`.
+
+        The columns are NumPy arrays if NumPy is installed. Use :func:`~quaac.columns.deviation`,
+        :func:`~quaac.columns.rolling_mean`, and :func:`~quaac.columns.rolling_std` to analyse them.
+
+        .. code-block:: python
+
+            for linac_hash, columns in doc.to_columns(group_by='equipment').items():
+                out_of_tolerance = abs(columns.deviation(relative=True)) > 2
+
+        Parameters
+        ----------
+        group_by : str | None
+            If given, the columns are split into groups by 'name', 'equipment' (primary equipment), or 'performer'
+            and a dict of the columns of each group is returned, keyed by the name or the hash of the equipment or performer.
+        """
+        columns = Columns.from_datapoints(self.datapoints)
+        if group_by is None:
+            return columns
+        return columns.group_by(group_by)
+
+    def _hash_entry(self) -> dict:
+        """The serialized document, with the reference tables deduplicated and sorted by hash so that the hash
+        does not depend on the iteration order of the sets, which changes between interpreter sessions."""
+        entry = super()._hash_entry()
+        for key in ('equipment', 'users', 'attachments'):
+            unique = {e['hash']: e for e in entry[key]}
+            entry[key] = [unique[h] for h in sorted(unique)]
+        return entry
+
+    def verify(self, workers: int | None = 1) -> VerificationReport:
+        """Check every entry of the document against the hash it was loaded with and report every mismatch.
+
+        Use this for documents loaded with ``check_hash='deferred'`` or ``trusted=True``, e.g. to open a large archive
+        for viewing straight away and check it later. The equipment, users, and attachments are verified first,
+        then the data points, and then the document, so that each hash is built from verified hashes.
+
+        .. code-block:: python
+
+            doc = Document.from_json_file('archive.json', check_hash='deferred')
+            report = doc.verify(workers=8)
+            for mismatch in report.mismatches:
+                print(mismatch.entry, mismatch.expected, mismatch.actual)
+
+        Parameters
+        ----------
+        workers : int | None
+            The number of threads to verify attachments with. 1 verifies them in the calling thread. If None, the
+            :class:`~concurrent.futures.ThreadPoolExecutor` default is used. Digesting attachment content releases the GIL,
+            so threads speed up documents with large attachments. The other entries are hashed in pure Python, which
+            threads don't speed up, so they are always verified in the calling thread.
+        """
+        with phase('hash.verify') as p:
+            report = self._verify(workers)
+            p.add(objects=report.checked)
+        return report
+
+    def _verify(self, workers: int | None) -> VerificationReport:
+        registry = self.registry()
+        report = VerificationReport()
+        attachments = [a for a in registry.attachments.values() if a.from_file_hash]
+        if workers == 1 or len(attachments) < 2:
+            mismatches = [a.verify() for a in attachments]
+        else:
+            mismatches = map_in_threads(HashModel.verify, attachments, workers)
+        report.checked += len(attachments)
+        report.mismatches.extend(m for m in mismatches if m is not None)
+        for entries in ([*registry.equipment.values(), *registry.users.values()], self.datapoints, [self]):
+            entries = [e for e in entries if e.from_file_hash]
+            # the document's own entry is checked with HashModel.verify, which this method overrides
+            report.checked += len(entries)
+            report.mismatches.extend(m for m in map(HashModel.verify, entries) if m is not None)
+        return report
+
+    def writer(self, path: str | Path, format: Literal['json', 'yaml'] = 'json', indent: int | None = 4, bundle: Bundle | None = None) -> DocumentWriter:
+        """A :class:`~quaac.streaming.DocumentWriter` for this document's version and extra fields."""
+        extras = self.model_dump(mode='json', include=set(self.model_extra or {}))
+        return DocumentWriter(path, format=format, indent=indent, version=self.version, hash_scheme=self._hash_scheme, bundle=bundle, **extras)
 
     def to_json_file(self, path: str, indent: int = 4) -> None:
         """Write the document to a JSON file."""
-        with open(path, 'w') as f:
-            f.write(self.model_dump_json(indent=indent, by_alias=True))
+        with self.writer(path, format='json', indent=indent) as writer:
+            writer.write_many(self.datapoints)
+
+    async def adump_json(self, path: str | Path, indent: int = 4, executor: Executor | None = None) -> None:
+        """Write the document to a JSON file without blocking the event loop. The document is written in an executor.
+
+        Parameters
+        ----------
+        path : str or Path
+            The path of the JSON file.
+        indent : int
+            The indentation of the JSON.
+        executor : Executor | None
+            The executor to write the file in. If None, the event loop's default thread pool is used.
+        """
+        await run_blocking(self.to_json_file, path, indent, executor=executor)
+
+    def extract_attachments(self, directory: str | Path, workers: int | None = None) -> list[Path]:
+        """Write the unique attachments of the document to a directory in parallel.
+
+        Each attachment is written under its name. If several different attachments have the same name,
+        the later ones get the start of their hash appended to the name, e.g. ``image-1a2b3c4d.png``.
+
+        Parameters
+        ----------
+        directory : str or Path
+            The directory to write to. It is created if it doesn't exist.
+        workers : int | None
+            The number of threads. If None, the :class:`~concurrent.futures.ThreadPoolExecutor` default is used.
+
+        Returns
+        -------
+        list of Path
+            The paths written, in the order the attachments are first referenced by the datapoints.
+
+        Raises
+        ------
+        BulkAttachmentError
+            If any attachment fails to be written. The others are still written.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        targets = {}
+        for attachment_hash, attachment in self.registry().attachments.items():
+            path = directory / Path(attachment.name).name
+            if path in targets:
+                path = path.with_name(f"{path.stem}-{attachment_hash.split(':')[-1][:8]}{path.suffix}")
+            targets[path] = attachment
+        map_in_threads(lambda path: targets[path].to_file(path), targets, workers)
+        return list(targets)
 
     @classmethod
-    def from_json_file(cls, path: str, check_hash: bool = True) -> Document:
+    def from_json_file(cls, path: str, check_hash: bool | HashCheck = True, lazy_attachments: bool = False, trusted: bool = False) -> Document:
         """Load a document from a JSON file.
 
         Parameters
         ----------
         path : str
             The path to the JSON file.
+        check_hash : bool or str
+            How to check the hashes of the entries against the hashes in the file:
+
+            * True or ``'eager'`` (default): check each entry as it is loaded and raise a ValueError at the first mismatch.
+            * ``'deferred'``: don't check while loading, but keep the hashes in the file so that the document can be checked later with :meth:`verify`.
+            * ``'parallel'``: check every entry after loading with :meth:`verify`, with the attachments in a thread pool, and raise a
+              :class:`~quaac.common.HashMismatchError` listing every mismatch.
+            * False: don't check.
+        lazy_attachments : bool
+            If True, the content of each attachment is not loaded. Instead, the attachment references the byte range of its content
+            in the file and reads it when needed. See :meth:`Attachment.from_source <quaac.attachments.Attachment.from_source>`.
+        trusted : bool
+            If True, only the equipment, users, and attachments are validated and have their hashes checked. The data points
+            and the document are built without validation and take the hashes stored in the file as their own.
+            Use this to reload files written by this library quickly. See :meth:`~quaac.common.HashModel.construct_trusted`.
+        """
+        def load(context: dict) -> Document:
+            if not lazy_attachments:
+                with open(path, 'r') as f, phase('load.read') as p:
+                    text = f.read()
+                    p.add(bytes=len(text))
+                if trusted:
+                    with phase('load.parse', bytes=len(text)):
+                        document = json.loads(text)
+                    return validate_document(document, context, trusted=True)
+                with phase('load.validate') as p:
+                    document = Document.model_validate_json(text, context=context)
+                    p.add(objects=len(document.datapoints))
+                return document
+            document, tables = {}, {}
+            with open(path, 'r', encoding='utf-8', newline='') as f, phase('load.parse', bytes=Path(path).stat().st_size):
+                reader = JSONStreamReader(f, track_bytes=True)
+                for key in reader.iter_object():
+                    if key in REFERENCE_MODELS:
+                        tables[key] = read_reference_table(reader, key, path, context, lazy_attachments=True)
+                    else:
+                        document[key] = reader.decode_value()
+            return validate_document(document, context, tables, trusted=trusted)
+
+        return load_with_hash_check(load, check_hash)
+
+    @classmethod
+    async def aload_json(cls, path: str | Path, executor: Executor | None = None, **kwargs: Any) -> Document:
+        """Load a document from a JSON file without blocking the event loop. The file is read and validated in an executor.
+
+        Use :func:`~quaac.aio.amap` to load many files with bounded concurrency.
+
+        .. code-block:: python
+
+            doc = await Document.aload_json('history.json', check_hash='deferred')
+
+        Parameters
+        ----------
+        path : str or Path
+            The path to the JSON file.
+        executor : Executor | None
+            The executor to load the file in. If None, the event loop's default thread pool is used.
+        kwargs
+            Passed to :meth:`from_json_file`, e.g. ``check_hash``.
+        """
+        return await run_blocking(cls.from_json_file, path, executor=executor, **kwargs)
+
+    @classmethod
+    def iter_datapoints(cls, path: str | Path, check_hash: bool = True, lazy_attachments: bool = False) -> Iterator[DataPoint]:
+        """Iterate over the data points of a JSON file one at a time without loading the whole document.
+
+        The file is read twice: once to collect the equipment, users, and attachments tables and again
+        to yield each data point with its references resolved. Only the reference tables and the current
+        data point are held in memory.
+
+        .. note:: The document-level hash covers every data point and so is not checked. Each data point, equipment,
+                  user, and attachment is still checked against its own hash.
+
+        Parameters
+        ----------
+        path : str or Path
+            The path to the JSON file.
         check_hash : bool
-            Whether to check the hash of the file. This is True by default. If the file has been edited since it was created, an error will be raised.
+            Whether to check the hashes of the entries. This is True by default. If an entry has been edited since it was created, an error will be raised.
+        lazy_attachments : bool
+            If True, attachments reference the byte range of their content in the file rather than loading it. See :meth:`from_json_file`.
+        """
+        context = {'check_hash': check_hash}
+        tables = {}
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            reader = JSONStreamReader(f, track_bytes=lazy_attachments)
+            for key in reader.iter_object():
+                if key not in REFERENCE_MODELS:
+                    reader.skip_value()
+                    continue
+                tables[key] = read_reference_table(reader, key, path, context, lazy_attachments=lazy_attachments)
+        with open(path, 'r', encoding='utf-8') as f:
+            reader = JSONStreamReader(f)
+            for key in reader.iter_object():
+                if key != 'datapoints':
+                    reader.skip_value()
+                    continue
+                for d in reader.iter_array():
+                    resolve_references(d, tables['equipment'], tables['users'], tables['attachments'])
+                    with phase('load.validate', objects=1):
+                        datapoint = DataPoint.model_validate(d, context=context)
+                    yield datapoint
+
+    def to_bundle(self, path: str | Path, name: str = DOCUMENT_NAME, indent: int = 4) -> None:
+        """Write the document to a bundle: a directory or zip file with the document and a separate store of attachment content.
+        See :class:`~quaac.bundle.Bundle`.
+
+        If the bundle already exists, the document is added to it and attachments that are already stored are not written again.
+        A ValueError is raised if the bundle already contains a document of the same name, for both directory and zip bundles.
+
+        Parameters
+        ----------
+        path : str or Path
+            The path of the bundle. If it ends in ``.zip``, the bundle is a zip file; otherwise it is a directory.
+        name : str
+            The name of the document within the bundle.
+        indent : int
+            The indentation of the JSON document.
+        """
+        with Bundle(path) as bundle:
+            if bundle.has_document(name):
+                raise ValueError(f"The bundle {bundle.path} already contains {name}.")
+            if not bundle.is_zip:
+                with self.writer(bundle.path / name, indent=indent, bundle=bundle) as writer:
+                    writer.write_many(self.datapoints)
+                return
+            with tempfile.TemporaryDirectory() as directory:
+                with self.writer(Path(directory) / name, indent=indent, bundle=bundle) as writer:
+                    writer.write_many(self.datapoints)
+                bundle.add_document(Path(directory) / name, name)
+
+    @classmethod
+    def from_bundle(cls, path: str | Path, name: str = DOCUMENT_NAME, check_hash: bool | HashCheck = True) -> Document:
+        """Load a document from a bundle. See :meth:`to_bundle`.
+
+        Attachments are lazy; their content is read from the bundle by hash whenever it is needed.
+
+        Parameters
+        ----------
+        path : str or Path
+            The path of the bundle.
+        name : str
+            The name of the document within the bundle.
+        check_hash : bool or str
+            How to check the hashes: True or 'eager' (default), 'deferred', 'parallel', or False. See :meth:`from_json_file`.
+            Checking the hashes of attachments and the document reads the content of every attachment;
+            pass 'deferred' or False to only read the document itself.
+        """
+        bundle = Bundle(path)
+
+        def load(context: dict) -> Document:
+            with bundle.open_document(name) as f, phase('load.parse'):
+                document = json.load(f)
+            attachments = {}
+            for fields in document.pop('attachments'):
+                entry_hash = fields.pop('hash')
+                source = bundle.source(entry_hash, fields.get('encoding', 'base64'))
+                attachments[entry_hash] = Attachment.from_source(source, from_file_hash=entry_hash if context['check_hash'] else None, **fields)
+            return validate_document(document, context, {'attachments': attachments})
+
+        return load_with_hash_check(load, check_hash)
+
+    def to_binary_file(self, path: str | Path) -> None:
+        """Write the document to a compact binary file. See :mod:`quaac.binary`.
+
+        The binary file has the same structure as the JSON file, but attachment content is stored as raw (compressed) bytes
+        rather than base64 text and datetimes and numbers are packed rather than written as text,
+        so the file is smaller and much faster to load.
+        """
+        # the reference tables are collected from the datapoints as they are serialized, like DocumentWriter does,
+        # so that every reference of the datapoints written is in the tables
+        tables = {'equipment': {}, 'users': {}, 'attachments': {}}
+        datapoints = []
+        for datapoint in self.datapoints:
+            datapoints.append(binary_entry(datapoint))
+            users = [datapoint.performer] + ([datapoint.reviewer] if datapoint.reviewer is not None else [])
+            for key, entries in (('equipment', [datapoint.primary_equipment, *datapoint.ancillary_equipment]), ('users', users),
+                                 ('attachments', datapoint.attachments)):
+                for entry in entries:
+                    if entry.hash not in tables[key]:
+                        tables[key][entry.hash] = binary_entry(entry)
+        extras = self.model_dump(mode='json', include=set(self.model_extra or {}))
+        document = {'version': self.version, 'datapoints': datapoints, **extras, 'hash': self.hash,
+                    **{key: list(table.values()) for key, table in tables.items()}}
+        with open(path, 'wb') as f, phase('dump.binary', objects=len(self.datapoints)) as p:
+            write_header(f)
+            write_value(f, document)
+            p.add(bytes=f.tell())
+
+    @classmethod
+    def from_binary_file(cls, path: str | Path, check_hash: bool | HashCheck = True, trusted: bool = False) -> Document:
+        """Load a document from a binary file written by :meth:`to_binary_file`.
+
+        Parameters
+        ----------
+        path : str or Path
+            The path to the binary file.
+        check_hash : bool or str
+            How to check the hashes of the entries: True or 'eager' (default), 'deferred', 'parallel', or False. See :meth:`from_json_file`.
+        trusted : bool
+            If True, only the equipment, users, and attachments are validated and have their hashes checked. The data points
+            and the document are built without validation and take the hashes stored in the file as their own.
+            See :meth:`from_json_file`.
         """
-        with open(path, 'r') as f:
-            return Document.model_validate_json(f.read(), context={'check_hash': check_hash})
+        size = Path(path).stat().st_size
+        with open(path, 'rb') as f:
+            if not size:
+                raise ValueError(f"{path} is empty.")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, phase('load.parse', bytes=size):
+                document = BinaryReader.from_header(mm).read_value()
+        for attachment in document['attachments']:
+            attachment['content'] = get_encoder(attachment.get('encoding', 'base64'))(attachment['content'])
+        return load_with_hash_check(lambda context: validate_document(document, context, trusted=trusted), check_hash)
 
     def to_yaml_file(self, path: str) -> None:
         """Write the document to a YAML file."""
-        doc_yaml = yaml.safe_load(self.model_dump_json(by_alias=True))
-        with open(path, 'w') as f:
-            yaml.dump(doc_yaml, f, sort_keys=False)
+        with self.writer(path, format='yaml') as writer:
+            writer.write_many(self.datapoints)
 
     @classmethod
-    def from_yaml_file(cls, path: str, check_hash: bool = True) -> Document:
-        """Load a document from a YAML file."""
-        with open(path, 'r') as f:
-            json_str = json.dumps(yaml.safe_load(f))
-            return Document.model_validate_json(json_str)
+    def from_yaml_file(cls, path: str, check_hash: bool | HashCheck = True, trusted: bool = False) -> Document:
+        """Load a document from a YAML file.
+
+        The file is parsed with libyaml when PyYAML has been built with it and validated straight from the parsed objects.
+
+        Parameters
+        ----------
+        path : str
+            The path to the YAML file.
+        check_hash : bool or str
+            How to check the hashes of the entries: True or 'eager' (default), 'deferred', 'parallel', or False. See :meth:`from_json_file`.
+        trusted : bool
+            If True, only the equipment, users, and attachments are validated and have their hashes checked. The data points
+            and the document are built without validation and take the hashes stored in the file as their own.
+            See :meth:`from_json_file`.
+        """
+        with open(path, 'r') as f, phase('load.parse', bytes=Path(path).stat().st_size):
+            document = load_yaml(f)
+        return load_with_hash_check(lambda context: validate_document(document, context, trusted=trusted), check_hash)
 
     def merge(self, documents: list[Document]) -> Document:
-        """Merge other documents into a new document."""
+        """Merge other documents into a new document. Data points that are in more than one document,
+        i.e. that have the same hash, are only included once. The order of the data points is kept."""
         # check versions are the same
         if any(d.version != self.version for d in documents):
             raise ValueError("All documents must have the same version to merge.")
 
         # get all unique data points
-        all_data_points = self.datapoints + [datapoint for doc in documents for datapoint in doc.datapoints]
+        all_data_points = {}
+        datapoints = self.datapoints + [datapoint for doc in documents for datapoint in doc.datapoints]
+        with phase('merge', objects=len(datapoints)):
+            for datapoint in datapoints:
+                all_data_points.setdefault(datapoint.hash, datapoint)
+            return Document(datapoints=list(all_data_points.values()))
+
+    @classmethod
+    def merge_files(cls, paths: Iterable[str | Path], output: str | Path, format: Literal['json', 'yaml'] = 'json', check_hash: bool = True) -> int:
+        """Merge JSON files into a new file without loading them, ordering the data points by perform datetime and dropping duplicates.
+
+        JSON files (``.json``) are read with :meth:`iter_datapoints` and merged with :func:`~quaac.streaming.merge_datapoints`;
+        the result is written incrementally with a :class:`~quaac.streaming.DocumentWriter`. Attachment content is
+        streamed from the input files rather than loaded. Only one data point per file, plus the reference tables of
+        each file, is held in memory. YAML files (``.yaml``, ``.yml``) can't be streamed, so each is loaded whole
+        with :meth:`from_yaml_file` when the merge reaches it.
+
+        .. note:: The data points of each file must be ordered by perform datetime, as they are when written in time order.
+                  If not, a ValueError is raised.
+
+        The output is written to a temporary file that replaces it only once the merge has succeeded, so a failed merge
+        leaves an existing output file as it was.
+
+        Parameters
+        ----------
+        paths : iterable of str or Path
+            The JSON or YAML files to merge.
+        output : str or Path
+            The file to write.
+        format : str
+            The format of the output; 'json' or 'yaml'.
+        check_hash : bool
+            Whether to check the hashes of the entries of the input files.
+
+        Returns
+        -------
+        int
+            The number of data points written.
+
+        Raises
+        ------
+        ValueError
+            If a file isn't a JSON or YAML file, if the output is one of the files, or if the data points of a file aren't in order.
+        """
+        paths = [Path(path) for path in paths]
+        if Path(output).absolute() in {path.absolute() for path in paths}:
+            raise ValueError("The output file can't be one of the files being merged.")
+        unsupported = [str(path) for path in paths if path.suffix not in ('.json', '.yaml', '.yml')]
+        if unsupported:
+            raise ValueError(f"Only JSON (.json) and YAML (.yaml, .yml) files can be merged, not {', '.join(unsupported)}.")
+        sources = [cls.iter_datapoints(path, check_hash=check_hash, lazy_attachments=True) if path.suffix == '.json'
+                   else _iter_yaml_datapoints(path, check_hash) for path in paths]
+        count = 0
+        with phase('merge') as p, DocumentWriter(output, format=format) as writer:
+            for datapoint in merge_datapoints(*sources):
+                writer.write(datapoint)
+                count += 1
+            p.add(objects=count)
+        return count
+
+    @classmethod
+    def load_many(cls, paths: Iterable[str | Path], workers: int | None = None, merge: bool = False, check_hash: bool | HashCheck = True,
+                  trusted: bool = False, lazy_attachments: bool = True) -> list[Document] | Document:
+        """Load many files in a pool of processes, so that parsing, validating, and hashing use several cores.
+
+        JSON (``.json``) and YAML (``.yaml``, ``.yml``) files are loaded by their extension; other files are loaded as
+        binary files (see :meth:`to_binary_file`). Each file is loaded and its hashes checked in a worker process, and the
+        loaded document is sent back to this process with its hashes, so they are not computed again here.
+        By default, the attachments of JSON files are lazy, so only the location of their content in the file is sent back
+        rather than the content itself; the files must then stay in place while the attachments are used.
+        The attachment content of YAML and binary files is sent back in full.
+
+        .. note:: Workers don't inherit the context of the caller, e.g. the :func:`~quaac.common.hash_scheme`
+                  or :func:`~quaac.stats.collect_stats`.
+
+        .. code-block:: python
 
-        return Document(datapoints=all_data_points)
+            year = Document.load_many(sorted(Path('daily').glob('*.json')), workers=16, merge=True)
+
+        Parameters
+        ----------
+        paths : iterable of str or Path
+            The files to load.
+        workers : int | None
+            The number of processes. If None, the number of CPUs is used. 1 loads the files one after another in this process.
+        merge : bool
+            If True, the documents are merged into one with :meth:`merge`, in the order of the paths.
+        check_hash : bool or str
+            How to check the hashes of the entries: True or 'eager' (default), 'deferred', 'parallel', or False. See :meth:`from_json_file`.
+        trusted : bool
+            Whether to skip validating the data points and the document. See :meth:`from_json_file`.
+        lazy_attachments : bool
+            Whether the attachments of JSON files reference their content in the file rather than load it (default).
+            See :meth:`from_json_file`.
+
+        Returns
+        -------
+        list of Document or Document
+            The documents in the order of the paths, or the merged document if ``merge`` is True.
+
+        Raises
+        ------
+        ValueError
+            If a file fails to load, naming the file.
+        """
+        paths = [Path(path) for path in paths]
+        load = partial(_load_file, check_hash=check_hash, trusted=trusted, lazy_attachments=lazy_attachments)
+        if workers == 1 or len(paths) < 2:
+            documents = [load(path) for path in paths]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            workers = min(workers or os.cpu_count() or 1, len(paths))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # send several small files to a worker at a time
+                documents = list(executor.map(load, paths, chunksize=max(1, len(paths) // (workers * 4))))
+        if not merge:
+            return documents
+        if not documents:
+            return Document(datapoints=[])
+        return documents[0].merge(documents[1:])
 
     @model_validator(mode='before')
     @classmethod
@@ -150,16 +731,141 @@ class Document(HashModel, validate_assignment=True):
         # in python mode, objects are already loaded
         if info.mode == 'python':
             return data
-        # Create a lookup table for each type of object
-        equipment = {e['hash']: e for e in data['equipment']}
-        users = {u['hash']: u for u in data['users']}
-        attachments = {a['hash']: a for a in data['attachments']}
-        # Replace the hashes with the actual objects
-        for d in data['datapoints']:
-            d['primary equipment'] = equipment[split_hash(d['primary equipment'])]
-            d['ancillary equipment'] = [equipment[split_hash(a)] for a in d['ancillary equipment']]
-            d['performer'] = users[split_hash(d['performer'])]
-            if d['reviewer']:
-                d['reviewer'] = users[split_hash(d['reviewer'])]
-            d['attachments'] = [attachments[split_hash(f)] for f in d['attachments']]
+        # Create a lookup table for each type of object. Each entry is validated (and its hash checked)
+        # once here and the same instance is shared by every data point that references it.
+        # the tables are popped so that they aren't kept as extra fields, which would be written again when the document is saved
+        with phase('load.references') as p:
+            tables = {key: validate_reference_table(key, data.pop(key), info.context) for key in REFERENCE_MODELS}
+            # Replace the hashes with the actual objects
+            for d in data['datapoints']:
+                resolve_references(d, tables['equipment'], tables['users'], tables['attachments'])
+            p.add(objects=sum(len(table) for table in tables.values()))
         return data
+
+
+REFERENCE_MODELS = {'equipment': Equipment, 'users': User, 'attachments': Attachment}
+
+
+@lru_cache(maxsize=None)
+def _datapoints_adapter() -> TypeAdapter:
+    """The validator of lists of data points. Like the models, it is built when first used rather than on import."""
+    return TypeAdapter(List[DataPoint])
+
+
+def validate_document(document: dict, context: dict, tables: dict[str, dict[str, HashModel]] | None = None, trusted: bool = False) -> Document:
+    """Validate a document that has been deserialized to Python objects, e.g. from YAML, rather than from JSON.
+
+    The reference tables are validated from the document unless given, e.g. when they have been read separately.
+    If ``trusted`` is True, only the reference tables are validated; the data points and the document are built
+    with :meth:`~quaac.common.HashModel.construct_trusted`."""
+    tables = dict(tables or {})
+    with phase('load.references') as p:
+        for key in REFERENCE_MODELS:
+            entries = document.pop(key, [])
+            if key not in tables:
+                tables[key] = validate_reference_table(key, entries, context)
+                p.add(objects=len(tables[key]))
+        for d in document.get('datapoints', []):
+            resolve_references(d, tables['equipment'], tables['users'], tables['attachments'])
+    with phase('load.validate', objects=len(document.get('datapoints', []))):
+        if trusted:
+            document['datapoints'] = [DataPoint.construct_trusted(d) for d in document.get('datapoints', [])]
+            return Document.construct_trusted(document)
+        return Document.model_validate(document, context=context)
+
+
+def _load_file(path: Path, check_hash: bool | HashCheck, trusted: bool, lazy_attachments: bool) -> Document:
+    """Load a file by its extension for :meth:`Document.load_many`. Errors are raised as a ValueError naming the file,
+    as not every error, e.g. a :class:`~quaac.common.HashMismatchError`, can be sent back from a worker process."""
+    try:
+        if path.suffix == '.json':
+            return Document.from_json_file(path, check_hash=check_hash, trusted=trusted, lazy_attachments=lazy_attachments)
+        if path.suffix in ('.yaml', '.yml'):
+            return Document.from_yaml_file(path, check_hash=check_hash, trusted=trusted)
+        return Document.from_binary_file(path, check_hash=check_hash, trusted=trusted)
+    except Exception as e:
+        raise ValueError(f"Failed to load {path}: {e}") from None
+
+
+def _iter_yaml_datapoints(path: Path, check_hash: bool) -> Iterator[DataPoint]:
+    """The data points of a YAML file for :meth:`Document.merge_files`. The file is loaded when the first data point is needed."""
+    yield from Document.from_yaml_file(str(path), check_hash=check_hash).datapoints
+
+
+def load_with_hash_check(load: Callable[[dict], Document], check_hash: bool | HashCheck) -> Document:
+    """Load a document with one of the hash checks of :meth:`Document.from_json_file`. ``load`` is called with the validation context."""
+    if check_hash not in (True, False, 'eager', 'deferred', 'parallel'):
+        raise ValueError(f"Unsupported hash check: {check_hash!r}")
+    with deferred_hash_checks(check_hash in ('deferred', 'parallel')):
+        document = load({'check_hash': check_hash is not False})
+    if check_hash == 'parallel':
+        document.verify(workers=None).check()
+    return document
+
+
+def validate_reference_table(key: str, entries: Iterable[dict], context: dict | None) -> dict[str, HashModel]:
+    """Validate each entry of a reference table ('equipment', 'users', or 'attachments'), keyed by the hash it was saved with."""
+    model = REFERENCE_MODELS[key]
+    return {entry['hash']: model.model_validate(entry, context=context) for entry in entries}
+
+
+def read_reference_table(reader: JSONStreamReader, key: str, path: str | Path, context: dict, lazy_attachments: bool = False) -> dict[str, HashModel]:
+    """Read and validate the reference table at the current position of the reader, keyed by the hash it was saved with.
+
+    If ``lazy_attachments`` is True, the content of each attachment is left in the file and referenced by its byte range.
+    The reader must track bytes and the file must have been opened with ``encoding='utf-8', newline=''``.
+    """
+    with phase('load.references') as p:
+        table = _read_reference_table(reader, key, path, context, lazy_attachments)
+        p.add(objects=len(table))
+    return table
+
+
+def _read_reference_table(reader: JSONStreamReader, key: str, path: str | Path, context: dict, lazy_attachments: bool) -> dict[str, HashModel]:
+    if key != 'attachments' or not lazy_attachments:
+        return validate_reference_table(key, reader.iter_array(), context)
+    attachments = {}
+    for _ in reader.iter_array(decode=False):
+        fields, source = {}, None
+        for field in reader.iter_object():
+            if field != 'content':
+                fields[field] = reader.decode_value()
+                continue
+            start, end, escaped = reader.string_span()
+            source = ByteRangeSource(Path(path).absolute(), start, end - start)
+            if escaped:
+                # only plain strings can be referenced directly; this isn't the case for base64 written by this library
+                fields['content'] = json.loads(b'"' + b''.join(source.iter_encoded()) + b'"')
+                source = None
+        entry_hash = fields.pop('hash')
+        from_file_hash = entry_hash if context.get('check_hash', True) else None
+        if source is None:
+            attachments[entry_hash] = Attachment.model_validate({**fields, 'hash': entry_hash}, context=context)
+        else:
+            attachments[entry_hash] = Attachment.from_source(source, from_file_hash=from_file_hash, **fields)
+    return attachments
+
+
+def binary_entry(entry: HashModel) -> dict:
+    """Serialize an entry for the binary format. This is the JSON form, except that datetime fields are kept as datetimes
+    and the content of attachments is streamed as raw bytes."""
+    exclude = {'content'} if isinstance(entry, Attachment) else None
+    data = entry.model_dump(mode='json', by_alias=True, exclude=exclude)
+    for name, field in type(entry).model_fields.items():
+        value = entry.__dict__.get(name)
+        if isinstance(value, datetime):
+            data[field.alias or name] = value
+    if isinstance(entry, Attachment):
+        data['content'] = ByteStream(entry.iter_decoded())
+    return data
+
+
+def resolve_references(datapoint: dict, equipment: dict, users: dict, attachments: dict) -> dict:
+    """Replace the named hashes of a serialized data point with the entries of the given lookup tables, keyed by hash."""
+    datapoint['primary equipment'] = equipment[split_hash(datapoint['primary equipment'])]
+    datapoint['ancillary equipment'] = [equipment[split_hash(a)] for a in datapoint['ancillary equipment']]
+    datapoint['performer'] = users[split_hash(datapoint['performer'])]
+    if datapoint['reviewer']:
+        datapoint['reviewer'] = users[split_hash(datapoint['reviewer'])]
+    datapoint['attachments'] = [attachments[split_hash(f)] for f in datapoint['attachments']]
+    return datapoint
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from operator import is_
+from typing import TYPE_CHECKING
+
+from .columns import posix_timestamp
+from .common import HashModel, split_hash
+
+if TYPE_CHECKING:
+    from .attachments import Attachment
+    from .models import DataPoint, Equipment, User
+
+
+class ReferenceRegistry:
+    """An index of the equipment, users, and attachments referenced by a list of data points, keyed by hash.
+
+    Data points appended to the list are indexed incrementally on the next :meth:`sync`; if the data points already
+    indexed have been replaced, reordered, or removed, the registry is rebuilt. Entries are kept in the order they are first referenced.
+    """
+
+    def __init__(self):
+        self.equipment: dict[str, Equipment] = {}
+        self.users: dict[str, User] = {}
+        self.attachments: dict[str, Attachment] = {}
+        self.datapoints_by_equipment: dict[str, list[DataPoint]] = {}
+        self.datapoints_by_user: dict[str, list[DataPoint]] = {}
+        self.datapoints_by_attachment: dict[str, list[DataPoint]] = {}
+        # the data points indexed, in order, to detect changes to the list other than appends
+        self._indexed: list[DataPoint] = []
+
+    def sync(self, datapoints: list[DataPoint]) -> ReferenceRegistry:
+        """Bring the registry up to date with the given list of data points."""
+        if not is_extension(self._indexed, datapoints):
+            self.__init__()
+        for datapoint in datapoints[len(self._indexed):]:
+            self._add(datapoint)
+            self._indexed.append(datapoint)
+        return self
+
+    def _add(self, datapoint: DataPoint) -> None:
+        """Index the references of a single data point."""
+        equipment = [datapoint.primary_equipment, *datapoint.ancillary_equipment]
+        users = [datapoint.performer] + ([datapoint.reviewer] if datapoint.reviewer is not None else [])
+        for entries, table, index in ((equipment, self.equipment, self.datapoints_by_equipment),
+                                      (users, self.users, self.datapoints_by_user),
+                                      (datapoint.attachments, self.attachments, self.datapoints_by_attachment)):
+            # a data point can reference the same entry twice, e.g. as performer and reviewer
+            for entry_hash, entry in {e.hash: e for e in entries}.items():
+                table.setdefault(entry_hash, entry)
+                index.setdefault(entry_hash, []).append(datapoint)
+
+
+class DatapointIndex:
+    """Secondary indexes of a list of data points for :meth:`Document.query <quaac.models.Document.query>`.
+
+    Data points are indexed by position in the list, by name, primary equipment hash, and performer hash,
+    and by the POSIX timestamp of the perform datetime in sorted order so that datetime ranges are found by bisection.
+    Datetimes without a time zone are taken to be UTC, like :func:`~quaac.columns.posix_timestamp`, so naive and
+    aware datetimes can be mixed. Data points appended to the list are indexed incrementally on the next :meth:`sync`;
+    if the data points already indexed have been replaced, reordered, or removed, the indexes are rebuilt.
+    """
+
+    def __init__(self):
+        self.by_name: dict[str, list[int]] = {}
+        self.by_primary_equipment: dict[str, list[int]] = {}
+        self.by_performer: dict[str, list[int]] = {}
+        # the timestamps of the perform datetimes in sorted order and the position of the data point of each
+        self.timestamps: list[float] = []
+        self.timestamp_positions: list[int] = []
+        # the data points indexed, in order, to detect changes to the list other than appends
+        self._indexed: list[DataPoint] = []
+
+    def sync(self, datapoints: list[DataPoint]) -> DatapointIndex:
+        """Bring the indexes up to date with the given list of data points."""
+        if not is_extension(self._indexed, datapoints):
+            self.__init__()
+        added = []
+        for position in range(len(self._indexed), len(datapoints)):
+            datapoint = datapoints[position]
+            self.by_name.setdefault(datapoint.name, []).append(position)
+            self.by_primary_equipment.setdefault(datapoint.primary_equipment.hash, []).append(position)
+            self.by_performer.setdefault(datapoint.performer.hash, []).append(position)
+            added.append((posix_timestamp(datapoint.perform_datetime), position))
+        self._indexed.extend(datapoints[len(self._indexed):])
+        self._add_timestamps(added)
+        return self
+
+    def _add_timestamps(self, added: list[tuple[float, int]]) -> None:
+        """Add (timestamp, position) pairs to the sorted timestamps, sorting once per sync rather than inserting each."""
+        if not added:
+            return
+        added.sort()
+        if self.timestamps and added[0][0] < self.timestamps[-1]:
+            # appended data points older than the newest indexed one; sorting two sorted runs is about linear
+            added = sorted([*zip(self.timestamps, self.timestamp_positions), *added])
+            self.timestamps, self.timestamp_positions = [], []
+        self.timestamps.extend(t for t, _ in added)
+        self.timestamp_positions.extend(p for _, p in added)
+
+    def select(self, name: str | None = None, equipment: HashModel | str | None = None, performer: HashModel | str | None = None,
+               since: datetime | None = None, until: datetime | None = None) -> list[int]:
+        """The positions of the data points that match all the given filters, in order. See :meth:`Document.query <quaac.models.Document.query>`."""
+        candidates = []
+        if name is not None:
+            candidates.append(self.by_name.get(name, []))
+        if equipment is not None:
+            candidates.append(self.by_primary_equipment.get(hash_key(equipment), []))
+        if performer is not None:
+            candidates.append(self.by_performer.get(hash_key(performer), []))
+        if since is not None or until is not None:
+            start = 0 if since is None else bisect_left(self.timestamps, posix_timestamp(since))
+            end = len(self.timestamps) if until is None else bisect_right(self.timestamps, posix_timestamp(until))
+            candidates.append(self.timestamp_positions[start:end])
+        if not candidates:
+            return list(range(len(self._indexed)))
+        # intersect starting from the most selective filter
+        candidates.sort(key=len)
+        selected = set(candidates[0])
+        for positions in candidates[1:]:
+            if not selected:
+                break
+            selected.intersection_update(positions)
+        return sorted(selected)
+
+
+def is_extension(indexed: list[DataPoint], datapoints: list[DataPoint]) -> bool:
+    """Whether a list of data points starts with the same objects, in the same order, as the data points indexed from it."""
+    return len(datapoints) >= len(indexed) and all(map(is_, indexed, datapoints))
+
+
+def hash_key(reference: HashModel | str) -> str:
+    """The hash of an entry, or of a hash or named hash string."""
+    if isinstance(reference, HashModel):
+        return reference.hash
+    return split_hash(reference)
@@ -0,0 +1,192 @@
+"""Opt-in timing of the phases of loading, saving, and merging documents and encoding and decoding attachments.
+
+.. code-block:: python
+
+    from quaac.stats import collect_stats
+
+    with collect_stats() as stats:
+        doc = Document.from_json_file('archive.json')
+    print(stats.report())
+
+Phases are named ``<operation>.<phase>``, e.g. ``load.parse`` or ``attachment.decode``. See :data:`PHASES`.
+Phases can be nested in others, e.g. ``hash.check`` is within ``load.validate``, so the times of nested phases
+are included in the times of the phases around them.
+
+Outside :func:`collect_stats`, each phase costs a context variable lookup and nothing is recorded.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
+
+# the phases recorded by the library and what their objects and bytes count
+PHASES = {
+    'load.read': "Reading a file into memory. Bytes: the characters read.",
+    'load.parse': "Parsing JSON, YAML, or binary into Python objects. Bytes: the size of the file.",
+    'load.references': "Validating the equipment, users, and attachments tables and resolving the references of the data points to them. "
+                       "Objects: the entries of the tables.",
+    'load.validate': "Validating the data points and the document, or building them for trusted loads. For JSON files loaded eagerly, "
+                     "this includes parsing and load.references as pydantic parses and validates in one pass. Objects: the data points.",
+    'hash.check': "Computing the hashes of entries to check them against the hashes they were saved with. Objects: the entries.",
+    'hash.verify': "Verifying a loaded document with Document.verify(). Objects: the entries checked.",
+    'dump.datapoints': "Serializing and writing data points. Objects: the data points.",
+    'dump.hash': "Computing the document hash when writing a document.",
+    'dump.tables': "Writing the equipment, users, and attachments tables and closing the file. Objects: the entries of the tables. "
+                   "Bytes: the size of the whole file.",
+    'dump.binary': "Writing a binary file. Objects: the data points. Bytes: the size of the file.",
+    'merge': "Merging documents or files. Objects: the data points written, or read for in-memory merges.",
+    'attachment.encode': "Compressing and encoding the content of an attachment. Objects: the attachments. Bytes: the raw content.",
+    'attachment.decode': "Decoding and decompressing the content of an attachment. Objects: the attachments. Bytes: the raw content.",
+}
+
+
+@dataclass
+class PhaseStats:
+    """The totals of a phase.
+
+    Attributes
+    ----------
+    seconds : float
+        The wall time spent in the phase.
+    calls : int
+        The number of times the phase was run.
+    objects : int
+        The number of objects processed, e.g. data points. See :data:`PHASES`.
+    bytes : int
+        The number of bytes processed. See :data:`PHASES`.
+    """
+    seconds: float = 0.0
+    calls: int = 0
+    objects: int = 0
+    bytes: int = 0
+
+
+@dataclass
+class Stats:
+    """The phases recorded within :func:`collect_stats`, in the order they were first run."""
+    phases: dict[str, PhaseStats] = field(default_factory=dict)
+    callback: Callable[[str, PhaseStats], None] | None = None
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def __getitem__(self, name: str) -> PhaseStats:
+        """The totals of a phase. Phases that weren't run have zero totals."""
+        return self.phases.get(name, PhaseStats())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.phases
+
+    def record(self, name: str, seconds: float = 0.0, objects: int = 0, bytes: int = 0) -> None:
+        """Add a run of a phase to its totals and pass it to the callback, if any."""
+        with self._lock:
+            totals = self.phases.setdefault(name, PhaseStats())
+            totals.seconds += seconds
+            totals.calls += 1
+            totals.objects += objects
+            totals.bytes += bytes
+        if self.callback is not None:
+            self.callback(name, PhaseStats(seconds, 1, objects, bytes))
+
+    def report(self) -> str:
+        """The totals of each phase as a text table."""
+        lines = [f"{'phase':<20}{'calls':>8}{'objects':>10}{'MiB':>10}{'seconds':>10}"]
+        for name, totals in self.phases.items():
+            lines.append(f"{name:<20}{totals.calls:>8}{totals.objects:>10}{totals.bytes / 2 ** 20:>10.2f}{totals.seconds:>10.4f}")
+        return '\n'.join(lines)
+
+
+_current_stats: ContextVar[Stats | None] = ContextVar('quaac_stats', default=None)
+
+
+class Phase:
+    """A run of a phase that is being timed. Use :func:`phase` to create one."""
+    __slots__ = ('stats', 'name', 'objects', 'bytes', '_start')
+
+    def __init__(self, stats: Stats, name: str, objects: int = 0, bytes: int = 0):
+        self.stats = stats
+        self.name = name
+        self.objects = objects
+        self.bytes = bytes
+
+    def __enter__(self) -> Phase:
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.stats.record(self.name, time.perf_counter() - self._start, self.objects, self.bytes)
+
+    def add(self, objects: int = 0, bytes: int = 0) -> None:
+        """Add to the objects and bytes of the run, e.g. once they are known."""
+        self.objects += objects
+        self.bytes += bytes
+
+    def counted(self, chunks: Iterable[T]) -> Iterator[T]:
+        """Pass through an iterable of chunks, e.g. bytes, adding their lengths to the bytes of the run."""
+        for chunk in chunks:
+            self.bytes += len(chunk)
+            yield chunk
+
+
+class _NullPhase:
+    """The phase returned outside :func:`collect_stats`. It records nothing."""
+    __slots__ = ()
+
+    def __enter__(self) -> _NullPhase:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        pass
+
+    def add(self, objects: int = 0, bytes: int = 0) -> None:
+        pass
+
+    def counted(self, chunks: Iterable[T]) -> Iterable[T]:
+        return chunks
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def phase(name: str, objects: int = 0, bytes: int = 0) -> Phase | _NullPhase:
+    """Time a phase within a ``with`` block if stats are being collected.
+
+    .. code-block:: python
+
+        with phase('load.read') as p:
+            text = f.read()
+            p.add(bytes=len(text))
+    """
+    stats = _current_stats.get()
+    if stats is None:
+        return _NULL_PHASE
+    return Phase(stats, name, objects, bytes)
+
+
+def get_stats() -> Stats | None:
+    """The stats being collected, or None outside :func:`collect_stats`."""
+    return _current_stats.get()
+
+
+@contextmanager
+def collect_stats(callback: Callable[[str, PhaseStats], None] | None = None) -> Iterator[Stats]:
+    """Record the wall time, objects, and bytes of each phase run in this context.
+
+    Stats are also recorded for work done by the library's thread pools, e.g. by
+    :meth:`Attachment.from_files <quaac.attachments.Attachment.from_files>`.
+
+    Parameters
+    ----------
+    callback : callable | None
+        If given, called with the name and stats of each run of a phase as it ends, e.g. to send them to a metrics system.
+    """
+    stats = Stats(callback=callback)
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
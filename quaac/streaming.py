@@ -0,0 +1,526 @@
+from __future__ import annotations
+
+import heapq
+import json
+import os
+import re
+import tempfile
+import textwrap
+from pathlib import Path
+from functools import lru_cache
+from operator import itemgetter
+from typing import IO, TYPE_CHECKING, Any, Iterable, Iterator, Literal
+
+from .columns import posix_timestamp
+from .common import get_hash_scheme, is_merkle_scheme, iter_streamed_json, new_hasher, prefix_hash, streamed_values
+from .stats import phase
+
+if TYPE_CHECKING:
+    from .bundle import Bundle
+    from .common import HashModel
+    from .models import DataPoint
+
+CHUNK_SIZE = 64 * 1024
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRING_CHARACTERS = re.compile(r'[^"\\]*')
+
+
+class JSONStreamReader:
+    """Walk a JSON document incrementally, decoding one value at a time.
+
+    Only the unconsumed part of the file that is needed to decode the current value is held in memory.
+    Objects and arrays can be walked item-by-item with :meth:`iter_object` and :meth:`iter_array`
+    so that very large containers (e.g. the data points of a QuAAC document) never have to be loaded whole.
+
+    Parameters
+    ----------
+    f : file-like
+        A text file opened for reading.
+    chunk_size : int
+        The minimum number of characters to read from the file at a time.
+    track_bytes : bool
+        Whether to keep count of the UTF-8 byte position in the file so that :meth:`string_span` can be used.
+        The file should be opened with ``encoding='utf-8', newline=''`` so that characters map exactly onto the bytes of the file.
+    """
+
+    def __init__(self, f: IO[str], chunk_size: int = CHUNK_SIZE, track_bytes: bool = False):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._track_bytes = track_bytes
+        self._buffer = ''
+        self._pos = 0
+        # the number of bytes of the file before the start of the buffer
+        self._offset = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        """Read more of the file into the buffer, dropping what has been consumed. Returns False at the end of the file."""
+        if self._eof:
+            return False
+        # grow the read size with the pending data so that a value much larger than a chunk
+        # is not re-decoded from the start once per chunk
+        chunk = self._f.read(max(self._chunk_size, len(self._buffer) - self._pos))
+        if self._track_bytes:
+            self._offset += len(self._buffer[:self._pos].encode('utf-8'))
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        if not chunk:
+            self._eof = True
+        return bool(chunk)
+
+    def _peek(self) -> str:
+        """Skip whitespace and return the next character without consuming it. Returns an empty string at the end of the file."""
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char: str) -> None:
+        """Consume the given structural character or raise an error."""
+        found = self._peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' but found '{found}' while reading the JSON stream.")
+        self._pos += 1
+
+    def _end_of_item(self, closing: str) -> bool:
+        """Consume the separator after an item. Returns True if the container was closed."""
+        found = self._peek()
+        self._pos += 1
+        if found == ',':
+            return False
+        if found == closing:
+            return True
+        raise ValueError(f"Expected ',' or '{closing}' but found '{found}' while reading the JSON stream.")
+
+    def decode_value(self) -> Any:
+        """Decode the next complete JSON value."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # the value is most likely cut off at the end of the buffer
+                if not self._fill():
+                    raise
+                continue
+            # a number at the very end of the buffer may continue in the next chunk
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def byte_position(self) -> int:
+        """The position in the file, in bytes. Requires ``track_bytes``."""
+        if not self._track_bytes:
+            raise ValueError("The reader was not created with track_bytes=True.")
+        return self._offset + len(self._buffer[:self._pos].encode('utf-8'))
+
+    def string_span(self) -> tuple[int, int, bool]:
+        """Consume the string at the current position without decoding it. Requires ``track_bytes``.
+
+        Returns the start and end byte positions of the string's contents (excluding the quotes)
+        and whether it contains any escape sequences.
+        """
+        self._expect('"')
+        start = self.byte_position()
+        escaped = False
+        while True:
+            self._pos = _STRING_CHARACTERS.match(self._buffer, self._pos).end()
+            # an escape sequence needs the character after the backslash to be in the buffer too
+            if self._pos + 1 >= len(self._buffer) and self._buffer[self._pos:] != '"':
+                if not self._fill():
+                    raise ValueError("Unterminated string while reading the JSON stream.")
+                continue
+            if self._buffer[self._pos] == '\\':
+                escaped = True
+                self._pos += 2
+                continue
+            end = self.byte_position()
+            self._pos += 1
+            return start, end, escaped
+
+    def skip_value(self) -> None:
+        """Consume the next JSON value without holding all of it in memory."""
+        char = self._peek()
+        if char == '{':
+            for _ in self.iter_object():
+                self.skip_value()
+        elif char == '[':
+            for _ in self.iter_array(decode=False):
+                self.skip_value()
+        else:
+            self.decode_value()
+
+    def iter_object(self) -> Iterator[str]:
+        """Iterate over the keys of the object at the current position.
+
+        After each key is yielded the caller must consume its value with
+        :meth:`decode_value`, :meth:`skip_value` or :meth:`iter_array`.
+        """
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.decode_value()
+            self._expect(':')
+            yield key
+            if self._end_of_item('}'):
+                return
+
+    def iter_array(self, decode: bool = True) -> Iterator[Any]:
+        """Iterate over the items of the array at the current position.
+
+        Parameters
+        ----------
+        decode : bool
+            If True, each item is decoded and yielded. If False, None is yielded for each item and the caller
+            must consume the item itself, e.g. with :meth:`skip_value`.
+        """
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self.decode_value() if decode else None
+            if self._end_of_item(']'):
+                return
+
+
+class DocumentWriter:
+    """Write a QuAAC document to disk one data point at a time.
+
+    Each data point is written as soon as it is given to the writer. The equipment, users, and attachments
+    it references are spooled to temporary files and written as the reference tables when the writer is closed,
+    so memory use does not grow with the number of data points. The document hash is computed incrementally
+    and matches :attr:`Document.hash <quaac.models.Document.hash>` for the same data points.
+
+    The document is written to a temporary file next to the output, which replaces the output when the writer is closed.
+    If an exception is raised inside the ``with`` block, the temporary file is deleted and an existing output file is left as it was.
+    Attachments whose content is read lazily from the output file can't be written, as the file is replaced.
+
+    .. code-block:: python
+
+        with DocumentWriter('history.json') as writer:
+            for datapoint in produce_datapoints():
+                writer.write(datapoint)
+
+    Parameters
+    ----------
+    path : str or Path
+        The path of the file to write.
+    format : str
+        The format of the file; 'json' or 'yaml'.
+    indent : int | None
+        The indentation of the JSON output. Ignored for YAML.
+    version : str
+        The QuAAC version of the document.
+    hash_scheme : str | None
+        The scheme of the document hash. If None, the current :func:`~quaac.common.get_hash_scheme` is used.
+    bundle : Bundle | None
+        If given, the content of each attachment is stored in the :class:`~quaac.bundle.Bundle` rather than written to the file.
+        The bundle must be open.
+    extras
+        Any extra top-level fields of the document.
+    """
+
+    def __init__(self, path: str | Path, format: Literal['json', 'yaml'] = 'json', indent: int | None = 4, version: str = '1.0', hash_scheme: str | None = None, bundle: Bundle | None = None, **extras: Any):
+        if format not in ('json', 'yaml'):
+            raise ValueError(f"Unsupported format: {format}")
+        self.path = Path(path)
+        self.format = format
+        self.indent = indent
+        self.version = version
+        self.hash_scheme = hash_scheme or get_hash_scheme()
+        self.bundle = bundle
+        self.extras = extras
+        self._file: IO[str] | None = None
+        self._temp_path: Path | None = None
+        self._count = 0
+        # the hash form of each data point, in order, and the JSON of each referenced entry keyed by hash
+        self._datapoint_spool: IO[str] | None = None
+        self._tables: dict[str, _Spool] = {}
+
+    def __enter__(self) -> DocumentWriter:
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._release()
+
+    def open(self) -> None:
+        """Open a temporary file next to the output and write the header of the document."""
+        self._temp_path = self.path.with_name(f'.{self.path.name}.{os.urandom(4).hex()}.tmp')
+        self._file = open(self._temp_path, 'w')
+        self._datapoint_spool = tempfile.TemporaryFile('w+', encoding='utf-8')
+        self._tables = {key: _Spool() for key in ('equipment', 'users', 'attachments')}
+        if self.format == 'json':
+            self._file.write('{' + self._newline(1) + f'"version": {json.dumps(self.version)},' + self._newline(1) + '"datapoints": [')
+        else:
+            self._file.write(_dump_yaml({'version': self.version}))
+
+    def write(self, datapoint: DataPoint) -> None:
+        """Write a data point to the file and record the entries it references."""
+        with phase('dump.datapoints', objects=1):
+            self._write(datapoint)
+
+    def _write(self, datapoint: DataPoint) -> None:
+        for attachment in datapoint.attachments:
+            source_path = getattr(attachment._source, 'path', None)
+            if source_path is not None and Path(source_path).absolute() == self.path.absolute():
+                raise ValueError(f"The content of attachment '{attachment.name}' is read from {self.path}, so it can't be written to that file. "
+                                 f"Write to another path.")
+        entry = datapoint.model_dump(mode='json', by_alias=True)
+        if is_merkle_scheme(self.hash_scheme):
+            self._datapoint_spool.write(json.dumps(datapoint.hash) + '\n')
+        else:
+            self._datapoint_spool.write(_hash_form(entry, type(datapoint)) + '\n')
+        if self.format == 'json':
+            separator = ',' if self._count else ''
+            self._file.write(separator + self._newline(2) + self._dump_json(entry, depth=2))
+        else:
+            if not self._count:
+                self._file.write('datapoints:\n')
+            self._file.write(_dump_yaml([entry]))
+        self._count += 1
+        self._tables['equipment'].add(datapoint.primary_equipment)
+        for equipment in datapoint.ancillary_equipment:
+            self._tables['equipment'].add(equipment)
+        self._tables['users'].add(datapoint.performer)
+        if datapoint.reviewer is not None:
+            self._tables['users'].add(datapoint.reviewer)
+        for attachment in datapoint.attachments:
+            self._tables['attachments'].add(attachment)
+            if self.bundle is not None:
+                self.bundle.add(attachment)
+
+    def write_many(self, datapoints: Iterable[DataPoint]) -> None:
+        """Write several data points to the file."""
+        for datapoint in datapoints:
+            self.write(datapoint)
+
+    def close(self) -> None:
+        """Write the reference tables and the document hash, close the file, and move it to the output path."""
+        try:
+            with phase('dump.hash'):
+                doc_hash = self._document_hash()
+            with phase('dump.tables', objects=sum(len(table) for table in self._tables.values())) as p:
+                self._write_tables(doc_hash)
+                p.add(bytes=self._file.tell())
+        except BaseException:
+            self._release()
+            raise
+        self._release(replace=True)
+
+    def _write_tables(self, doc_hash: str) -> None:
+        """Write the end of the data points, the extra fields, the document hash, and the reference tables."""
+        if self.format == 'json':
+            self._file.write((self._newline(1) if self._count else '') + '],')
+            for key, value in self.extras.items():
+                self._file.write(self._newline(1) + f'{json.dumps(key)}: {self._dump_json(value, depth=1)},')
+            self._file.write(self._newline(1) + f'"hash": {json.dumps(doc_hash)}')
+            for key, table in self._tables.items():
+                self._file.write(',' + self._newline(1) + f'"{key}": [')
+                for i, (entry, streams) in enumerate(self._table_entries(key)):
+                    self._file.write((',' if i else '') + self._newline(2))
+                    # large values such as lazy attachment content are streamed into the file
+                    for piece in iter_streamed_json(self._dump_json(entry, depth=2), streams):
+                        self._file.write(piece)
+                self._file.write((self._newline(1) if len(table) else '') + ']')
+            self._file.write(self._newline(0) + '}')
+        else:
+            if not self._count:
+                self._file.write('datapoints: []\n')
+            self._file.write(_dump_yaml({**self.extras, 'hash': doc_hash}))
+            for key, table in self._tables.items():
+                if not len(table):
+                    self._file.write(f'{key}: []\n')
+                    continue
+                self._file.write(f'{key}:\n')
+                for entry, streams in self._table_entries(key):
+                    self._file.write(_dump_yaml([_materialize(entry, streams)]))
+
+    def _table_entries(self, key: str) -> Iterator[tuple[dict, dict]]:
+        """The entries of a reference table as they are written. Bundled attachment content is left out."""
+        for entry, streams in self._tables[key].entries():
+            if key == 'attachments' and self.bundle is not None:
+                entry.pop('content', None)
+            yield entry, streams
+
+    def _release(self, replace: bool = False) -> None:
+        """Close the output and spool files, and either move the output to its path or delete it."""
+        for f in (self._file, self._datapoint_spool, *(t.file for t in self._tables.values())):
+            if f is not None:
+                f.close()
+        if self._temp_path is None:
+            return
+        if replace:
+            os.replace(self._temp_path, self.path)
+        elif self._temp_path.exists():
+            self._temp_path.unlink()
+        self._temp_path = None
+
+    def _document_hash(self) -> str:
+        """Compute the document hash the same way :func:`~quaac.common.create_hash_from_entry` would for the whole document."""
+        streamed = {'datapoints': self._datapoint_lines}
+        if not is_merkle_scheme(self.hash_scheme):
+            streamed.update({key: table.hash_entries for key, table in self._tables.items()})
+        static = {'version': self.version, **json.loads(json.dumps(self.extras))}
+        hasher = new_hasher(self.hash_scheme)
+        hasher.update(b'{')
+        for i, key in enumerate(sorted([*streamed, *static])):
+            hasher.update(((', ' if i else '') + json.dumps(key) + ': ').encode('utf-8'))
+            if key in streamed:
+                hasher.update(b'[')
+                for j, pieces in enumerate(streamed[key]()):
+                    hasher.update(b', ' if j else b'')
+                    for piece in pieces:
+                        hasher.update(piece.encode('utf-8'))
+                hasher.update(b']')
+            else:
+                hasher.update(json.dumps(static[key], sort_keys=True).encode('utf-8'))
+        hasher.update(b'}')
+        return prefix_hash(self.hash_scheme, hasher.hexdigest())
+
+    def _datapoint_lines(self) -> Iterator[list[str]]:
+        self._datapoint_spool.seek(0)
+        for line in self._datapoint_spool:
+            yield [line.rstrip('\n')]
+
+    def _newline(self, depth: int) -> str:
+        if self.indent is None:
+            return ''
+        return '\n' + ' ' * self.indent * depth
+
+    def _dump_json(self, value: Any, depth: int) -> str:
+        """Dump a value to JSON, indented to sit at the given depth of the document."""
+        dumped = json.dumps(value, indent=self.indent)
+        if self.indent is None:
+            return dumped
+        return textwrap.indent(dumped, ' ' * self.indent * depth)[self.indent * depth:]
+
+
+class _Spool:
+    """A temporary file of unique reference entries, keyed by hash.
+
+    Large values such as the content of lazy attachments are spooled as placeholders
+    (see :func:`~quaac.common.streamed_values`) and streamed in when the entries are written.
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile('w+', encoding='utf-8')
+        self.offsets: dict[str, tuple[int, type, dict]] = {}
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def add(self, entry: HashModel) -> None:
+        if entry.hash in self.offsets:
+            return
+        with streamed_values() as streams:
+            dumped = json.dumps(entry.model_dump(mode='json', by_alias=True))
+        self.file.seek(0, 2)
+        self.offsets[entry.hash] = (self.file.tell(), type(entry), streams)
+        self.file.write(dumped + '\n')
+
+    def _read(self, offset: int) -> dict:
+        self.file.seek(offset)
+        return json.loads(self.file.readline())
+
+    def entries(self) -> Iterator[tuple[dict, dict]]:
+        """The entries in hash order, each with the values of its placeholders."""
+        for entry_hash in sorted(self.offsets):
+            offset, _, streams = self.offsets[entry_hash]
+            yield self._read(offset), streams
+
+    def hash_entries(self) -> Iterator[Iterator[str]]:
+        """The pieces of the hash form of each entry in hash order."""
+        for entry_hash in sorted(self.offsets):
+            offset, model, streams = self.offsets[entry_hash]
+            yield iter_streamed_json(_hash_form(self._read(offset), model), streams)
+
+
+def merge_datapoints(*sources: Iterable[DataPoint]) -> Iterator[DataPoint]:
+    """Merge streams of data points into one stream ordered by perform datetime, dropping duplicates by hash.
+
+    This is a k-way merge: each source must already be ordered by perform datetime, and only one data point per source
+    is held at a time. Duplicates have the same perform datetime, so only the hashes of the data points at the
+    current datetime are remembered. Data points with the same datetime keep the order of their sources.
+    Datetimes are compared by their POSIX timestamps, taking datetimes without a time zone to be UTC,
+    so sources may mix naive and aware datetimes.
+
+    Parameters
+    ----------
+    sources : iterables of DataPoint
+        The data points of each source, e.g. from :meth:`Document.iter_datapoints <quaac.models.Document.iter_datapoints>`.
+    """
+    streams = [_check_order(source, i) for i, source in enumerate(sources)]
+    current, seen = None, set()
+    for timestamp, datapoint in heapq.merge(*streams, key=itemgetter(0)):
+        if timestamp != current:
+            current, seen = timestamp, set()
+        if datapoint.hash in seen:
+            continue
+        seen.add(datapoint.hash)
+        yield datapoint
+
+
+def _check_order(source: Iterable[DataPoint], index: int) -> Iterator[tuple[float, DataPoint]]:
+    """Pair the data points of a source of :func:`merge_datapoints` with their timestamps,
+    raising a ValueError if they are not ordered by perform datetime."""
+    previous = None
+    for datapoint in source:
+        timestamp = posix_timestamp(datapoint.perform_datetime)
+        if previous is not None and timestamp < previous[0]:
+            raise ValueError(f"Source {index} is not ordered by perform datetime; {datapoint.perform_datetime} comes after {previous[1]}.")
+        previous = timestamp, datapoint.perform_datetime
+        yield timestamp, datapoint
+
+
+@lru_cache(maxsize=None)
+def _yaml_classes() -> tuple[Any, type, type]:
+    """PyYAML and its safe loader and dumper. PyYAML is slow to import, so it is imported when YAML is first read or written.
+
+    The libyaml-backed loader and dumper are much faster than the pure-Python ones, but PyYAML may be built without libyaml."""
+    import yaml
+    return yaml, getattr(yaml, 'CSafeLoader', yaml.SafeLoader), getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+def __getattr__(name: str) -> Any:
+    # YAML_LOADER and YAML_DUMPER are looked up lazily so that PyYAML isn't imported with quaac
+    if name == 'YAML_LOADER':
+        return _yaml_classes()[1]
+    if name == 'YAML_DUMPER':
+        return _yaml_classes()[2]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def load_yaml(f: IO[str]) -> Any:
+    """Parse a YAML file object with the fastest safe loader available."""
+    yaml, loader, _ = _yaml_classes()
+    return yaml.load(f, Loader=loader)
+
+
+def _dump_yaml(value: Any) -> str:
+    yaml, _, dumper = _yaml_classes()
+    return yaml.dump(value, Dumper=dumper, sort_keys=False)
+
+
+def _materialize(entry: dict, streams: dict) -> dict:
+    """Replace the placeholders of a spooled entry with their full values."""
+    if not streams:
+        return entry
+    with_placeholders = json.dumps(entry)
+    return json.loads(''.join(iter_streamed_json(with_placeholders, streams)))
+
+
+def _hash_form(entry: dict, model: type[HashModel]) -> str:
+    """Convert an entry dumped by alias to the JSON string used to hash it."""
+    aliases = {field.alias: name for name, field in model.model_fields.items() if field.alias}
+    return json.dumps({aliases.get(key, key): value for key, value in entry.items()}, sort_keys=True)
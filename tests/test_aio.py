@@ -0,0 +1,100 @@
+import asyncio
+import os
+import tempfile
+import time
+from pathlib import Path
+from unittest import IsolatedAsyncioTestCase
+
+from quaac import Attachment, Document
+from quaac.aio import amap, run_blocking
+from quaac.attachments import BulkAttachmentError
+from quaac.common import hash_scheme, scheme_of_hash
+from quaac.stats import collect_stats
+from tests.test_models import create_attachment, create_datapoint
+
+
+class TestAio(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+
+    async def test_run_blocking_keeps_loop_free(self):
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.001)
+
+        ticker = asyncio.ensure_future(tick())
+        await run_blocking(time.sleep, 0.1)
+        ticker.cancel()
+        self.assertGreater(ticks, 5)
+
+    async def test_run_blocking_context(self):
+        with hash_scheme('merkle-blake2b'):
+            attachment = await run_blocking(create_attachment)
+        self.assertEqual(scheme_of_hash(attachment.hash), 'merkle-blake2b')
+
+    async def test_amap_limit(self):
+        running, most = 0, 0
+
+        async def work(item: int) -> int:
+            nonlocal running, most
+            running += 1
+            most = max(most, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return item * 2
+
+        self.assertEqual(await amap(work, range(10), limit=3), [i * 2 for i in range(10)])
+        self.assertEqual(most, 3)
+        # a shared semaphore limits several calls together
+        semaphore = asyncio.Semaphore(2)
+        most = 0
+        await asyncio.gather(amap(work, range(5), limit=semaphore), amap(work, range(5), limit=semaphore))
+        self.assertEqual(most, 2)
+
+    async def test_amap_error(self):
+        async def work(item: int) -> int:
+            if item == 1:
+                raise ValueError("bad item")
+            return item
+
+        with self.assertRaises(ValueError):
+            await amap(work, range(4), limit=1)
+        results = await amap(work, range(4), return_exceptions=True)
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(results[2], 2)
+
+    async def test_document_round_trip(self):
+        doc = Document(datapoints=[create_datapoint(attachments=[create_attachment()])])
+        path = self.directory / 'doc.json'
+        await doc.adump_json(path)
+        loaded = await Document.aload_json(path, check_hash='deferred')
+        self.assertEqual(loaded.hash, doc.hash)
+        self.assertTrue(loaded.verify().ok)
+
+    async def test_attachment_round_trip(self):
+        content = os.urandom(1000)
+        path = self.directory / 'image.png'
+        path.write_bytes(content)
+        with collect_stats() as stats:
+            attachment = await Attachment.afrom_file(path, compression='bz2')
+        self.assertEqual(stats['attachment.encode'].bytes, 1000)
+        self.assertEqual(attachment.compression, 'bz2')
+        await attachment.ato_file(self.directory / 'out.png')
+        self.assertEqual((self.directory / 'out.png').read_bytes(), content)
+
+    async def test_afrom_files(self):
+        paths = []
+        for i in range(5):
+            paths.append(self.directory / f'{i}.txt')
+            paths[-1].write_bytes(os.urandom(100))
+        attachments = await Attachment.afrom_files(paths, limit=2)
+        self.assertEqual([a.name for a in attachments], [p.name for p in paths])
+        with self.assertRaises(BulkAttachmentError) as context:
+            await Attachment.afrom_files([paths[0], self.directory / 'missing.txt'])
+        self.assertEqual(list(context.exception.errors), [self.directory / 'missing.txt'])
+        self.assertEqual(context.exception.results[0].name, '0.txt')
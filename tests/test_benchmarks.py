@@ -0,0 +1,47 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from quaac import Document
+from benchmarks.generate import DocumentSpec, generate_document, write_document
+from benchmarks.run import BENCHMARKS, Fresh, compare, measure, run_benchmarks
+
+
+class TestGenerate(TestCase):
+
+    def test_cardinality(self):
+        doc = generate_document(DocumentSpec(datapoints=30, equipment=3, users=2, attachments=4, attachment_size=100))
+        self.assertEqual(len(doc.datapoints), 30)
+        self.assertEqual(len(doc.equipment), 3)
+        self.assertEqual(len(doc.users), 2)
+        self.assertEqual(len(doc.attachments), 4)
+        self.assertEqual(sorted(d.perform_datetime for d in doc.datapoints), [d.perform_datetime for d in doc.datapoints])
+
+    def test_reproducible(self):
+        spec = DocumentSpec(datapoints=10, attachments=1, attachment_size=10)
+        self.assertEqual(generate_document(spec).hash, generate_document(spec).hash)
+
+    def test_write(self):
+        spec = DocumentSpec(datapoints=10, attachments=2, attachment_size=10)
+        path = write_document(spec, Path(tempfile.mkdtemp()) / 'doc.yaml', format='yaml')
+        self.assertEqual(Document.from_yaml_file(str(path)).hash, generate_document(spec).hash)
+
+
+class TestRun(TestCase):
+
+    def test_run(self):
+        results = run_benchmarks([20], DocumentSpec(attachments=2, attachment_size=100), repeat=1, log=lambda message: None)
+        self.assertEqual(set(results['results']), {f'{name}/20' for name in BENCHMARKS})
+        self.assertEqual(compare(results, results), [])
+
+    def test_fresh_inputs(self):
+        inputs = []
+        measure(Fresh(lambda: inputs.append(object()) or inputs[-1], lambda value: self.assertIs(value, inputs[-1])), repeat=2)
+        # one per timed run and one for the memory run
+        self.assertEqual(len(inputs), 3)
+
+    def test_compare(self):
+        baseline = {'spec': {}, 'results': {'verify/10': {'seconds': 1.0, 'peak_mib': 10.0}}}
+        results = {'spec': {}, 'results': {'verify/10': {'seconds': 1.1, 'peak_mib': 20.0}, 'merge/10': {'seconds': 1.0, 'peak_mib': 1.0}}}
+        self.assertEqual(len(compare(results, baseline)), 1)
+        self.assertEqual(len(compare(results, {**baseline, 'spec': {'users': 1}})), 1)
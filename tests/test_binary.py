@@ -0,0 +1,126 @@
+import io
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest import TestCase
+
+from quaac import Attachment, Document
+from quaac.binary import BinaryReader, ByteStream, write_header, write_value
+from quaac.common import hash_scheme
+from tests.test_models import create_attachment, create_datapoint, create_equipment, create_user
+
+
+class TestBinaryValues(TestCase):
+
+    def cycle(self, value):
+        f = io.BytesIO()
+        write_value(f, value)
+        return BinaryReader(f.getvalue()).read_value()
+
+    def test_values(self):
+        value = {'none': None, 'bools': [True, False], 'int': -5, 'big int': 2 ** 70, 'float': 1.5,
+                 'str': 'héllo', 'bytes': b'\x00\x01', 'nested': {'list': [1, [2, {'a': 'b'}]]}}
+        self.assertEqual(self.cycle(value), value)
+
+    def test_datetimes(self):
+        for value in (datetime(2021, 1, 1), datetime(1999, 12, 31, 23, 59, 59, 999999),
+                      datetime(2021, 6, 1, 12, tzinfo=timezone.utc), datetime(2021, 6, 1, 12, tzinfo=timezone(timedelta(hours=-5, minutes=-30)))):
+            result = self.cycle(value)
+            self.assertEqual(result, value)
+            self.assertEqual(result.utcoffset(), value.utcoffset())
+
+    def test_byte_stream(self):
+        self.assertEqual(self.cycle([ByteStream([b'ab', b'', b'cd']), 'after']), [b'abcd', 'after'])
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            write_value(io.BytesIO(), {1: 'a'})
+        with self.assertRaises(ValueError):
+            write_value(io.BytesIO(), object())
+
+    def test_header(self):
+        f = io.BytesIO()
+        write_header(f)
+        write_value(f, 'value')
+        self.assertEqual(BinaryReader.from_header(f.getvalue()).read_value(), 'value')
+        with self.assertRaises(ValueError):
+            BinaryReader.from_header(b'{"version": "1.0"}')
+
+    def test_truncated(self):
+        f = io.BytesIO()
+        write_value(f, {'a': 'some text'})
+        for end in (3, 10, len(f.getvalue()) - 1):
+            with self.assertRaises(ValueError):
+                BinaryReader(f.getvalue()[:end]).read_value()
+
+
+class TestBinaryDocument(TestCase):
+
+    def create_document(self) -> Document:
+        attachment = Attachment.from_file(__file__)
+        user = create_user()
+        return Document(site='clinic', datapoints=[
+            create_datapoint(attachments=[attachment, create_attachment()], performer=user, reviewer=create_user(name='Jane')),
+            create_datapoint(name='tz', perform_datetime=datetime(2021, 1, 1, 8, tzinfo=timezone(timedelta(hours=2))), performer=user,
+                             ancillary_equipment=[create_equipment(name='Phantom')], measurement_value=3, parameters={'ssd': 100.5}),
+        ])
+
+    def write(self, doc: Document) -> str:
+        with tempfile.NamedTemporaryFile(suffix='.quaac', delete=False) as f:
+            doc.to_binary_file(f.name)
+        return f.name
+
+    def test_cycle(self):
+        doc = self.create_document()
+        loaded = Document.from_binary_file(self.write(doc))
+        self.assertEqual(loaded.hash, doc.hash)
+        self.assertEqual(loaded.site, 'clinic')
+        self.assertEqual(loaded.datapoints[1].perform_datetime, doc.datapoints[1].perform_datetime)
+        self.assertEqual(loaded.datapoints[0].attachments[0].content, doc.datapoints[0].attachments[0].content)
+        self.assertIs(loaded.datapoints[0].performer, loaded.datapoints[1].performer)
+
+    def test_tables_are_collected_from_datapoints(self):
+        doc = self.create_document()
+        doc_hash = doc.hash
+        # the registry is a cache and isn't trusted when writing
+        doc.registry().equipment.clear()
+        loaded = Document.from_binary_file(self.write(doc))
+        self.assertEqual(loaded.hash, doc_hash)
+        self.assertEqual(len(loaded.equipment), 2)
+
+    def test_merkle_cycle(self):
+        with hash_scheme('merkle-md5'):
+            doc = self.create_document()
+        self.assertEqual(Document.from_binary_file(self.write(doc)).hash, doc.hash)
+
+    def test_lazy_attachment(self):
+        doc = Document(datapoints=[create_datapoint(attachments=[Attachment.from_file(__file__, lazy=True)])])
+        loaded = Document.from_binary_file(self.write(doc))
+        self.assertEqual(loaded.hash, doc.hash)
+
+    def test_smaller_than_json(self):
+        doc = self.create_document()
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            doc.to_json_file(f.name)
+        self.assertLess(os.path.getsize(self.write(doc)), os.path.getsize(f.name))
+
+    def test_edited_file_does_not_validate(self):
+        path = self.write(self.create_document())
+        data = Path(path).read_bytes()
+        Path(path).write_bytes(data.replace(b'clinic', b'CLINIC'))
+        with self.assertRaises(ValueError):
+            Document.from_binary_file(path)
+        # without checking, the edit is loaded
+        self.assertEqual(Document.from_binary_file(path, check_hash=False).site, 'CLINIC')
+
+    def test_not_binary(self):
+        doc = self.create_document()
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            doc.to_json_file(f.name)
+        with self.assertRaises(ValueError):
+            Document.from_binary_file(f.name)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            pass
+        with self.assertRaises(ValueError):
+            Document.from_binary_file(f.name)
@@ -0,0 +1,118 @@
+import base64
+import json
+import os
+import tempfile
+import zipfile
+from pathlib import Path
+from unittest import TestCase
+
+from quaac import Document
+from quaac.bundle import Bundle, blob_name
+from quaac.common import hash_scheme
+from tests.test_models import create_attachment, create_datapoint
+
+
+def create_document(attachments=None) -> Document:
+    attachments = attachments or [create_attachment(name='a.bin'), create_attachment(name='b.bin')]
+    return Document(datapoints=[create_datapoint(name='first', attachments=attachments),
+                                create_datapoint(name='second', attachments=attachments[:1])])
+
+
+class TestBundle(TestCase):
+
+    def bundle_paths(self) -> list:
+        directory = Path(tempfile.mkdtemp())
+        return [directory / 'bundle', directory / 'bundle.zip']
+
+    def test_cycle(self):
+        doc = create_document()
+        for path in self.bundle_paths():
+            doc.to_bundle(path)
+            loaded = Document.from_bundle(path)
+            self.assertEqual(loaded.hash, doc.hash)
+            self.assertTrue(all(a.is_lazy for a in loaded.attachments))
+            self.assertEqual({a.content for a in loaded.attachments}, {a.content for a in doc.attachments})
+
+    def test_merkle_cycle(self):
+        with hash_scheme('merkle-md5'):
+            doc = create_document()
+        path = self.bundle_paths()[1]
+        doc.to_bundle(path)
+        self.assertEqual(Document.from_bundle(path).hash, doc.hash)
+
+    def test_document_has_no_content(self):
+        doc = create_document()
+        path = self.bundle_paths()[0]
+        doc.to_bundle(path)
+        document = json.loads((path / 'document.json').read_text())
+        self.assertEqual(len(document['attachments']), 2)
+        self.assertTrue(all('content' not in a for a in document['attachments']))
+        # blobs hold the compressed content without the base64 encoding
+        for attachment in doc.attachments:
+            self.assertEqual((path / blob_name(attachment.hash)).read_bytes(), base64.b64decode(attachment.content))
+
+    def test_deduplicates_across_documents(self):
+        shared = create_attachment(name='shared.bin')
+        first = create_document([shared, create_attachment(name='a.bin')])
+        second = create_document([shared, create_attachment(name='b.bin')])
+        for path in self.bundle_paths():
+            first.to_bundle(path, name='first.json')
+            second.to_bundle(path, name='second.json')
+            names = Bundle(path).names()
+            self.assertEqual({'first.json', 'second.json'}, {n for n in names if not n.startswith('blobs/')})
+            self.assertEqual(len([n for n in names if n.startswith('blobs/')]), 3)
+            self.assertEqual(Document.from_bundle(path, name='second.json').hash, second.hash)
+
+    def test_duplicate_document(self):
+        for path in self.bundle_paths():
+            first = create_document()
+            first.to_bundle(path)
+            with self.assertRaises(ValueError):
+                create_document().to_bundle(path)
+            self.assertEqual(Document.from_bundle(path).hash, first.hash)
+            with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+                first.to_json_file(f.name)
+            with Bundle(path) as bundle, self.assertRaises(ValueError):
+                bundle.add_document(f.name)
+
+    def test_no_check_hash_reads_no_blobs(self):
+        doc = create_document()
+        path = self.bundle_paths()[0]
+        doc.to_bundle(path)
+        for blob in (path / 'blobs').iterdir():
+            blob.unlink()
+        loaded = Document.from_bundle(path, check_hash=False)
+        self.assertEqual(loaded.datapoints[0].attachments[1].name, 'b.bin')
+        with self.assertRaises(FileNotFoundError):
+            loaded.datapoints[0].attachments[0].content
+
+    def test_edited_blob_does_not_validate(self):
+        doc = create_document()
+        path = self.bundle_paths()[0]
+        doc.to_bundle(path)
+        blob = path / blob_name(doc.datapoints[0].attachments[0].hash)
+        blob.write_bytes(os.urandom(32))
+        with self.assertRaises(ValueError):
+            Document.from_bundle(path)
+
+    def test_to_json_file(self):
+        doc = create_document()
+        path = self.bundle_paths()[1]
+        doc.to_bundle(path)
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            Document.from_bundle(path).to_json_file(f.name)
+        self.assertEqual(Document.from_json_file(f.name).hash, doc.hash)
+
+    def test_not_a_bundle(self):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(b'not a zip')
+        with self.assertRaises(ValueError):
+            Bundle(f.name)
+
+    def test_zip_blobs_are_stored(self):
+        path = self.bundle_paths()[1]
+        create_document().to_bundle(path)
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                expected = zipfile.ZIP_DEFLATED if info.filename == 'document.json' else zipfile.ZIP_STORED
+                self.assertEqual(info.compress_type, expected)
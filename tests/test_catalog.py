@@ -0,0 +1,102 @@
+import os
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from unittest import TestCase
+
+from quaac import Document
+from quaac.catalog import Catalog
+from tests.test_models import create_attachment, create_datapoint, create_equipment, create_user
+
+
+class TestCatalog(TestCase):
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.linacs = [create_equipment(name='TrueBeam 1'), create_equipment(name='TrueBeam 2', serial_number='5678')]
+        self.user = create_user()
+        self.attachment = create_attachment()
+        self.catalog = Catalog(':memory:')
+        self.addCleanup(self.catalog.close)
+
+    def datapoints(self, month: int, linac: int) -> list:
+        return [create_datapoint(name=name, perform_datetime=f'2024-{month:02d}-{day:02d}T08:00:00', measurement_value=100 + day / 10,
+                                 primary_equipment=self.linacs[linac], performer=self.user,
+                                 attachments=[self.attachment] if name == 'symmetry' else [])
+                for day in (1, 15) for name in ('6MV Output', 'symmetry')]
+
+    def write(self, name: str, datapoints: list) -> Path:
+        path = self.directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        doc = Document(datapoints=datapoints)
+        doc.to_yaml_file(str(path)) if path.suffix == '.yaml' else doc.to_json_file(str(path))
+        return path
+
+    def test_refresh_and_query(self):
+        self.write('jan.json', self.datapoints(1, 0))
+        self.write('sub/feb.yaml', self.datapoints(2, 1))
+        result = self.catalog.refresh(self.directory)
+        self.assertEqual(len(result.added), 2)
+        self.assertEqual(result.errors, {})
+        self.assertEqual(len(self.catalog.query()), 8)
+        entries = self.catalog.query(name='6MV Output', equipment='TrueBeam 2')
+        self.assertEqual([e.measurement_value for e in entries], [100.1, 101.5])
+        self.assertEqual(self.catalog.query(equipment=self.linacs[1].named_hash()), self.catalog.query(equipment=self.linacs[1]))
+        self.assertEqual(len(self.catalog.query(performer=self.user.name)), 8)
+        entries = self.catalog.query(since='2024-01-10', until=datetime(2024, 2, 1, 8))
+        self.assertEqual([e.name for e in entries], ['6MV Output', 'symmetry', '6MV Output', 'symmetry'])
+        self.assertEqual(self.catalog.query(since='2024-01-10T00:00:00Z', until='2024-02-01T08:00:00Z'), entries)
+        self.assertEqual(len(self.catalog.query(attachment=self.attachment.hash)), 4)
+
+    def test_load(self):
+        jan = self.write('jan.json', self.datapoints(1, 0))
+        feb = self.write('feb.yaml', self.datapoints(2, 1))
+        self.catalog.refresh(self.directory)
+        entries = self.catalog.query(name='symmetry')
+        datapoints = self.catalog.load_datapoints(entries)
+        self.assertEqual([d.hash for d in datapoints], [e.hash for e in entries])
+        self.assertEqual(datapoints[0].attachments[0].content, self.attachment.content)
+        self.assertEqual(entries[-1].load().hash, entries[-1].hash)
+        documents = self.catalog.load_documents(entries)
+        self.assertEqual([d.hash for d in documents], [Document.from_json_file(str(jan)).hash, Document.from_yaml_file(str(feb)).hash])
+
+    def test_incremental_refresh(self):
+        jan = self.write('jan.json', self.datapoints(1, 0))
+        feb = self.write('feb.json', self.datapoints(2, 0))
+        self.catalog.refresh(self.directory)
+        # touching a file doesn't re-index it
+        os.utime(jan, (time.time() + 10, time.time() + 10))
+        result = self.catalog.refresh(self.directory)
+        self.assertEqual(sorted(result.unchanged), sorted([jan, feb]))
+        # changing one does
+        self.write('jan.json', self.datapoints(3, 1))
+        os.remove(feb)
+        result = self.catalog.refresh(self.directory)
+        self.assertEqual((result.updated, result.removed), ([jan], [feb]))
+        self.assertEqual(self.catalog.files(), [jan])
+        self.assertEqual({e.equipment_hash for e in self.catalog.query()}, {self.linacs[1].hash})
+
+    def test_bad_file(self):
+        self.write('jan.json', self.datapoints(1, 0))
+        (self.directory / 'bad.json').write_text('{"version": "1.0", "datapoints": [{')
+        result = self.catalog.refresh(self.directory)
+        self.assertEqual(list(result.errors), [self.directory / 'bad.json'])
+        self.assertEqual(len(self.catalog.files()), 1)
+
+    def test_stale_entry(self):
+        path = self.write('jan.json', self.datapoints(1, 0))
+        self.catalog.refresh(self.directory)
+        entry = self.catalog.query()[0]
+        self.write('jan.json', self.datapoints(2, 0))
+        with self.assertRaises(ValueError):
+            entry.load()
+        self.assertEqual(path, entry.path)
+
+    def test_persistent(self):
+        self.write('jan.json', self.datapoints(1, 0))
+        database = self.directory / 'catalog.sqlite'
+        with Catalog(database) as catalog:
+            catalog.refresh(self.directory)
+        with Catalog(database) as catalog:
+            self.assertEqual(len(catalog.query(name='symmetry')), 2)
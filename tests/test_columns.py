@@ -0,0 +1,98 @@
+import math
+from unittest import TestCase
+
+from quaac import Document
+from quaac.columns import deviation, rolling_mean, rolling_std
+from tests.test_models import create_datapoint, create_equipment, create_user
+
+
+def assert_close(test: TestCase, actual, expected):
+    test.assertEqual(len(actual), len(expected))
+    for a, e in zip(actual, expected):
+        if math.isnan(e):
+            test.assertTrue(math.isnan(a), f"{a} is not NaN")
+        else:
+            test.assertAlmostEqual(a, e)
+
+
+class TestColumns(TestCase):
+
+    def setUp(self):
+        self.linacs = [create_equipment(), create_equipment(name='TB2', serial_number='5678')]
+        self.users = [create_user(), create_user(name='Randle')]
+        self.doc = Document(datapoints=[
+            create_datapoint(name='output', perform_datetime='2021-01-03T00:00:00', measurement_value=101, reference_value=100,
+                             primary_equipment=self.linacs[0], performer=self.users[0]),
+            create_datapoint(name='output', perform_datetime='2021-01-01T00:00:00', measurement_value='99.5', reference_value=100,
+                             primary_equipment=self.linacs[1], performer=self.users[1]),
+            create_datapoint(name='symmetry', perform_datetime='2021-01-02T00:00:00', measurement_value='pass', reference_value=None,
+                             primary_equipment=self.linacs[0], performer=self.users[0]),
+        ])
+
+    def test_columns(self):
+        columns = self.doc.to_columns()
+        self.assertEqual(len(columns), 3)
+        # ordered by perform datetime
+        assert_close(self, columns.timestamps, [1609459200, 1609545600, 1609632000])
+        assert_close(self, columns.values, [99.5, math.nan, 101])
+        assert_close(self, columns.references, [100, math.nan, 100])
+        self.assertEqual(columns.names, ['output', 'symmetry'])
+        self.assertEqual(list(columns.name_codes), [0, 1, 0])
+        self.assertEqual(columns.equipment, [self.linacs[1], self.linacs[0]])
+        self.assertEqual(list(columns.equipment_codes), [0, 1, 1])
+        self.assertEqual([columns.performers[c] for c in columns.performer_codes], [self.users[1], self.users[0], self.users[0]])
+        self.assertEqual(columns.datetimes()[0].day, 1)
+
+    def test_naive_and_aware_datetimes(self):
+        # naive datetimes are taken to be UTC
+        self.doc.add_datapoints([create_datapoint(perform_datetime='2021-01-01T12:00:00+02:00', measurement_value=7),
+                                 create_datapoint(perform_datetime='2021-01-02T12:00:00Z', measurement_value=8)])
+        columns = self.doc.to_columns()
+        assert_close(self, columns.timestamps, [1609459200, 1609495200, 1609545600, 1609588800, 1609632000])
+        assert_close(self, columns.values, [99.5, 7, math.nan, 8, 101])
+
+    def test_deviation(self):
+        columns = self.doc.to_columns()
+        assert_close(self, columns.deviation(), [-0.5, math.nan, 1])
+        assert_close(self, columns.deviation(relative=True), [-0.5, math.nan, 1])
+        assert_close(self, deviation([1, 2], [0, 4], relative=True), [math.nan, -50])
+
+    def test_group_by(self):
+        groups = self.doc.to_columns(group_by='equipment')
+        self.assertEqual(list(groups), [self.linacs[1].hash, self.linacs[0].hash])
+        assert_close(self, groups[self.linacs[0].hash].values, [math.nan, 101])
+        by_name = self.doc.to_columns(group_by='name')
+        assert_close(self, by_name['output'].values, [99.5, 101])
+        self.assertEqual(len(self.doc.to_columns(group_by='performer')[self.users[1].hash]), 1)
+
+    def test_empty(self):
+        columns = Document(datapoints=[]).to_columns()
+        self.assertEqual(len(columns), 0)
+        self.assertEqual(len(rolling_mean(columns.values, 3)), 0)
+
+
+class TestRolling(TestCase):
+
+    def test_mean(self):
+        assert_close(self, rolling_mean([1, 2, 3, 4, 5], 2), [math.nan, 1.5, 2.5, 3.5, 4.5])
+        assert_close(self, rolling_mean([1, 2], 3), [math.nan, math.nan])
+
+    def test_nan_only_affects_its_windows(self):
+        assert_close(self, rolling_mean([1, math.nan, 3, 4, 5], 2), [math.nan, math.nan, math.nan, 3.5, 4.5])
+
+    def test_std(self):
+        assert_close(self, rolling_std([1, 2, 4, 8], 3), [math.nan, math.nan, 1.5275252316519468, 3.0550504633038935])
+        assert_close(self, rolling_std([1, 2, 4, 8], 3, ddof=0), [math.nan, math.nan, 1.247219128924647, 2.494438257849294])
+
+    def test_std_of_large_values(self):
+        # a large offset with a small spread, where sums of squares lose all precision
+        values = [1e6 + 0.01 * (-1) ** i for i in range(50)]
+        for std in rolling_std(values, 10)[9:]:
+            self.assertAlmostEqual(std / 0.010540925533894598, 1, places=6)
+        assert_close(self, rolling_std([1e9 + 1, 1e9 + 2, math.nan, 1e9 + 4, 1e9 + 8], 2), [math.nan, 0.7071067811865476, math.nan, math.nan, 2.8284271247461903])
+
+    def test_bad_window(self):
+        with self.assertRaises(ValueError):
+            rolling_mean([1, 2], 0)
+        with self.assertRaises(ValueError):
+            rolling_std([1, 2], 1)
@@ -0,0 +1,42 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from unittest import TestCase, skipIf
+
+ROOT = Path(__file__).parent.parent
+# the time importing quaac may take on top of importing pydantic, in seconds. It is about 0.04 s on a typical machine.
+IMPORT_BUDGET = 0.1
+# the modules that are slow to import and are only imported when they are first needed
+DEFERRED_MODULES = ('yaml', 'asyncio', 'concurrent.futures', 'multiprocessing', 'email_validator', 'numpy')
+
+
+def run_python(code: str) -> str:
+    """Run code in a fresh interpreter and return its output."""
+    return subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+
+
+class TestImport(TestCase):
+
+    # wall-clock timings are noisy on shared or busy machines; test_deferred_modules checks the behavior the budget relies on
+    @skipIf(not os.environ.get('QUAAC_TIMING_TESTS'), "set QUAAC_TIMING_TESTS=1 to run timing tests")
+    def test_import_budget(self):
+        # pydantic is imported first so that only the time of quaac itself is measured. The fastest of a few runs is used
+        code = ("import pydantic, pydantic.networks, time\n"
+                "start = time.perf_counter()\n"
+                "import quaac\n"
+                "print(time.perf_counter() - start)")
+        seconds = min(float(run_python(code)) for _ in range(3))
+        self.assertLess(seconds, IMPORT_BUDGET)
+
+    def test_deferred_modules(self):
+        code = f"import json, sys, quaac\nprint(json.dumps([m for m in {DEFERRED_MODULES!r} if m in sys.modules]))"
+        self.assertEqual(json.loads(run_python(code)), [])
+
+    def test_schemas_are_built_on_first_use(self):
+        code = ("import json, quaac\n"
+                "before = quaac.User.__pydantic_complete__\n"
+                "quaac.User(name='Johnny', email='j@j.com')\n"
+                "print(json.dumps([before, quaac.User.__pydantic_complete__]))")
+        self.assertEqual(json.loads(run_python(code)), [False, True])
@@ -0,0 +1,92 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from quaac import Document
+from quaac.journal import Journal
+from tests.test_models import create_attachment, create_datapoint, create_equipment, create_user
+
+
+class TestJournal(TestCase):
+
+    def setUp(self):
+        self.path = Path(tempfile.mkdtemp()) / 'journal.jsonl'
+        self.user = create_user()
+        self.attachment = create_attachment()
+
+    def datapoints(self, count: int, start: int = 0) -> list:
+        return [create_datapoint(name=f'dp {i}', performer=self.user, measurement_value=i,
+                                 attachments=[self.attachment] if i % 2 else [])
+                for i in range(start, start + count)]
+
+    def test_append_and_read(self):
+        datapoints = self.datapoints(4)
+        with Journal(self.path, site='clinic') as journal:
+            journal.append_many(datapoints)
+        doc = Journal.read(self.path)
+        self.assertEqual(doc.hash, Document(site='clinic', datapoints=datapoints).hash)
+        self.assertEqual(doc.site, 'clinic')
+        self.assertIs(doc.datapoints[1].attachments[0], doc.datapoints[3].attachments[0])
+
+    def test_references_written_once(self):
+        with Journal(self.path) as journal:
+            journal.append_many(self.datapoints(2))
+        # reopening keeps track of the entries already in the journal
+        with Journal(self.path) as journal:
+            journal.append_many(self.datapoints(2, start=2))
+        types = [json.loads(line)['type'] for line in self.path.read_text().splitlines()]
+        self.assertEqual(types.count('header'), 1)
+        self.assertEqual(types.count('attachment'), 1)
+        self.assertEqual(types.count('user'), 1)
+        self.assertEqual(types.count('datapoint'), 4)
+
+    def test_new_reference(self):
+        with Journal(self.path) as journal:
+            journal.append_many(self.datapoints(1))
+            journal.append(create_datapoint(primary_equipment=create_equipment(name='Phantom'), reviewer=create_user(name='Jane')))
+        doc = Journal.read(self.path)
+        self.assertEqual(doc.datapoints[1].primary_equipment.name, 'Phantom')
+        self.assertEqual(doc.datapoints[1].reviewer.name, 'Jane')
+
+    def test_partly_written_record(self):
+        with Journal(self.path) as journal:
+            journal.append_many(self.datapoints(2))
+        with open(self.path, 'a') as f:
+            f.write('{"type": "datapoint", "entry": {"na')
+        self.assertEqual(len(Journal.read(self.path).datapoints), 2)
+        with Journal(self.path) as journal:
+            journal.append_many(self.datapoints(1, start=2))
+        self.assertEqual(len(Journal.read(self.path).datapoints), 3)
+
+    def test_partly_written_header(self):
+        self.path.write_text('{"type": "header", "vers')
+        with Journal(self.path, site='clinic') as journal:
+            journal.append_many(self.datapoints(1))
+        types = [json.loads(line)['type'] for line in self.path.read_text().splitlines()]
+        self.assertEqual(types[0], 'header')
+        self.assertEqual(Journal.read(self.path).site, 'clinic')
+        # a file whose first record isn't a header isn't a journal, and is left as it is
+        self.path.write_text('{"type": "datapoint", "entry": {}}\n{"type": "da')
+        with self.assertRaises(ValueError):
+            Journal(self.path).open()
+        self.assertEqual(self.path.read_text(), '{"type": "datapoint", "entry": {}}\n{"type": "da')
+
+    def test_edited_journal_does_not_validate(self):
+        with Journal(self.path) as journal:
+            journal.append_many(self.datapoints(2))
+        self.path.write_text(self.path.read_text().replace('"measurement value": 1,', '"measurement value": 5,'))
+        with self.assertRaises(ValueError):
+            Journal.read(self.path)
+        self.assertEqual(Journal.read(self.path, check_hash=False).datapoints[1].measurement_value, 5)
+
+    def test_compact(self):
+        datapoints = self.datapoints(5)
+        with Journal(self.path, site='clinic') as journal:
+            journal.append_many(datapoints)
+        output = self.path.with_name('compacted.json')
+        self.assertEqual(Journal.compact(self.path, output), 5)
+        doc = Document.from_json_file(output)
+        self.assertEqual(doc.hash, Journal.read(self.path).hash)
+        self.assertEqual(doc.site, 'clinic')
+        self.assertEqual(len(doc.attachments), 1)
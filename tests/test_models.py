@@ -1,15 +1,22 @@
 import base64
+import gzip
+import hashlib
+import io
 import json
 import os
 import tempfile
 from abc import ABC, abstractmethod
+from datetime import datetime
 from pathlib import Path
-from unittest import TestCase, skip
+from unittest import TestCase, skip, skipIf
 
+import yaml
 from pydantic import ValidationError
 
-from quaac.common import create_hash_from_entry
+from quaac.common import HASH_SCHEMES, HashMismatchError, create_hash_from_entry, hash_scheme, register_hash_scheme, set_hash_scheme, scheme_of_hash
 from quaac import User, Equipment, Attachment, Document, DataPoint
+from quaac.attachments import (BulkAttachmentError, Compression, COMPRESSIONS, PassthroughCodec, choose_compression, decode_stream, encode_stream, get_compressor,
+                               get_encoder, register_compression)
 
 
 def create_attachment(**kwargs) -> Attachment:
@@ -60,6 +67,174 @@ class TestHasher(TestCase):
         hash = create_hash_from_entry(entry)
         self.assertEqual(hash, '5ef2d60d51b2dad78f9a6f5be9c6fa38')
 
+    def test_scheme_of_hash(self):
+        self.assertEqual(scheme_of_hash('5ef2d60d51b2dad78f9a6f5be9c6fa38'), 'md5')
+        self.assertEqual(scheme_of_hash('merkle-md5:5ef2d60d51b2dad78f9a6f5be9c6fa38'), 'merkle-md5')
+        with self.assertRaises(ValueError):
+            scheme_of_hash('sha1024:5ef2d60d51b2dad78f9a6f5be9c6fa38')
+
+    def test_unknown_scheme(self):
+        with self.assertRaises(ValueError):
+            set_hash_scheme('sha1024')
+
+
+class TestMerkleHashing(TestCase):
+
+    def test_prefix(self):
+        with hash_scheme('merkle-md5'):
+            u = create_user()
+        self.assertTrue(u.hash.startswith('merkle-md5:'))
+        # the scheme is fixed when the entry is created
+        self.assertTrue(u.hash.startswith('merkle-md5:'))
+        self.assertEqual(scheme_of_hash(create_user().hash), 'md5')
+
+    def test_datapoint_hash_uses_child_hashes(self):
+        with hash_scheme('merkle-md5'):
+            a = create_attachment()
+            dp = create_datapoint(attachments=[a])
+        entry = dp._merkle_entry()
+        self.assertEqual(entry['attachments'], [a.hash])
+        self.assertEqual(entry['performer'], dp.performer.hash)
+
+    def test_attachment_content_is_digested(self):
+        with hash_scheme('merkle-md5'):
+            a1 = create_attachment(content=b'a' * 1000)
+            a2 = create_attachment(content=b'b' * 1000)
+        self.assertEqual(len(a1._merkle_entry()['content']), 32)
+        self.assertNotEqual(a1.hash, a2.hash)
+
+    def test_json_cycle(self):
+        with hash_scheme('merkle-md5'):
+            users = [create_user(name='Randle'), create_user(name='Johnny')]
+            d = Document(version="1.0", datapoints=[create_datapoint(performer=u, attachments=[create_attachment()]) for u in users])
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            d.to_json_file(f.name)
+        # loads with the scheme from the file regardless of the current scheme
+        d2 = Document.from_json_file(f.name)
+        self.assertEqual(d.hash, d2.hash)
+        self.assertEqual(scheme_of_hash(d2.hash), 'merkle-md5')
+
+    def test_edited_file_does_not_validate(self):
+        with hash_scheme('merkle-md5'):
+            d = Document(version="1.0", datapoints=[create_datapoint()])
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            d.to_json_file(f.name)
+        with open(f.name, 'r') as f:
+            data = json.loads(f.read())
+            data['users'][0]['email'] = 'k@k.com'
+        with open(f.name, 'w') as f:
+            f.write(json.dumps(data))
+        with self.assertRaises(ValueError):
+            Document.from_json_file(f.name)
+
+
+class TestHashSchemes(TestCase):
+
+    def tearDown(self):
+        HASH_SCHEMES.pop('merkle-sha256', None)
+
+    def test_blake2b(self):
+        with hash_scheme('merkle-blake2b'):
+            d = Document(datapoints=[create_datapoint(attachments=[create_attachment()])])
+        self.assertTrue(d.hash.startswith('merkle-blake2b:'))
+        self.assertNotEqual(d.hash.split(':')[1], Document(datapoints=d.datapoints).hash)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            d.to_json_file(f.name)
+        self.assertEqual(Document.from_json_file(f.name).hash, d.hash)
+        self.assertEqual(Document.from_json_file(f.name, lazy_attachments=True).hash, d.hash)
+
+    def test_register(self):
+        register_hash_scheme('merkle-sha256', hashlib.sha256)
+        with hash_scheme('merkle-sha256'):
+            u = create_user()
+        self.assertEqual(len(u.hash), len('merkle-sha256:') + 64)
+        with self.assertRaises(ValueError):
+            register_hash_scheme('bad:name', hashlib.sha256)
+        with self.assertRaises(ValueError):
+            register_hash_scheme('md5', hashlib.sha256)
+
+
+class TestVerification(TestCase):
+
+    def setUp(self):
+        attachment = create_attachment()
+        self.doc = Document(datapoints=[create_datapoint(name=f'dp {i}', attachments=[attachment]) for i in range(4)])
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            self.doc.to_json_file(f.name)
+        self.path = f.name
+
+    def edit(self, user: bool = True):
+        with open(self.path) as f:
+            data = json.load(f)
+        data['datapoints'][1]['measurement value'] = 5
+        data['datapoints'][3]['measurement value'] = 6
+        if user:
+            data['users'][0]['email'] = 'k@k.com'
+        with open(self.path, 'w') as f:
+            json.dump(data, f)
+
+    def test_unedited(self):
+        for check_hash in ('eager', 'deferred', 'parallel'):
+            doc = Document.from_json_file(self.path, check_hash=check_hash)
+            report = doc.verify(workers=4)
+            self.assertTrue(report.ok)
+            # 1 user, 1 equipment, 1 attachment, 4 data points, and the document
+            self.assertEqual(report.checked, 8)
+            self.assertEqual(doc.hash, self.doc.hash)
+
+    def test_deferred_reports_every_mismatch(self):
+        self.edit()
+        doc = Document.from_json_file(self.path, check_hash='deferred')
+        self.assertEqual(doc.datapoints[1].measurement_value, 5)
+        for workers in (1, 4):
+            report = doc.verify(workers=workers)
+            self.assertFalse(report.ok)
+            self.assertEqual([type(m.entry).__name__ for m in report.mismatches], ['User', 'DataPoint', 'DataPoint', 'DataPoint', 'DataPoint', 'Document'])
+            with self.assertRaises(HashMismatchError) as context:
+                report.check()
+            self.assertIs(context.exception.report, report)
+
+    def test_attachments_in_threads(self):
+        doc = Document(datapoints=[create_datapoint(attachments=[create_attachment(name=f'{i}.txt') for i in range(3)])])
+        doc.to_json_file(self.path)
+        with open(self.path) as f:
+            data = json.load(f)
+        data['attachments'][1]['content'] = data['attachments'][0]['content']
+        with open(self.path, 'w') as f:
+            json.dump(data, f)
+        for lazy_attachments in (False, True):
+            loaded = Document.from_json_file(self.path, check_hash='deferred', lazy_attachments=lazy_attachments)
+            report = loaded.verify(workers=4)
+            self.assertEqual(report.checked, 7)
+            self.assertEqual([type(m.entry).__name__ for m in report.mismatches], ['Attachment', 'DataPoint', 'Document'])
+            self.assertEqual(report.mismatches[0].entry.name, data['attachments'][1]['name'])
+
+    def test_parallel_raises_with_report(self):
+        self.edit()
+        with self.assertRaises(HashMismatchError) as context:
+            Document.from_json_file(self.path, check_hash='parallel')
+        self.assertEqual(len(context.exception.report.mismatches), 6)
+        # eager loading still raises at the first mismatch
+        with self.assertRaises(ValueError):
+            Document.from_json_file(self.path)
+
+    def test_other_formats(self):
+        self.edit()
+        doc = Document.from_json_file(self.path, check_hash=False)
+        with tempfile.NamedTemporaryFile(suffix='.yaml', delete=False) as f:
+            doc.to_yaml_file(f.name)
+        self.assertTrue(Document.from_yaml_file(f.name, check_hash='parallel').verify().ok)
+
+    def test_trusted(self):
+        self.edit(user=False)
+        doc = Document.from_json_file(self.path, trusted=True)
+        mismatches = doc.verify().mismatches
+        self.assertEqual([m.entry for m in mismatches], [doc.datapoints[1], doc.datapoints[3], doc])
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            Document.from_json_file(self.path, check_hash='sometimes')
+
 
 class BaseModelTester(ABC):
 
@@ -166,6 +341,257 @@ class TestAttachmentModel(BaseModelTester, TestCase):
         self.assertEqual(a.content, base64.b64encode(b"test"))
 
 
+class TestStreamingCodecs(TestCase):
+
+    def test_encode_matches_one_shot(self):
+        data = os.urandom(10_000) + b'abc' * 10_000
+        expected = get_encoder('base64')(get_compressor('gzip')(data))
+        for chunk_size in (1, 7, 1000, 100_000):
+            chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+            self.assertEqual(b''.join(encode_stream(chunks)), expected)
+            self.assertEqual(b''.join(encode_stream(chunks, compression=None)), base64.b64encode(data))
+
+    def test_decode_round_trip(self):
+        data = os.urandom(10_000)
+        encoded = b''.join(encode_stream([data]))
+        for chunk_size in (1, 5, 999, 100_000):
+            chunks = [encoded[i:i + chunk_size] for i in range(0, len(encoded), chunk_size)]
+            self.assertEqual(b''.join(decode_stream(chunks)), data)
+
+    def test_decode_multiple_gzip_members(self):
+        encoded = base64.b64encode(gzip.compress(b'first ') + gzip.compress(b'second'))
+        self.assertEqual(b''.join(decode_stream([encoded[:10], encoded[10:]])), b'first second')
+
+    def test_stream_cycle(self):
+        data = os.urandom(5000)
+        a = Attachment.from_stream(io.BytesIO(data), name='data.bin', chunk_size=100)
+        self.assertEqual(a.type, 'bin')
+        self.assertEqual(a.content, Attachment.from_file(self._write(data)).content)
+        out = io.BytesIO()
+        a.to_stream(out, chunk_size=64)
+        self.assertEqual(out.getvalue(), data)
+
+    def _write(self, data: bytes) -> str:
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(data)
+        return f.name
+
+
+class TestCompressions(TestCase):
+
+    def create_file(self, content: bytes = b"test data " * 1000) -> str:
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(content)
+        return f.name
+
+    def test_round_trips(self):
+        path = self.create_file()
+        for compression in COMPRESSIONS:
+            a = Attachment.from_file(path, compression=compression)
+            self.assertEqual(a.compression, compression)
+            with tempfile.NamedTemporaryFile(delete=False) as f:
+                a.to_file(f.name)
+            self.assertEqual(Path(f.name).read_bytes(), Path(path).read_bytes())
+
+    @skipIf(Compression.ZSTD is None, "zstd is not available")
+    def test_zstd(self):
+        self.assertIn('zstd', COMPRESSIONS)
+
+    def test_level(self):
+        path = self.create_file(os.urandom(1000) + b"test data " * 10_000)
+        fast = Attachment.from_file(path, compression_level=1)
+        best = Attachment.from_file(path)
+        self.assertLess(len(best.content), len(fast.content))
+        # the level is not needed to read the attachment back
+        out = io.BytesIO()
+        fast.to_stream(out)
+        self.assertEqual(out.getvalue(), Path(path).read_bytes())
+
+    def test_lazy_level(self):
+        path = self.create_file()
+        self.assertEqual(Attachment.from_file(path, compression='xz', compression_level=1, lazy=True).hash,
+                         Attachment.from_file(path, compression='xz', compression_level=1).hash)
+
+    def test_register(self):
+
+        class Reverse(PassthroughCodec):
+            def __init__(self, level=None):
+                self.data = b''
+
+            def update(self, data: bytes) -> bytes:
+                self.data += data
+                return b''
+
+            def flush(self) -> bytes:
+                return self.data[::-1]
+
+        register_compression('reverse', Reverse, Reverse)
+        try:
+            a = Attachment.from_file(self.create_file(b'abc'), compression='reverse')
+            self.assertEqual(a.content, base64.b64encode(b'cba'))
+            out = io.BytesIO()
+            a.to_stream(out)
+            self.assertEqual(out.getvalue(), b'abc')
+        finally:
+            del COMPRESSIONS['reverse']
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            Attachment.from_file(self.create_file(), compression='rar')
+
+    def test_auto_compressible(self):
+        path = self.create_file()
+        for lazy in (False, True):
+            a = Attachment.from_file(path, compression='auto', lazy=lazy)
+            self.assertEqual(a.compression, 'gzip')
+            self.assertEqual(a.hash, Attachment.from_file(path).hash)
+
+    def test_auto_compressed_format(self):
+        # compressible data behind a png signature is still stored as-is
+        path = self.create_file(b'\x89PNG\r\n\x1a\n' + b'test data ' * 1000)
+        for lazy in (False, True):
+            a = Attachment.from_file(path, compression='auto', lazy=lazy)
+            self.assertIsNone(a.compression)
+            out = io.BytesIO()
+            a.to_stream(out)
+            self.assertEqual(out.getvalue(), Path(path).read_bytes())
+
+    def test_auto_incompressible(self):
+        path = self.create_file(os.urandom(100_000))
+        with open(path, 'rb') as f:
+            a = Attachment.from_stream(f, name='random.bin', compression='auto', chunk_size=1000)
+        self.assertIsNone(a.compression)
+        self.assertEqual(base64.b64decode(a.content), Path(path).read_bytes())
+
+    def test_choose_compression(self):
+        self.assertIsNone(choose_compression(b''))
+        self.assertIsNone(choose_compression(gzip.compress(b'test data ' * 1000)))
+        self.assertEqual(choose_compression(b'test data ' * 1000, 'xz'), 'xz')
+        self.assertIsNone(choose_compression(b'test data ' * 1000, min_saving=1))
+
+
+class TestBulkAttachments(TestCase):
+
+    def create_files(self, count: int = 5) -> list:
+        directory = Path(tempfile.mkdtemp())
+        paths = []
+        for i in range(count):
+            paths.append(directory / f"file{i}.bin")
+            paths[-1].write_bytes(os.urandom(100) + b"test data " * 1000 * i)
+        return paths
+
+    def test_from_files(self):
+        paths = self.create_files()
+        attachments = Attachment.from_files(paths, workers=3, compression='xz')
+        self.assertEqual([a.name for a in attachments], [p.name for p in paths])
+        for path, attachment in zip(paths, attachments):
+            self.assertEqual(attachment.compression, 'xz')
+            self.assertEqual(attachment.hash, Attachment.from_file(path, compression='xz').hash)
+
+    def test_from_files_errors(self):
+        paths = self.create_files(3)
+        missing = paths[0].parent / 'missing.bin'
+        with self.assertRaises(BulkAttachmentError) as context:
+            Attachment.from_files([paths[0], missing, paths[1]], workers=2)
+        self.assertEqual(list(context.exception.errors), [missing])
+        self.assertIsInstance(context.exception.errors[missing], FileNotFoundError)
+        results = context.exception.results
+        self.assertEqual([r.name if r else None for r in results], ['file0.bin', None, 'file1.bin'])
+
+    def test_extract_attachments(self):
+        paths = self.create_files(3)
+        attachments = Attachment.from_files(paths)
+        # a different attachment with the same name as the first
+        duplicate = create_attachment(name='file0.bin', compression=None)
+        doc = Document(datapoints=[create_datapoint(attachments=attachments[:2]),
+                                   create_datapoint(attachments=[attachments[2], attachments[0], duplicate])])
+        directory = Path(tempfile.mkdtemp()) / 'out'
+        written = doc.extract_attachments(directory, workers=4)
+        self.assertEqual([p.name for p in written[:3]], ['file0.bin', 'file1.bin', 'file2.bin'])
+        self.assertNotEqual(written[3], written[0])
+        self.assertTrue(written[3].name.startswith('file0-'))
+        for path, original in zip(written, paths):
+            self.assertEqual(path.read_bytes(), original.read_bytes())
+        self.assertEqual(written[3].read_bytes(), base64.b64decode(duplicate.content))
+
+
+class TestLazyAttachment(TestCase):
+
+    def create_file(self, content: bytes = b"test" * 1000) -> str:
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(content)
+        return f.name
+
+    def test_matches_eager(self):
+        path = self.create_file()
+        eager = Attachment.from_file(path)
+        lazy = Attachment.from_file(path, lazy=True)
+        self.assertTrue(lazy.is_lazy)
+        self.assertFalse(eager.is_lazy)
+        self.assertNotIn('content', lazy.__dict__)
+        self.assertEqual(lazy.content, eager.content)
+        self.assertEqual(lazy.hash, eager.hash)
+        self.assertEqual(lazy.model_dump_json(), eager.model_dump_json())
+
+    def test_merkle_hash_matches_eager(self):
+        path = self.create_file()
+        with hash_scheme('merkle-md5'):
+            eager = Attachment.from_file(path)
+            lazy = Attachment.from_file(path, lazy=True)
+        self.assertEqual(lazy.hash, eager.hash)
+
+    def test_empty_file(self):
+        path = self.create_file(b'')
+        self.assertEqual(Attachment.from_file(path, lazy=True).hash, Attachment.from_file(path).hash)
+
+    def test_to_file(self):
+        path = self.create_file()
+        lazy = Attachment.from_file(path, lazy=True)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            lazy.to_file(f.name)
+        self.assertEqual(Path(f.name).read_bytes(), b"test" * 1000)
+
+    def test_document_cycle(self):
+        lazy = Attachment.from_file(self.create_file(), lazy=True)
+        d = Document(version="1.0", datapoints=[create_datapoint(attachments=[lazy, create_attachment()])])
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            d.to_json_file(f.name)
+        d2 = Document.from_json_file(f.name, lazy_attachments=True)
+        self.assertEqual(d2.hash, d.hash)
+        loaded = {a.name: a for a in d2.datapoints[0].attachments}
+        self.assertTrue(loaded[lazy.name].is_lazy)
+        self.assertEqual(loaded[lazy.name].content, lazy.content)
+        streamed = list(Document.iter_datapoints(f.name, lazy_attachments=True))
+        self.assertTrue(all(a.is_lazy for a in streamed[0].attachments))
+        # the lazily loaded document can be written out again
+        with tempfile.NamedTemporaryFile(delete=False) as f2:
+            d2.to_json_file(f2.name)
+        self.assertEqual(Document.from_json_file(f2.name).hash, d.hash)
+
+    def test_save_over_own_source(self):
+        d = Document(version="1.0", datapoints=[create_datapoint(attachments=[create_attachment()])])
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            d.to_json_file(f.name)
+        original = Path(f.name).read_bytes()
+        lazy = Document.from_json_file(f.name, lazy_attachments=True)
+        with self.assertRaises(ValueError):
+            lazy.to_json_file(f.name)
+        # the file is left as it was and the lazy attachments can still be read
+        self.assertEqual(Path(f.name).read_bytes(), original)
+        self.assertEqual(Document.from_json_file(f.name).hash, d.hash)
+        self.assertEqual(lazy.datapoints[0].attachments[0].content, d.datapoints[0].attachments[0].content)
+        self.assertEqual([p.name for p in Path(f.name).parent.glob(f'.{Path(f.name).name}.*')], [])
+
+    def test_edited_content_does_not_validate(self):
+        d = Document(version="1.0", datapoints=[create_datapoint(attachments=[create_attachment(content=b'abcd')])])
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            d.to_json_file(f.name)
+        text = Path(f.name).read_text().replace('"abcd"', '"abce"')
+        Path(f.name).write_text(text)
+        with self.assertRaises(ValueError):
+            Document.from_json_file(f.name, lazy_attachments=True)
+
+
 class TestDataPointModel(BaseModelTester, TestCase):
 
     def test_valid_create(self):
@@ -318,6 +744,60 @@ class TestDocumentModel(BaseModelTester, TestCase):
         d = Document(version="1.0", datapoints=[create_datapoint(attachments=[a1, a2]), create_datapoint(attachments=[a2])])
         self.assertIn(a1.hash, [a.hash for a in d.attachments])
 
+    def test_lookups_by_hash(self):
+        e1 = create_equipment(name='Catphan')
+        e2 = create_equipment(name='Ion chamber')
+        u = create_user()
+        a = create_attachment()
+        dp1 = create_datapoint(primary_equipment=e1, ancillary_equipment=[e2], performer=u, reviewer=u, attachments=[a])
+        dp2 = create_datapoint(primary_equipment=e2)
+        d = Document(version="1.0", datapoints=[dp1, dp2])
+        self.assertEqual(d.equipment_by_hash(e1.hash), e1)
+        self.assertEqual(d.equipment_by_hash(e1.named_hash()), e1)
+        self.assertEqual(d.user_by_hash(u.hash), u)
+        self.assertEqual(d.attachment_by_hash(a.hash), a)
+        self.assertEqual(d.datapoints_for_equipment(e1), [dp1])
+        self.assertEqual(d.datapoints_for_equipment(e2.hash), [dp1, dp2])
+        # performer and reviewer of the same datapoint only count once
+        self.assertEqual(d.datapoints_for_user(u), [dp1, dp2])
+        self.assertEqual(d.datapoints_for_attachment(a), [dp1])
+        with self.assertRaises(KeyError):
+            d.equipment_by_hash('not a hash')
+
+    def test_registry_updates(self):
+        e1 = create_equipment(name='Catphan')
+        e2 = create_equipment(name='Ion chamber')
+        d = Document(version="1.0", datapoints=[create_datapoint(primary_equipment=e1)])
+        old_hash = d.hash
+        self.assertEqual(d.equipment, {e1})
+        d.add_datapoints([create_datapoint(primary_equipment=e2)])
+        self.assertEqual(d.equipment, {e1, e2})
+        self.assertNotEqual(d.hash, old_hash)
+        # appending directly is also picked up
+        e3 = create_equipment(name='Linac')
+        d.datapoints.append(create_datapoint(primary_equipment=e3))
+        self.assertEqual(len(d.datapoints_for_equipment(e3)), 1)
+        # as is reassignment
+        d.datapoints = [create_datapoint(primary_equipment=e2)]
+        self.assertEqual(d.equipment, {e2})
+        self.assertEqual(d.datapoints_for_equipment(e1), [])
+
+    def test_registry_rebuilt_after_changes_in_place(self):
+        e1, e2, e3 = create_equipment(name='Catphan'), create_equipment(name='Ion chamber'), create_equipment(name='Linac')
+        d = Document(version="1.0", datapoints=[create_datapoint(primary_equipment=e1)])
+        self.assertEqual(d.equipment, {e1})
+        d.datapoints.insert(0, create_datapoint(primary_equipment=e2))
+        self.assertEqual(d.equipment, {e1, e2})
+        d.datapoints[1] = create_datapoint(primary_equipment=e3)
+        self.assertEqual(d.equipment, {e2, e3})
+        self.assertEqual(d.datapoints_for_equipment(e1), [])
+        self.assertEqual(d.hash, Document(version="1.0", datapoints=list(d.datapoints)).hash)
+        with tempfile.NamedTemporaryFile(suffix='.quaac', delete=False) as f:
+            d.to_binary_file(f.name)
+        loaded = Document.from_binary_file(f.name)
+        self.assertEqual(loaded.hash, d.hash)
+        self.assertEqual({e.hash for e in loaded.equipment}, {e2.hash, e3.hash})
+
     def test_json_cycle(self):
         """Test going to JSON and back again"""
         d = Document(version="1.0", datapoints=[create_datapoint()])
@@ -338,6 +818,66 @@ class TestDocumentModel(BaseModelTester, TestCase):
         d2_data = json.loads(d2.model_dump_json())
         self.assertEqual(d1_data, d2_data)
 
+    def test_yaml_check_hash(self):
+        """An edited YAML file does not validate unless the hash check is turned off"""
+        d = Document(version="1.0", datapoints=[create_datapoint(attachments=[create_attachment()])])
+        with tempfile.NamedTemporaryFile(suffix='.yaml', delete=False) as f:
+            d.to_yaml_file(f.name)
+        self.assertEqual(Document.from_yaml_file(f.name).hash, d.hash)
+        text = Path(f.name).read_text().replace('measurement unit: Gy', 'measurement unit: cGy')
+        Path(f.name).write_text(text)
+        with self.assertRaises(ValueError):
+            Document.from_yaml_file(f.name)
+        self.assertEqual(Document.from_yaml_file(f.name, check_hash=False).datapoints[0].measurement_unit, 'cGy')
+
+    def test_yaml_from_json_dump(self):
+        """YAML files written by earlier versions, as a YAML dump of the JSON document, still load"""
+        d = Document(version="1.0", datapoints=[create_datapoint(attachments=[create_attachment()])])
+        with tempfile.NamedTemporaryFile(suffix='.yaml', mode='w', delete=False) as f:
+            yaml.dump(yaml.safe_load(d.model_dump_json(by_alias=True)), f, sort_keys=False)
+        self.assertEqual(Document.from_yaml_file(f.name).hash, d.hash)
+
+    def test_json_cycle_shared_references(self):
+        """Multiple data points sharing equipment and users should load back with a matching document hash"""
+        users = [create_user(name='Randle'), create_user(name='Johnny')]
+        equipment = [create_equipment(name=f'TB{i}') for i in range(4)]
+        d = Document(version="1.0", datapoints=[create_datapoint(performer=users[i % 2], primary_equipment=e) for i, e in enumerate(equipment)])
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            d.to_json_file(f.name)
+        d2 = Document.from_json_file(f.name)
+        self.assertEqual(d.hash, d2.hash)
+
+    def test_json_resave(self):
+        """A document loaded from JSON can be saved again"""
+        d = Document(version="1.0", datapoints=[create_datapoint(attachments=[create_attachment()])])
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            d.to_json_file(f.name)
+        d2 = Document.from_json_file(f.name)
+        self.assertIsNone(d2.model_extra.get('users'))
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            d2.to_json_file(f.name)
+        self.assertEqual(Document.from_json_file(f.name).hash, d.hash)
+
+    def test_loaded_references_are_shared(self):
+        """Each referenced entry is validated once and shared across the data points that reference it"""
+        e = create_equipment()
+        u = create_user()
+        a = create_attachment()
+        d = Document(version="1.0", datapoints=[create_datapoint(name=f'dp {i}', primary_equipment=e, ancillary_equipment=[e],
+                                                                 performer=u, reviewer=u, attachments=[a]) for i in range(3)])
+        for loader, writer in ((Document.from_json_file, d.to_json_file), (Document.from_yaml_file, d.to_yaml_file)):
+            with tempfile.NamedTemporaryFile(delete=False) as f:
+                writer(f.name)
+            d2 = loader(f.name)
+            first = d2.datapoints[0]
+            for dp in d2.datapoints:
+                self.assertIs(dp.primary_equipment, first.primary_equipment)
+                self.assertIs(dp.ancillary_equipment[0], first.primary_equipment)
+                self.assertIs(dp.performer, first.performer)
+                self.assertIs(dp.reviewer, first.performer)
+                self.assertIs(dp.attachments[0], first.attachments[0])
+            self.assertEqual(len(d2.equipment), 1)
+
     def test_edited_file_does_not_validate(self):
         """Test that if the file is edited it will not validate"""
         d = Document(version="1.0", datapoints=[create_datapoint()])
@@ -375,6 +915,34 @@ class TestDocumentModel(BaseModelTester, TestCase):
         d2 = Document.from_json_file(f.name, check_hash=False)
         self.assertIsInstance(d2, Document)
 
+    def test_iter_datapoints(self):
+        e1 = create_equipment(name='Catphan')
+        e2 = create_equipment(name='Ion chamber')
+        a = create_attachment()
+        dps = [create_datapoint(name=f'dp {i}', primary_equipment=e1, ancillary_equipment=[e2], attachments=[a]) for i in range(5)]
+        d = Document(version="1.0", datapoints=dps)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            d.to_json_file(f.name)
+        streamed = list(Document.iter_datapoints(f.name))
+        self.assertEqual([dp.name for dp in streamed], [dp.name for dp in dps])
+        self.assertEqual([dp.hash for dp in streamed], [dp.hash for dp in dps])
+        self.assertEqual(streamed[0].ancillary_equipment[0].hash, e2.hash)
+        self.assertEqual(streamed[0].attachments[0].content, a.content)
+
+    def test_iter_datapoints_edited_file_does_not_validate(self):
+        d = Document(version="1.0", datapoints=[create_datapoint()])
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            d.to_json_file(f.name)
+        with open(f.name, 'r') as f:
+            data = json.loads(f.read())
+            data['datapoints'][0]['measurement value'] = 2.0
+        with open(f.name, 'w') as f:
+            f.write(json.dumps(data))
+        with self.assertRaises(ValueError):
+            list(Document.iter_datapoints(f.name))
+        # loads if the check is turned off
+        self.assertEqual(len(list(Document.iter_datapoints(f.name, check_hash=False))), 1)
+
     def test_merge_documents(self):
         u = create_user()
         u2 = create_user(name='Randle')
@@ -388,6 +956,14 @@ class TestDocumentModel(BaseModelTester, TestCase):
         self.assertEqual(len(d3.equipment), 1)
         self.assertEqual(len(d3.users), 2)
 
+    def test_merge_drops_duplicates(self):
+        dp1 = create_datapoint(name='test 1')
+        dp2 = create_datapoint(name='test 2')
+        d1 = Document(version="1.0", datapoints=[dp1, dp2])
+        d2 = Document(version="1.0", datapoints=[create_datapoint(name='test 2'), create_datapoint(name='test 3'), dp1])
+        d3 = d1.merge(documents=[d2, d1])
+        self.assertEqual([dp.name for dp in d3.datapoints], ['test 1', 'test 2', 'test 3'])
+
     @skip("Only v 1.0 allowed for now. As versions are added, we'll need to check this.")
     def test_merge_version_must_be_same(self):
         u = create_user()
@@ -396,3 +972,192 @@ class TestDocumentModel(BaseModelTester, TestCase):
         d2 = Document(version="2.0", datapoints=[create_datapoint(name='test2', performer=u2)])
         with self.assertRaises(ValidationError):
             d1.merge(documents=[d2])
+
+
+class TestQuery(TestCase):
+
+    def setUp(self):
+        self.users = [create_user(), create_user(name='Randle')]
+        self.equipment = [create_equipment(), create_equipment(name='TB2', serial_number='5678')]
+        self.datapoints = [create_datapoint(name='output' if i % 2 else 'symmetry', perform_datetime=f'2021-01-{10 - i:02d}T08:00:00',
+                                            performer=self.users[i % 2], primary_equipment=self.equipment[i // 5])
+                           for i in range(10)]
+        self.doc = Document(datapoints=self.datapoints)
+
+    def test_no_filters(self):
+        self.assertEqual(self.doc.query(), self.datapoints)
+
+    def test_name(self):
+        self.assertEqual(self.doc.query(name='output'), self.datapoints[1::2])
+        self.assertEqual(self.doc.query(name='missing'), [])
+
+    def test_equipment_and_performer(self):
+        self.assertEqual(self.doc.query(equipment=self.equipment[1]), self.datapoints[5:])
+        self.assertEqual(self.doc.query(equipment=self.equipment[1].named_hash(), performer=self.users[0].hash),
+                         [self.datapoints[6], self.datapoints[8]])
+
+    def test_datetime_range(self):
+        # the datapoints are in reverse time order; results are in document order
+        self.assertEqual(self.doc.query(since='2021-01-03', until=datetime(2021, 1, 5, 8)), self.datapoints[5:8])
+        self.assertEqual(self.doc.query(since='2021-01-09'), self.datapoints[:2])
+        self.assertEqual(self.doc.query(until='2021-01-01T07:59:59'), [])
+
+    def test_combined(self):
+        self.assertEqual(self.doc.query(name='symmetry', equipment=self.equipment[0], since='2021-01-07'), [self.datapoints[0], self.datapoints[2]])
+
+    def test_naive_and_aware_datetimes(self):
+        # naive datetimes are taken to be UTC
+        doc = Document(datapoints=[create_datapoint(perform_datetime='2021-01-02T08:00:00'),
+                                   create_datapoint(perform_datetime='2021-01-01T08:00:00Z'),
+                                   create_datapoint(perform_datetime='2021-01-02T09:00:00+02:00')])
+        self.assertEqual(doc.query(name='test'), doc.datapoints)
+        self.assertEqual(doc.query(since='2021-01-02T07:00:00Z'), [doc.datapoints[0], doc.datapoints[2]])
+        self.assertEqual(doc.query(since=datetime(2021, 1, 2, 7, 30), until='2021-01-02T08:00:00+00:00'), [doc.datapoints[0]])
+        self.assertEqual(doc.query(until='2021-01-01T09:00:00+01:00'), [doc.datapoints[1]])
+
+    def test_index_updates(self):
+        self.assertEqual(len(self.doc.query(name='output')), 5)
+        new = create_datapoint(name='output', perform_datetime='2021-01-05T12:00:00')
+        self.doc.add_datapoints([new])
+        self.assertEqual(self.doc.query(name='output')[-1], new)
+        self.assertIn(new, self.doc.query(since='2021-01-05T10:00:00', until='2021-01-05T13:00:00'))
+        self.assertEqual(self.doc.query(since='2021-01-05T08:00:00', until='2021-01-05T12:00:00'), [self.datapoints[5], new])
+        self.doc.datapoints = self.datapoints[:2]
+        self.assertEqual(self.doc.query(name='output'), [self.datapoints[1]])
+
+    def test_index_rebuilt_after_changes_in_place(self):
+        self.assertEqual(self.doc.query(name='output'), self.datapoints[1::2])
+        self.doc.datapoints.sort(key=lambda d: d.name)
+        self.assertEqual(self.doc.query(name='output'), self.datapoints[1::2])
+        self.assertEqual(self.doc.query(name='symmetry'), self.doc.datapoints[5:])
+        new = create_datapoint(name='new')
+        self.doc.datapoints.insert(0, new)
+        self.assertEqual(self.doc.query(name='new'), [new])
+        self.assertEqual(self.doc.query(name='output'), self.doc.datapoints[1:6])
+        replacement = create_datapoint(name='replacement')
+        self.doc.datapoints[0] = replacement
+        self.assertEqual(self.doc.query(name='new'), [])
+        self.assertEqual(self.doc.query(name='replacement'), [replacement])
+
+
+class TestTrustedLoad(TestCase):
+
+    def setUp(self):
+        self.doc = Document(site='clinic', datapoints=[
+            create_datapoint(attachments=[create_attachment()], reviewer=create_user(name='Jane'), parameters={'ssd': 100}),
+            create_datapoint(name='tz', perform_datetime='2021-06-01T12:00:00Z', ancillary_equipment=[create_equipment(name='Phantom')]),
+        ])
+        self.directory = Path(tempfile.mkdtemp())
+
+    def test_formats(self):
+        self.doc.to_json_file(str(self.directory / 'doc.json'))
+        self.doc.to_yaml_file(str(self.directory / 'doc.yaml'))
+        self.doc.to_binary_file(self.directory / 'doc.quaac')
+        for loaded in (Document.from_json_file(str(self.directory / 'doc.json'), trusted=True),
+                       Document.from_json_file(str(self.directory / 'doc.json'), trusted=True, lazy_attachments=True),
+                       Document.from_yaml_file(str(self.directory / 'doc.yaml'), trusted=True),
+                       Document.from_binary_file(self.directory / 'doc.quaac', trusted=True)):
+            self.assertEqual(loaded.hash, self.doc.hash)
+            self.assertEqual([d.model_dump(mode='json') for d in loaded.datapoints], [d.model_dump(mode='json') for d in self.doc.datapoints])
+            self.assertEqual(loaded.datapoints[1].perform_datetime, self.doc.datapoints[1].perform_datetime)
+            self.assertEqual(loaded.site, 'clinic')
+            self.assertEqual(len(loaded.equipment), 2)
+
+    def test_reference_tables_are_checked(self):
+        path = str(self.directory / 'doc.json')
+        self.doc.to_json_file(path)
+        with open(path) as f:
+            data = f.read()
+        with open(path, 'w') as f:
+            f.write(data.replace('"Phantom"', '"Edited"'))
+        with self.assertRaises(ValueError):
+            Document.from_json_file(path, trusted=True)
+
+    def test_datapoints_are_not_checked(self):
+        path = str(self.directory / 'doc.json')
+        self.doc.to_json_file(path)
+        with open(path) as f:
+            data = f.read()
+        with open(path, 'w') as f:
+            f.write(data.replace('"name": "tz"', '"name": "edited"'))
+        loaded = Document.from_json_file(path, trusted=True)
+        self.assertEqual(loaded.datapoints[1].name, 'edited')
+        # the stored hash is kept
+        self.assertEqual(loaded.datapoints[1].hash, self.doc.datapoints[1].hash)
+
+
+class TestFromRecords(TestCase):
+
+    def setUp(self):
+        self.defaults = {'primary_equipment': create_equipment(), 'performer': create_user(), 'measurement_unit': 'cGy'}
+        self.rows = [{'name': 'output', 'perform datetime': '2024-01-02T08:00:00', 'measurement_value': '100.2', 'room': 'A'},
+                     {'name': 'output', 'perform_datetime': '2024-01-03T08:00:00', 'measurement_value': '99.8', 'measurement_unit': 'MU'}]
+
+    def test_validated(self):
+        datapoints = DataPoint.from_records(self.rows, **self.defaults)
+        self.assertEqual(datapoints[0].perform_datetime, datetime(2024, 1, 2, 8))
+        self.assertEqual(datapoints[0].measurement_unit, 'cGy')
+        self.assertEqual(datapoints[1].measurement_unit, 'MU')
+        self.assertEqual(datapoints[0].model_extra, {'room': 'A'})
+        self.assertIs(datapoints[1].performer, self.defaults['performer'])
+
+    def test_invalid(self):
+        with self.assertRaises(ValidationError):
+            DataPoint.from_records([{'name': 'output'}], **self.defaults)
+
+    def test_trusted(self):
+        trusted = DataPoint.from_records(self.rows, trusted=True, **self.defaults)
+        validated = DataPoint.from_records(self.rows, **self.defaults)
+        self.assertEqual([d.hash for d in trusted], [d.hash for d in validated])
+        self.assertEqual(Document(datapoints=trusted).hash, Document(datapoints=validated).hash)
+
+
+class TestLoadMany(TestCase):
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        attachment = create_attachment()
+        self.docs = [Document(datapoints=[create_datapoint(name=f'dp {i}', measurement_value=j, attachments=[attachment]) for j in range(3)])
+                     for i in range(4)]
+        self.docs[0].to_json_file(self.directory / '0.json')
+        self.docs[1].to_yaml_file(self.directory / '1.yaml')
+        self.docs[2].to_binary_file(self.directory / '2.quaac')
+        self.docs[3].to_json_file(self.directory / '3.json')
+        self.paths = [self.directory / name for name in ('0.json', '1.yaml', '2.quaac', '3.json')]
+
+    def test_load_many(self):
+        for workers in (1, 2):
+            documents = Document.load_many(self.paths, workers=workers)
+            self.assertEqual([d.hash for d in documents], [d.hash for d in self.docs])
+
+    def test_merge(self):
+        # the first file is loaded twice, but its data points are only merged once
+        merged = Document.load_many([*self.paths, self.paths[0]], workers=2, merge=True)
+        self.assertEqual(merged.hash, self.docs[0].merge(self.docs[1:]).hash)
+        self.assertEqual(len(merged.datapoints), 12)
+        self.assertEqual(Document.load_many([], merge=True).datapoints, [])
+
+    def test_lazy_attachments(self):
+        # the attachments of JSON files are sent back from the workers as references to the file, not content
+        documents = Document.load_many(self.paths, workers=2)
+        attachment = documents[0].datapoints[0].attachments[0]
+        self.assertTrue(attachment.is_lazy)
+        self.assertNotIn('content', attachment.__dict__)
+        self.assertEqual(attachment.content, self.docs[0].datapoints[0].attachments[0].content)
+        self.assertTrue(documents[3].datapoints[0].attachments[0].is_lazy)
+        self.assertFalse(documents[1].datapoints[0].attachments[0].is_lazy)
+        self.assertEqual(documents[3].hash, self.docs[3].hash)
+        documents = Document.load_many(self.paths[:1], workers=2, lazy_attachments=False)
+        self.assertIn('content', documents[0].datapoints[0].attachments[0].__dict__)
+
+    def test_edited_file(self):
+        with open(self.paths[3]) as f:
+            data = json.load(f)
+        data['datapoints'][1]['measurement value'] = 5
+        with open(self.paths[3], 'w') as f:
+            json.dump(data, f)
+        with self.assertRaisesRegex(ValueError, '3.json'):
+            Document.load_many(self.paths, workers=2)
+        self.assertEqual(len(Document.load_many(self.paths, workers=2, check_hash=False)), 4)
+        documents = Document.load_many(self.paths, workers=2, check_hash='deferred')
+        self.assertEqual(len(documents[3].verify().mismatches), 2)
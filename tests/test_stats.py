@@ -0,0 +1,94 @@
+import io
+import os
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from quaac import Attachment, Document
+from quaac.stats import PHASES, PhaseStats, collect_stats, get_stats, phase
+from tests.test_models import create_attachment, create_datapoint
+
+
+class TestStats(TestCase):
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        attachment = create_attachment()
+        self.doc = Document(datapoints=[create_datapoint(name=f'dp {i}', attachments=[attachment] if i % 2 else []) for i in range(6)])
+
+    def test_disabled(self):
+        self.assertIsNone(get_stats())
+        with phase('load.read') as p:
+            p.add(objects=1, bytes=10)
+            self.assertEqual(list(p.counted([b'ab'])), [b'ab'])
+        with collect_stats() as stats:
+            self.assertIs(get_stats(), stats)
+        self.assertIsNone(get_stats())
+        self.assertEqual(stats.phases, {})
+
+    def test_load(self):
+        path = self.directory / 'doc.json'
+        self.doc.to_json_file(path)
+        with collect_stats() as stats:
+            Document.from_json_file(path)
+        self.assertEqual(stats['load.read'].bytes, path.stat().st_size)
+        self.assertEqual(stats['load.validate'].objects, 6)
+        self.assertEqual(stats['load.references'].objects, 3)
+        # at least the equipment, user, attachment, data points, and document. Shared entries are checked again
+        # by pydantic as each data point is validated, but their hashes are cached
+        self.assertGreaterEqual(stats['hash.check'].objects, 10)
+        self.assertTrue(set(stats.phases) <= set(PHASES))
+
+    def test_load_yaml_trusted(self):
+        path = self.directory / 'doc.yaml'
+        self.doc.to_yaml_file(path)
+        with collect_stats() as stats:
+            Document.from_yaml_file(path, trusted=True)
+        self.assertEqual(stats['load.parse'].bytes, path.stat().st_size)
+        self.assertEqual(stats['load.validate'].objects, 6)
+        # only the reference tables are checked
+        self.assertEqual(stats['hash.check'].objects, 3)
+
+    def test_dump(self):
+        path = self.directory / 'doc.json'
+        with collect_stats() as stats:
+            self.doc.to_json_file(path)
+        self.assertEqual(stats['dump.datapoints'].objects, 6)
+        self.assertEqual(stats['dump.datapoints'].calls, 6)
+        self.assertEqual(stats['dump.tables'].objects, 3)
+        self.assertEqual(stats['dump.tables'].bytes, path.stat().st_size)
+        self.assertEqual(stats['dump.hash'].calls, 1)
+
+    def test_merge(self):
+        with collect_stats() as stats:
+            self.doc.merge([self.doc])
+        self.assertEqual(stats['merge'].objects, 12)
+
+    def test_attachments(self):
+        content = os.urandom(1000)
+        source = self.directory / 'image.png'
+        source.write_bytes(content)
+        with collect_stats() as stats:
+            attachment = Attachment.from_stream(io.BytesIO(content), name='image.png')
+            attachment.to_file(str(self.directory / 'out.png'))
+            # files loaded in the thread pool are recorded too
+            Attachment.from_files([source, source], workers=2)
+        self.assertEqual(stats['attachment.encode'].objects, 3)
+        self.assertEqual(stats['attachment.encode'].bytes, 3000)
+        self.assertEqual(stats['attachment.decode'].bytes, 1000)
+
+    def test_callback(self):
+        runs = []
+        with collect_stats(callback=lambda name, run: runs.append((name, run))):
+            self.doc.merge([])
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(runs[0][0], 'merge')
+        self.assertEqual(runs[0][1].calls, 1)
+        self.assertIsInstance(runs[0][1], PhaseStats)
+
+    def test_report(self):
+        with collect_stats() as stats:
+            self.doc.to_json_file(self.directory / 'doc.json')
+        report = stats.report()
+        self.assertIn('dump.datapoints', report)
+        self.assertEqual(len(report.splitlines()), len(stats.phases) + 1)
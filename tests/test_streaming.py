@@ -0,0 +1,188 @@
+import io
+import json
+import os
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from quaac import Document
+from quaac.streaming import DocumentWriter, JSONStreamReader, merge_datapoints
+from tests.test_models import create_attachment, create_datapoint, create_equipment, create_user
+
+
+class TestJSONStreamReader(TestCase):
+
+    def reader(self, data, chunk_size: int = 3) -> JSONStreamReader:
+        return JSONStreamReader(io.StringIO(json.dumps(data, indent=2)), chunk_size=chunk_size)
+
+    def test_iter_object(self):
+        data = {'a': 1, 'b': 'text', 'c': [1, 2], 'd': {'e': None}}
+        reader = self.reader(data)
+        result = {key: reader.decode_value() for key in reader.iter_object()}
+        self.assertEqual(result, data)
+
+    def test_iter_array(self):
+        data = {'items': [{'x': i, 'y': 'z' * 50} for i in range(10)]}
+        reader = self.reader(data)
+        for key in reader.iter_object():
+            self.assertEqual(list(reader.iter_array()), data['items'])
+
+    def test_skip_value(self):
+        data = {'skip': [[1, 2], {'a': [3]}, 12345678], 'keep': 123456789}
+        reader = self.reader(data)
+        result = {}
+        for key in reader.iter_object():
+            if key == 'skip':
+                reader.skip_value()
+            else:
+                result[key] = reader.decode_value()
+        self.assertEqual(result, {'keep': 123456789})
+
+    def test_empty_containers(self):
+        reader = self.reader({'a': [], 'b': {}})
+        for key in reader.iter_object():
+            if key == 'a':
+                self.assertEqual(list(reader.iter_array()), [])
+            else:
+                self.assertEqual(list(reader.iter_object()), [])
+
+    def test_invalid_json(self):
+        reader = JSONStreamReader(io.StringIO('{"a": [1, 2}'))
+        with self.assertRaises(ValueError):
+            for _ in reader.iter_object():
+                list(reader.iter_array())
+
+
+class TestDocumentWriter(TestCase):
+
+    def datapoints(self) -> list:
+        users = [create_user(name='Johnny'), create_user(name='Randle')]
+        equipment = [create_equipment(name='TB1'), create_equipment(name='TB2'), create_equipment(name='Catphan')]
+        attachment = create_attachment()
+        return [create_datapoint(name=f'dp {i}', performer=users[i % 2], reviewer=users[(i + 1) % 2],
+                                 primary_equipment=equipment[i % 2], ancillary_equipment=[equipment[2]],
+                                 attachments=[attachment] if i % 3 else []) for i in range(7)]
+
+    def test_json(self):
+        datapoints = self.datapoints()
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            with DocumentWriter(f.name) as writer:
+                for dp in datapoints:
+                    writer.write(dp)
+        doc = Document.from_json_file(f.name)
+        self.assertEqual(doc.hash, Document(datapoints=datapoints).hash)
+        self.assertEqual([dp.hash for dp in doc.datapoints], [dp.hash for dp in datapoints])
+        self.assertEqual(len({e.hash for e in doc.equipment}), 3)
+        self.assertEqual(len({u.hash for u in doc.users}), 2)
+        self.assertEqual(len({a.hash for a in doc.attachments}), 1)
+
+    def test_yaml(self):
+        datapoints = self.datapoints()
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            with DocumentWriter(f.name, format='yaml') as writer:
+                writer.write_many(datapoints)
+        doc = Document.from_yaml_file(f.name)
+        self.assertEqual(doc.hash, Document(datapoints=datapoints).hash)
+
+    def test_compact_json_with_extras(self):
+        datapoints = self.datapoints()
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            with DocumentWriter(f.name, indent=None, pylinac_version='3.20') as writer:
+                writer.write_many(datapoints)
+        doc = Document.from_json_file(f.name)
+        self.assertEqual(doc.pylinac_version, '3.20')
+        self.assertEqual(doc.hash, Document(datapoints=datapoints, pylinac_version='3.20').hash)
+
+    def test_empty(self):
+        for format in ('json', 'yaml'):
+            with tempfile.NamedTemporaryFile(delete=False) as f:
+                with DocumentWriter(f.name, format=format):
+                    pass
+            loader = Document.from_json_file if format == 'json' else Document.from_yaml_file
+            self.assertEqual(loader(f.name).datapoints, [])
+
+    def test_bad_format(self):
+        with self.assertRaises(ValueError):
+            DocumentWriter('doc.xml', format='xml')
+
+
+class TestMerge(TestCase):
+
+    def datapoints(self, days: list, name: str = 'output') -> list:
+        user = create_user()
+        equipment = create_equipment()
+        return [create_datapoint(name=name, perform_datetime=f'2021-01-{day:02d}T08:00:00', performer=user, primary_equipment=equipment)
+                for day in days]
+
+    def write(self, datapoints: list) -> str:
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            Document(datapoints=datapoints).to_json_file(f.name)
+        return f.name
+
+    def test_merge_datapoints(self):
+        first = self.datapoints([1, 3, 5])
+        second = self.datapoints([2, 3, 4])
+        third = self.datapoints([3], name='symmetry')
+        merged = list(merge_datapoints(first, second, third))
+        self.assertEqual([(dp.perform_datetime.day, dp.name) for dp in merged],
+                         [(1, 'output'), (2, 'output'), (3, 'output'), (3, 'symmetry'), (4, 'output'), (5, 'output')])
+        self.assertIs(merged[2], first[1])
+
+    def test_naive_and_aware_datetimes(self):
+        # naive datetimes are taken to be UTC
+        first = [create_datapoint(perform_datetime='2021-01-01T08:00:00'), create_datapoint(perform_datetime='2021-01-01T10:00:00Z')]
+        second = [create_datapoint(perform_datetime='2021-01-01T09:00:00+00:00'), create_datapoint(perform_datetime='2021-01-01T12:00:00+01:00')]
+        merged = list(merge_datapoints(first, second))
+        self.assertEqual(merged, [first[0], second[0], first[1], second[1]])
+
+    def test_unordered_source(self):
+        with self.assertRaises(ValueError):
+            list(merge_datapoints(self.datapoints([1, 3]), self.datapoints([4, 2])))
+
+    def test_merge_files(self):
+        attachment = create_attachment()
+        first = self.datapoints([1, 2, 3])
+        second = self.datapoints([2, 3, 4]) + [create_datapoint(perform_datetime='2021-01-05T00:00:00', attachments=[attachment])]
+        paths = [self.write(first), self.write(second), self.write(first)]
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            count = Document.merge_files(paths, f.name)
+        self.assertEqual(count, 5)
+        doc = Document.from_json_file(f.name)
+        self.assertEqual([dp.perform_datetime.day for dp in doc.datapoints], [1, 2, 3, 4, 5])
+        self.assertEqual(doc.hash, Document(datapoints=first + second[2:]).hash)
+        self.assertEqual(doc.datapoints[-1].attachments[0].content, attachment.content)
+
+    def test_merge_yaml_files(self):
+        attachment = create_attachment()
+        first = self.datapoints([1, 3])
+        second = self.datapoints([2, 3]) + [create_datapoint(perform_datetime='2021-01-05T00:00:00', attachments=[attachment])]
+        with tempfile.NamedTemporaryFile(suffix='.yaml', delete=False) as f:
+            Document(datapoints=second).to_yaml_file(f.name)
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as output:
+            count = Document.merge_files([self.write(first), f.name], output.name)
+        self.assertEqual(count, 4)
+        doc = Document.from_json_file(output.name)
+        self.assertEqual([dp.perform_datetime.day for dp in doc.datapoints], [1, 2, 3, 5])
+        self.assertEqual(doc.datapoints[-1].attachments[0].content, attachment.content)
+
+    def test_merge_unsupported_files(self):
+        with tempfile.NamedTemporaryFile(suffix='.quaac', delete=False) as f:
+            Document(datapoints=self.datapoints([1])).to_binary_file(f.name)
+        with self.assertRaisesRegex(ValueError, 'Only JSON'):
+            Document.merge_files([self.write(self.datapoints([2])), f.name], f.name + '.json')
+        self.assertFalse(os.path.exists(f.name + '.json'))
+
+    def test_failed_merge_keeps_output(self):
+        paths = [self.write(self.datapoints([1, 3])), self.write(self.datapoints([4, 2]))]
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / 'merged.json'
+            output.write_text('previous')
+            with self.assertRaises(ValueError):
+                Document.merge_files(paths, output)
+            self.assertEqual(output.read_text(), 'previous')
+            self.assertEqual(os.listdir(directory), ['merged.json'])
+
+    def test_merge_files_into_input(self):
+        path = self.write(self.datapoints([1]))
+        with self.assertRaises(ValueError):
+            Document.merge_files([path], path)